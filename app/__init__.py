@@ -16,6 +16,7 @@ except Exception:
 
 
 def create_app():
+    from app import sqlite_profile
     # Asegurar que Flask pueda encontrar las plantillas y assets dentro del paquete `app/`
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
     app_pkg_dir = os.path.join(base_dir, 'app')
@@ -43,6 +44,44 @@ def create_app():
     app.config.setdefault('MAX_CONTENT_LENGTH', 2 * 1024 * 1024)
     # CSRF config (Flask-WTF)
     app.config.setdefault('WTF_CSRF_ENABLED', True)
+    # Cola de envíos (ver app/outbox.py y scripts/delivery_worker.py)
+    app.config.setdefault('OUTBOX_BATCH_SIZE', 100)
+    app.config.setdefault('OUTBOX_LEASE_SECONDS', 60)
+    app.config.setdefault('OUTBOX_MAX_INTENTOS', 5)
+    app.config.setdefault('OUTBOX_BACKOFF_BASE', 30)
+    # Reparto por prioridad (alta/media/baja) y segundos tras los que una entrega pasa delante
+    app.config.setdefault('OUTBOX_PESOS', {'alta': 6, 'media': 3, 'baja': 1})
+    app.config.setdefault('OUTBOX_ENVEJECIMIENTO', 600)
+    # Transporte por modalidad: 'log', 'memoria', 'smtp' o 'smpp' (ver app/transports.py)
+    app.config.setdefault('DELIVERY_TRANSPORTS', {'correo': 'log', 'sms': 'log'})
+    # Mensajes por ventana en la bandeja de inicio
+    app.config.setdefault('HOME_PAGE_SIZE', 20)
+    # Programador de campañas (ver app/scheduler.py y scripts/campaign_scheduler.py)
+    app.config.setdefault('CAMPAIGN_CHUNK', 1000)
+    app.config.setdefault('CAMPAIGN_MAX_RETRASO_HORAS', 24)
+    # Segundos máximos que un proceso tarda en ver un cambio de Settings (ver app/settings_cache.py)
+    app.config.setdefault('SETTINGS_CACHE_SEGUNDOS', 2.0)
+    # Método de hash de contraseñas en formato Werkzeug (ver app/passwords.py y scripts/bench_password_hash.py)
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Pool de procesos para verificar contraseñas (ver app/password_pool.py); 0 = en el propio hilo
+    app.config.setdefault('PASSWORD_POOL_WORKERS', 2)
+    app.config.setdefault('PASSWORD_POOL_MAX_PENDIENTES', 8)
+    app.config.setdefault('PASSWORD_POOL_TIMEOUT', 5.0)
+    # Perfil de producción de SQLite: WAL y pragmas por conexión; None lo desactiva (ver app/sqlite_profile.py)
+    app.config.setdefault('SQLITE_PRAGMAS', sqlite_profile.DEFAULT_PRAGMAS)
+    # Pool de conexiones por proceso: debe cubrir los hilos que usan la base de datos
+    app.config.setdefault('SQLITE_POOL_SIZE', 10)
+    app.config.setdefault('SQLITE_POOL_OVERFLOW', 10)
+    app.config.setdefault('SQLITE_POOL_TIMEOUT', 10)
+    # Alta masiva de usuarios (ver app/user_import.py): filas por transacción, procesos para
+    # las contraseñas y tamaño máximo del fichero subido a /admin/users/import
+    app.config.setdefault('USER_IMPORT_LOTE', 1000)
+    app.config.setdefault('USER_IMPORT_WORKERS', 2)
+    app.config.setdefault('USER_IMPORT_MAX_BYTES', 64 * 1024 * 1024)
+    # Réplica de lectura: None = el mismo fichero SQLite en sólo lectura; una URI; False = sin réplica
+    app.config.setdefault('READ_REPLICA_URI', None)
+    if sqlite_profile.es_fichero_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', sqlite_profile.opciones_engine(app.config))
     # Ensure there is a CSRF secret available (Flask-WTF may require it). Prefer explicit config, else use SECRET_KEY.
     if not app.config.get('WTF_CSRF_SECRET_KEY'):
         app.config['WTF_CSRF_SECRET_KEY'] = app.config.get('SECRET_KEY')
@@ -57,8 +96,12 @@ def create_app():
     app.config.setdefault('SESSION_COOKIE_SECURE', os.environ.get('SESSION_COOKIE_SECURE', 'False') == 'True')
 
     # Usar modelos desde app.models
-    from app.models import db, Usuario, Settings
+    from app.models import db, Usuario, Settings, VersionAjustes
     db.init_app(app)
+    sqlite_profile.init_app(app, db)
+    # Réplica de lectura para las vistas de consulta pesadas (ver app/replica.py)
+    from app import replica
+    replica.init_app(app, db)
     # Inicializar CSRF protection si está disponible
     try:
         csrf = CSRFProtect()
@@ -71,6 +114,10 @@ def create_app():
     with app.app_context():
         db.create_all()
 
+        # Resumen diario de estadísticas: se rellena la primera vez a partir de los datos existentes
+        from app import stats
+        stats.asegurar_resumen()
+
         # Crear admin por defecto (si no existe) - sólo si NO hay variable de entorno ADMIN_PASSWORD
         admin = Usuario.query.filter_by(username='admin').first()
         if not admin:
@@ -91,6 +138,9 @@ def create_app():
                          default_page='home', max_concurrent=5, maintenance=False, maintenance_message='')
             db.session.add(s)
             db.session.commit()
+        if db.session.get(VersionAjustes, 1) is None:
+            db.session.add(VersionAjustes(id=1, version=0))
+            db.session.commit()
 
     # Registrar blueprints
     from app.routes import main_bp
@@ -124,14 +174,20 @@ def create_app():
     except Exception:
         pass
 
+    # Estáticos con huella, /healthz y /favicon.ico sin pasar por la base de datos
+    from app import static_assets
+    static_assets.init_app(app)
+
     # Middleware: redirigir a página de mantenimiento si está activo y el usuario no es admin
     @app.before_request
     def check_maintenance():
         # permitir acceso a recursos estáticos, al propio endpoint de mantenimiento y a rutas admin para administradores
+        if static_assets.es_ligera():
+            return None
         try:
-            # Evitar usar la base de datos repetidamente si no es necesario
-            from app.models import Settings
-            s = Settings.query.first()
+            # Ajustes desde la caché del proceso: sin consulta en el camino habitual
+            from app.settings_cache import ajustes
+            s = ajustes()
             if s and s.maintenance:
                 # permisos: permitir si es admin
                 if session.get('logged_in') and session.get('role') == 'admin':
@@ -161,10 +217,10 @@ def create_app():
                         return '#'
                 return '#'
 
-        # Añadir variables globales desde Settings para que las plantillas reflejen cambios inmediatamente
-        from app.models import Settings
+        # Añadir variables globales desde Settings (caché del proceso, ver app/settings_cache.py)
+        from app.settings_cache import ajustes
         def global_settings():
-            s = Settings.query.first()
+            s = ajustes()
             return {
                 'system_name': (s.system_name if s and s.system_name else 'Mensajería Masiva'),
                 'support_email': (s.support_email if s and s.support_email else 'etecsa.ayuda@nauta.com.cu'),
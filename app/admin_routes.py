@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
 from app.models import Usuario, Settings, Campaña, Grupo, Mensaje, db
 from functools import wraps
 from datetime import datetime, timedelta
-import json
 from sqlalchemy.exc import IntegrityError
 from app.forms import AddUserForm, CampaignForm
+from app.scheduler import registrar_cambio, cancelar_campaña
+from app import stats, membership, campaign_groups, user_import
+from app import campaigns as campaigns_list
+from app.settings_cache import marcar_cambio
+from app.replica import solo_lectura
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -28,6 +32,7 @@ def admin():
 
 
 @admin_bp.route('/admin/dashboard')
+@solo_lectura
 def admin_dashboard():
     if session.get('logged_in') and session.get('role') == 'admin':
         # Estadísticas básicas
@@ -54,21 +59,11 @@ def admin_dashboard():
         # ordenar por fecha descendente y limitar
         latest_activity = sorted(latest_activity, key=lambda x: x.get('created_at') or datetime.utcnow(), reverse=True)[:8]
 
-        # Series de actividad últimos 7 días (mensajes y campañas)
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        labels = []
-        messages_series = []
-        campaigns_series = []
-        for i in range(6, -1, -1):
-            day_start = today - timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            labels.append(day_start.strftime('%Y-%m-%d'))
-            mcount = Mensaje.query.filter(Mensaje.fecha_envio >= day_start, Mensaje.fecha_envio < day_end).count()
-            ccount = Campaña.query.filter(Campaña.date >= day_start, Campaña.date < day_end).count()
-            messages_series.append(mcount)
-            campaigns_series.append(ccount)
-
-        return render_template('admin/admin_dashboard.html', admin_user=session.get('username'), usuarios_count=usuarios_count, mensajes_count=mensajes_count, grupos_count=grupos_count, latest_activity=latest_activity, activity_labels=labels, activity_messages=messages_series, activity_campaigns=campaigns_series)
+        # Series de actividad de los últimos N días (7/30/90): una consulta GROUP BY por tabla
+        dias = stats.rango_dias(request.args.get('dias'))
+        labels, messages_series, campaigns_series = stats.serie_actividad(dias)
+
+        return render_template('admin/admin_dashboard.html', admin_user=session.get('username'), usuarios_count=usuarios_count, mensajes_count=mensajes_count, grupos_count=grupos_count, latest_activity=latest_activity, activity_labels=labels, activity_messages=messages_series, activity_campaigns=campaigns_series, activity_days=dias, activity_ranges=stats.RANGOS_DIAS)
     flash("Debe iniciar sesión como administrador", "error")
     return redirect(url_for('main.login'))
 
@@ -146,6 +141,37 @@ def add_user():
     return redirect(url_for('main.login'))
 
 
+@admin_bp.route('/admin/users/import', methods=['POST'], endpoint='import_users')
+@require_admin
+def import_users():
+    # límite propio para el fichero (MAX_CONTENT_LENGTH es para formularios normales)
+    request.max_content_length = current_app.config.get('USER_IMPORT_MAX_BYTES')
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        flash('Selecciona un fichero CSV o JSONL', 'error')
+        return redirect(url_for('admin.admin_users'))
+    formato = request.form.get('formato') or user_import.formato_de(archivo.filename, por_defecto=None)
+    if formato not in user_import.FORMATOS:
+        flash('Formato no soportado (csv o jsonl)', 'error')
+        return redirect(url_for('admin.admin_users'))
+    informe = user_import.importar(archivo.stream, formato,
+                                   lote=current_app.config.get('USER_IMPORT_LOTE', user_import.DEFAULT_LOTE),
+                                   workers=current_app.config.get('USER_IMPORT_WORKERS', 0))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(informe.a_dict()), 400 if informe.detenido else 200
+    if informe.detenido:
+        flash('Importación detenida: %s. Se guardaron %d usuarios de las líneas anteriores.' % (
+            informe.detenido, informe.creados), 'error')
+        return redirect(url_for('admin.admin_users'))
+    flash('Importación: %d usuarios creados, %d duplicados, %d filas no válidas (%d filas, %.0f filas/s)' % (
+        informe.creados, informe.duplicados, informe.invalidas, informe.filas, informe.filas_por_segundo),
+        'success' if informe.creados else 'error')
+    if informe.errores:
+        flash('; '.join('línea %d: %s' % e for e in informe.errores[:10]) +
+              (' ...' if informe.duplicados + informe.invalidas > 10 else ''), 'error')
+    return redirect(url_for('admin.admin_users'))
+
+
 @admin_bp.route('/admin/users/<int:user_id>/edit', methods=['GET', 'POST'])
 def edit_user(user_id):
     if not (session.get('logged_in') and session.get('role') == 'admin'):
@@ -170,6 +196,9 @@ def delete_user(user_id):
         flash("Acceso denegado", "error")
         return redirect(url_for('main.login'))
     user = Usuario.query.get_or_404(user_id)
+    # bajas explícitas para que los contadores de miembros de sus grupos se ajusten
+    membership.quitar_usuario(user.id)
+    db.session.expire(user, ['grupos'])
     db.session.delete(user)
     db.session.commit()
     flash("Usuario eliminado correctamente", "success")
@@ -181,45 +210,21 @@ def admin_campaigns():
     if not (session.get('logged_in') and session.get('role') == 'admin'):
         flash("Debe iniciar sesión como administrador", "error")
         return redirect(url_for('main.login'))
-    campaigns = Campaña.query.order_by(Campaña.date.desc()).all()
-    groups = Grupo.query.order_by(Grupo.nombre).all()
+    now = datetime.utcnow()
+    # Conteos de la cabecera en una sola consulta agregada
+    total_count, active_count, scheduled_count = campaigns_list.resumen(now)
 
-    # Mapear campaign.id -> lista de nombres de grupos objetivo
-    campaign_targets = {}
-    for c in campaigns:
-        tg = []
-        if getattr(c, 'target_groups', None):
-            try:
-                gids = json.loads(c.target_groups)
-                if isinstance(gids, (list, tuple)):
-                    for gid in gids:
-                        try:
-                            g = Grupo.query.get(int(gid))
-                            if g:
-                                tg.append(g.nombre)
-                        except Exception:
-                            continue
-            except Exception:
-                tg = []
-        campaign_targets[c.id] = tg
+    # Página de campañas filtrada (paginación por clave, ver app/campaigns.py)
+    filtros = campaigns_list.parse_filtros(request.args)
+    campaigns, next_cursor = campaigns_list.pagina(filtros, cursor=request.args.get('cursor'), now=now)
+    groups = Grupo.query.order_by(Grupo.nombre).all()
 
-    # Conteos: activos y programados
-    now = datetime.utcnow()
-    active_count = 0
-    scheduled_count = 0
-    for c in campaigns:
-        try:
-            if getattr(c, 'active', True):
-                active_count += 1
-        except Exception:
-            active_count += 1
-        try:
-            if getattr(c, 'date', None) and c.date > now:
-                scheduled_count += 1
-        except Exception:
-            pass
+    # Mapear campaign.id -> lista de nombres de grupos objetivo (una sola consulta)
+    campaign_targets = campaign_groups.nombres_por_campaña([c.id for c in campaigns])
 
-    return render_template('admin/admin_campaigns.html', campaigns=campaigns, groups=groups, campaign_targets=campaign_targets, active_count=active_count, scheduled_count=scheduled_count)
+    return render_template('admin/admin_campaigns.html', campaigns=campaigns, groups=groups, campaign_targets=campaign_targets,
+                           total_count=total_count, active_count=active_count, scheduled_count=scheduled_count,
+                           filtros=filtros, next_cursor=next_cursor, is_first_page=not request.args.get('cursor'))
 
 
 @admin_bp.route('/admin/campaigns', methods=['POST'], endpoint='admin_campaigns_add')
@@ -236,16 +241,8 @@ def admin_campaigns_add():
         priority = 'baja'
     # grupos seleccionados (multiple select)
     selected_groups = request.form.getlist('groups') or []
-    # normalizar a ints válidos
-    valid_group_ids = []
-    for g in selected_groups:
-        try:
-            gid = int(g)
-            # validar existencia
-            if Grupo.query.get(gid):
-                valid_group_ids.append(gid)
-        except Exception:
-            continue
+    # normalizar a ints (la existencia se valida al guardar, con una sola consulta)
+    group_ids = membership.parse_ids(selected_groups)
 
     # Validación básica
     if not name or not message:
@@ -259,8 +256,11 @@ def admin_campaigns_add():
     try:
         # Por defecto crear campañas INACTIVAS; permitir activarlas en el formulario con 'active_now'
         active_flag = True if (request.form.get('active_now') in ('on', '1', 'true')) else False
-        nueva = Campaña(name=name, message=message, target_groups=json.dumps(valid_group_ids) if valid_group_ids else None, priority=priority, active=active_flag)
+        nueva = Campaña(name=name, message=message, priority=priority, active=active_flag)
         db.session.add(nueva)
+        db.session.flush()
+        campaign_groups.establecer(nueva.id, group_ids)
+        registrar_cambio(nueva.id)
         db.session.commit()
         flash("Campaña creada", "success")
     except Exception as e:
@@ -279,6 +279,7 @@ def edit_campaign(campaign_id):
     if request.method == 'POST':
         campaña.name = request.form.get('campaign_name')
         campaña.message = request.form.get('campaign_message')
+        registrar_cambio(campaña.id)
         db.session.commit()
         flash("Campaña actualizada correctamente", "success")
         return redirect(url_for('admin.admin_campaigns'))
@@ -291,6 +292,9 @@ def delete_campaign(campaign_id):
         flash("Acceso denegado", "error")
         return redirect(url_for('main.login'))
     campaña = Campaña.query.get_or_404(campaign_id)
+    cancelar_campaña(campaña.id)
+    campaign_groups.quitar_campaña(campaña.id)
+    registrar_cambio(campaña.id)
     db.session.delete(campaña)
     db.session.commit()
     flash("Campaña eliminada correctamente", "success")
@@ -314,6 +318,9 @@ def delete_campaign_simple():
         return redirect(url_for('admin.admin_campaigns'))
     campaña = Campaña.query.get_or_404(campaign_id)
     try:
+        cancelar_campaña(campaña.id)
+        campaign_groups.quitar_campaña(campaña.id)
+        registrar_cambio(campaña.id)
         db.session.delete(campaña)
         db.session.commit()
         flash('Campaña eliminada correctamente', 'success')
@@ -332,6 +339,7 @@ def toggle_campaign(campaign_id):
     # Alternar la bandera active (si no existe la columna en BD, esto puede fallar hasta ejecutar el script de migración)
     try:
         campaña.active = not (getattr(campaña, 'active', True))
+        registrar_cambio(campaña.id)
         db.session.commit()
         flash("Campaña activada" if campaña.active else "Campaña desactivada", "success")
     except Exception as e:
@@ -371,6 +379,7 @@ def schedule_campaign(campaign_id):
                 pass
 
         campaña.date = dt
+        registrar_cambio(campaña.id)
         db.session.commit()
         flash('Campaña programada correctamente', 'success')
     except ValueError:
@@ -416,6 +425,7 @@ def schedule_campaign_simple():
             except Exception:
                 pass
         campaña.date = dt
+        registrar_cambio(campaña.id)
         db.session.commit()
         flash('Campaña programada correctamente', 'success')
     except ValueError:
@@ -427,24 +437,25 @@ def schedule_campaign_simple():
 
 
 @admin_bp.route('/admin/reports')
+@solo_lectura
 def admin_reports():
     if session.get('logged_in') and session.get('role') == 'admin':
         # Estadísticas principales
         usuarios_count = Usuario.query.count()
-        mensajes_count = Mensaje.query.count()
+        mensajes_count = stats.total(stats.TIPO_MENSAJE)
         grupos_count = Grupo.query.count()
 
-        # Cambio relativo en los últimos 30 días vs los 30 días anteriores
-        now = datetime.utcnow()
-        last_30_start = now - timedelta(days=30)
-        prev_30_start = now - timedelta(days=60)
+        # Cambio relativo en los últimos 30 días vs los 30 días anteriores (desde el resumen diario)
+        hoy = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        last_30_start = hoy - timedelta(days=29)
+        prev_30_start = hoy - timedelta(days=59)
 
         # Usuarios: no hay fecha de creación en Usuario, no es posible calcular cambio preciso
         usuarios_change = 0
 
         # Mensajes
-        mensajes_recent = Mensaje.query.filter(Mensaje.fecha_envio >= last_30_start).count()
-        mensajes_prev = Mensaje.query.filter(Mensaje.fecha_envio >= prev_30_start, Mensaje.fecha_envio < last_30_start).count()
+        mensajes_recent = stats.total(stats.TIPO_MENSAJE, desde=last_30_start)
+        mensajes_prev = stats.total(stats.TIPO_MENSAJE, desde=prev_30_start, hasta=last_30_start)
         mensajes_change = 0
         try:
             if mensajes_prev > 0:
@@ -457,19 +468,9 @@ def admin_reports():
         # Grupos: no hay fecha en Grupo
         grupos_change = 0
 
-        # Actividad reciente: series para últimos 7 días (mensajes y campañas)
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        labels = []
-        messages_series = []
-        campaigns_series = []
-        for i in range(6, -1, -1):
-            day_start = today - timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            labels.append(day_start.strftime('%Y-%m-%d'))
-            mcount = Mensaje.query.filter(Mensaje.fecha_envio >= day_start, Mensaje.fecha_envio < day_end).count()
-            ccount = Campaña.query.filter(Campaña.date >= day_start, Campaña.date < day_end).count()
-            messages_series.append(mcount)
-            campaigns_series.append(ccount)
+        # Actividad reciente: series de los últimos N días (7/30/90), una consulta por tabla
+        dias = stats.rango_dias(request.args.get('dias'))
+        labels, messages_series, campaigns_series = stats.serie_actividad(dias)
 
         # Últimas notificaciones/actividades (mezcla de mensajes y campañas)
         mensajes = Mensaje.query.order_by(Mensaje.fecha_envio.desc()).limit(6).all()
@@ -487,7 +488,7 @@ def admin_reports():
             latest_notifications.append({'title': c.name or 'Campaña', 'created_at': c.date})
         latest_notifications = sorted(latest_notifications, key=lambda x: x.get('created_at') or datetime.utcnow(), reverse=True)[:6]
 
-        return render_template('admin/admin_reports.html', admin_user=session.get('username'), usuarios_count=usuarios_count, mensajes_count=mensajes_count, grupos_count=grupos_count, usuarios_change=usuarios_change, mensajes_change=mensajes_change, grupos_change=grupos_change, latest_notifications=latest_notifications, activity_labels=labels, activity_messages=messages_series, activity_campaigns=campaigns_series)
+        return render_template('admin/admin_reports.html', admin_user=session.get('username'), usuarios_count=usuarios_count, mensajes_count=mensajes_count, grupos_count=grupos_count, usuarios_change=usuarios_change, mensajes_change=mensajes_change, grupos_change=grupos_change, latest_notifications=latest_notifications, activity_labels=labels, activity_messages=messages_series, activity_campaigns=campaigns_series, activity_days=dias, activity_ranges=stats.RANGOS_DIAS)
     flash("Debe iniciar sesión como administrador", "error")
     return redirect(url_for('main.login'))
 
@@ -522,6 +523,7 @@ def admin_settings_site():
     settings.default_page = default_page or settings.default_page or 'home'
     settings.max_concurrent = max_concurrent
     settings.updated_at = datetime.utcnow()
+    marcar_cambio()
     try:
         db.session.commit()
         flash('Ajustes del sitio guardados correctamente.', 'success')
@@ -543,6 +545,7 @@ def admin_settings_maintenance():
     settings.maintenance = maintenance
     settings.maintenance_message = maintenance_message
     settings.updated_at = datetime.utcnow()
+    marcar_cambio()
     try:
         db.session.commit()
         flash('Ajustes de mantenimiento guardados correctamente.', 'success')
@@ -550,3 +553,11 @@ def admin_settings_maintenance():
         db.session.rollback()
         flash(f'Error al guardar ajustes de mantenimiento: {e}', 'error')
     return redirect(url_for('admin.admin_settings'))
+
+
+@admin_bp.route('/admin/dispatcher/stats', methods=['GET'], endpoint='admin_dispatcher_stats')
+@require_admin
+def admin_dispatcher_stats():
+    # Profundidad de la cola y concurrencia actual frente a Settings.max_concurrent
+    from app import dispatcher
+    return jsonify(dispatcher.estado())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Grupos destinatarios de las campañas (tabla `campaign_group`).
+
+Antes se guardaban como JSON en `Campaña.target_groups`, lo que obligaba a
+parsear cada campaña y a resolver los nombres con una consulta por grupo. Ahora
+cada par campaña-grupo es una fila indexada en los dos sentidos, y las lecturas
+(nombres de los grupos de una página de campañas, campañas de un grupo) son una
+sola consulta, sea cual sea el número de campañas o grupos.
+
+Los `target_groups` antiguos los copia a la tabla la migración 6 de
+`app/migrations.py` (`scripts/migrate.py`), que deja el JSON original en su
+columna.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select, insert, delete
+
+from app.models import db, Campaña, Grupo, campaign_group
+
+
+def grupos_existentes(ids):
+    """Subconjunto de `ids` que corresponde a grupos existentes (una consulta)."""
+    ids = set(ids)
+    if not ids:
+        return set()
+    return set(db.session.execute(select(Grupo.id).where(Grupo.id.in_(ids))).scalars())
+
+
+def establecer(campaña_id, ids):
+    """Deja como destinatarios de la campaña los grupos existentes de `ids`. No hace commit.
+
+    Devuelve la lista ordenada de IDs guardados.
+    """
+    validos = sorted(grupos_existentes(ids))
+    db.session.execute(delete(campaign_group).where(campaign_group.c.campaña_id == campaña_id))
+    if validos:
+        db.session.execute(insert(campaign_group), [{'campaña_id': campaña_id, 'grupo_id': gid} for gid in validos])
+    return validos
+
+
+def quitar_campaña(campaña_id):
+    db.session.execute(delete(campaign_group).where(campaign_group.c.campaña_id == campaña_id))
+
+
+def quitar_grupo(grupo_id):
+    db.session.execute(delete(campaign_group).where(campaign_group.c.grupo_id == grupo_id))
+
+
+def grupos_de(campaña_id):
+    """IDs de los grupos destinatarios de una campaña, ordenados."""
+    return list(db.session.execute(
+        select(campaign_group.c.grupo_id)
+        .where(campaign_group.c.campaña_id == campaña_id)
+        .order_by(campaign_group.c.grupo_id)
+    ).scalars())
+
+
+def nombres_por_campaña(campaña_ids):
+    """`{campaña_id: [nombre de grupo, ...]}` para varias campañas en una sola consulta."""
+    out = defaultdict(list)
+    ids = list(campaña_ids)
+    if not ids:
+        return out
+    rows = db.session.execute(
+        select(campaign_group.c.campaña_id, Grupo.nombre)
+        .join(Grupo, Grupo.id == campaign_group.c.grupo_id)
+        .where(campaign_group.c.campaña_id.in_(ids))
+        .order_by(Grupo.nombre)
+    )
+    for campaña_id, nombre in rows:
+        out[campaña_id].append(nombre)
+    return out
+
+
+def campañas_de_grupo(grupo_id):
+    """Campañas que tienen al grupo como destinatario (una consulta), más recientes primero."""
+    return (Campaña.query
+            .join(campaign_group, campaign_group.c.campaña_id == Campaña.id)
+            .filter(campaign_group.c.grupo_id == grupo_id)
+            .order_by(Campaña.date.desc())
+            .all())
+
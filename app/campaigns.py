@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Listado de campañas de la página de administración.
+
+Los contadores de la cabecera (total, activas, programadas) salen de una sola
+consulta agregada, y la tabla se pagina por clave (`date`, `id` de la última
+fila) con filtros por estado, prioridad y ventana de fechas. Con los índices
+`ix_campaña_active_date`, `ix_campaña_priority_date` y `ix_campaña_date` cada
+página lee sólo sus filas, aunque haya cientos de miles de campañas.
+"""
+import base64
+from datetime import datetime
+
+from sqlalchemy import select, func, and_, or_
+
+from app.models import db, Campaña
+from app.feed import parse_fecha
+
+DEFAULT_LIMITE = 25
+PRIORIDADES = ('alta', 'media', 'baja')
+ESTADOS = ('activas', 'inactivas')
+VENTANAS = ('programadas', 'pasadas')
+
+
+def resumen(now=None):
+    """`(total, activas, programadas)` en una sola consulta.
+
+    Cada contador es una subconsulta que recorre sólo su rango de índice
+    (`active = 1` en `ix_campaña_active_date`, `date > now` en `ix_campaña_date`)
+    en lugar de evaluar un CASE por cada fila de la tabla.
+    """
+    now = now or datetime.utcnow()
+
+    def contar(*condiciones):
+        return select(func.count()).select_from(Campaña).where(*condiciones).scalar_subquery()
+
+    total, activas, programadas = db.session.execute(
+        select(contar(), contar(Campaña.active.is_(True)), contar(Campaña.date > now))
+    ).one()
+    return total or 0, activas or 0, programadas or 0
+
+
+def parse_filtros(args):
+    """Filtros válidos de la query string (`estado`, `prioridad`, `ventana`, `desde`, `hasta`)."""
+    f = {}
+    estado = (args.get('estado') or '').strip().lower()
+    if estado in ESTADOS:
+        f['estado'] = estado
+    prioridad = (args.get('prioridad') or '').strip().lower()
+    if prioridad in PRIORIDADES:
+        f['prioridad'] = prioridad
+    ventana = (args.get('ventana') or '').strip().lower()
+    if ventana in VENTANAS:
+        f['ventana'] = ventana
+    for clave in ('desde', 'hasta'):
+        if parse_fecha(args.get(clave)):
+            f[clave] = args.get(clave)
+    return f
+
+
+def codificar_cursor(campaña):
+    fecha = campaña.date.isoformat() if campaña.date else ''
+    raw = '%s|%d' % (fecha, campaña.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve `(fecha o None, id)` o None si el cursor no es válido."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, id_ = raw.split('|')
+        return (datetime.fromisoformat(fecha) if fecha else None), int(id_)
+    except Exception:
+        return None
+
+
+def _despues_de(cursor):
+    # Orden: date DESC, id DESC; en SQLite los NULL van al final en orden descendente
+    fecha, id_c = cursor
+    if fecha is None:
+        return and_(Campaña.date.is_(None), Campaña.id < id_c)
+    return or_(Campaña.date < fecha,
+               and_(Campaña.date == fecha, Campaña.id < id_c),
+               Campaña.date.is_(None))
+
+
+def pagina(filtros=None, limite=DEFAULT_LIMITE, cursor=None, now=None):
+    """Página de campañas más recientes primero.
+
+    Devuelve `(campañas, siguiente)`; `siguiente` es el cursor de la página
+    siguiente o None si no hay más.
+    """
+    filtros = filtros or {}
+    now = now or datetime.utcnow()
+    q = Campaña.query
+    if filtros.get('estado') == 'activas':
+        q = q.filter(Campaña.active.is_(True))
+    elif filtros.get('estado') == 'inactivas':
+        q = q.filter(or_(Campaña.active.is_(False), Campaña.active.is_(None)))
+    if filtros.get('prioridad'):
+        q = q.filter(Campaña.priority == filtros['prioridad'])
+    if filtros.get('ventana') == 'programadas':
+        q = q.filter(Campaña.date > now)
+    elif filtros.get('ventana') == 'pasadas':
+        q = q.filter(Campaña.date <= now)
+    desde = parse_fecha(filtros.get('desde'))
+    hasta = parse_fecha(filtros.get('hasta'), fin_de_dia=True)
+    if desde:
+        q = q.filter(Campaña.date >= desde)
+    if hasta:
+        q = q.filter(Campaña.date < hasta)
+    cursor = decodificar_cursor(cursor) if isinstance(cursor, str) else cursor
+    if cursor:
+        q = q.filter(_despues_de(cursor))
+    # una fila de más para saber si hay otra página
+    filas = q.order_by(Campaña.date.desc(), Campaña.id.desc()).limit(limite + 1).all()
+    siguiente = codificar_cursor(filas[limite - 1]) if len(filas) > limite else None
+    return filas[:limite], siguiente
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Contadores de miembros y mensajes de cada `Grupo`.
+
+`Grupo.miembros_count` y `Grupo.mensajes_count` se actualizan con un UPDATE
+relativo (`col = col + n`) en la misma transacción que el cambio que los
+afecta, así que listar y ordenar grupos no necesita cargar sus colecciones:
+
+- miembros: lo llaman las funciones de `app.membership` al dar altas y bajas;
+- mensajes: hooks de flush del ORM al crear, borrar o mover un `Mensaje`.
+
+Los borrados masivos sin ORM pueden desajustarlos; `reconciliar()` (o
+`scripts/reconcile_group_counters.py`) los recalcula desde las tablas.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select, update, func, event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import db, Grupo, Mensaje, user_grupo
+
+
+def ajustar(columna, grupo_id, delta, conn=None):
+    """Suma `delta` al contador `columna` ('miembros_count' / 'mensajes_count') del grupo."""
+    if not delta or grupo_id is None:
+        return
+    t = Grupo.__table__
+    stmt = update(t).where(t.c.id == grupo_id).values({columna: t.c[columna] + delta})
+    (conn or db.session).execute(stmt)
+
+
+def ajustar_miembros(grupo_id, delta):
+    ajustar('miembros_count', grupo_id, delta)
+
+
+def poner_miembros(grupo_id, valor):
+    t = Grupo.__table__
+    db.session.execute(update(t).where(t.c.id == grupo_id).values(miembros_count=valor))
+
+
+# --- mensajes (hooks del ORM) ---
+@event.listens_for(Session, 'before_flush')
+def _antes_de_flush(session, flush_context, instances):
+    deltas = session.info.setdefault('grupo_mensajes_deltas', defaultdict(int))
+    for obj in session.deleted:
+        if isinstance(obj, Mensaje):
+            h = inspect(obj).attrs.grupo_id.history
+            deltas[h.deleted[0] if h.deleted else obj.grupo_id] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Mensaje) and obj not in session.deleted:
+            h = inspect(obj).attrs.grupo_id.history
+            if h.deleted and h.added and h.deleted[0] != h.added[0]:
+                deltas[h.deleted[0]] -= 1
+                deltas[h.added[0]] += 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _despues_de_flush(session, flush_context):
+    deltas = session.info.pop('grupo_mensajes_deltas', None) or defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, Mensaje):
+            deltas[obj.grupo_id] += 1
+    conn = None
+    for grupo_id, delta in deltas.items():
+        if delta:
+            conn = conn or session.connection()
+            ajustar('mensajes_count', grupo_id, delta, conn)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _tras_rollback(session):
+    session.info.pop('grupo_mensajes_deltas', None)
+
+
+# --- reconciliación ---
+def reconciliar():
+    """Recalcula los contadores de todos los grupos. Hace commit.
+
+    Devuelve la lista de `(grupo_id, miembros_antes, miembros, mensajes_antes, mensajes)`
+    de los grupos que estaban desajustados.
+    """
+    miembros = (select(func.count()).select_from(user_grupo)
+                .where(user_grupo.c.grupo_id == Grupo.id).scalar_subquery())
+    mensajes = (select(func.count()).select_from(Mensaje)
+                .where(Mensaje.grupo_id == Grupo.id).scalar_subquery())
+    desajustados = db.session.execute(
+        select(Grupo.id, Grupo.miembros_count, miembros, Grupo.mensajes_count, mensajes)
+        .where((Grupo.miembros_count != miembros) | (Grupo.mensajes_count != mensajes))
+    ).all()
+    if desajustados:
+        t = Grupo.__table__
+        db.session.execute(update(t).values(
+            miembros_count=select(func.count()).select_from(user_grupo)
+            .where(user_grupo.c.grupo_id == t.c.id).scalar_subquery(),
+            mensajes_count=select(func.count()).select_from(Mensaje.__table__)
+            .where(Mensaje.__table__.c.grupo_id == t.c.id).scalar_subquery(),
+        ))
+    db.session.commit()
+    return [tuple(r) for r in desajustados]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Dispatcher de envíos: aplica `Settings.max_concurrent` como límite global.
+
+El límite se evalúa dentro del propio UPDATE de reclamo (ver
+`outbox.reclamar_lote`) leyendo `settings.max_concurrent` como subconsulta, de
+modo que cambiar el ajuste en el panel de administración tiene efecto en el
+siguiente reclamo de cualquier worker, sin reiniciar nada. Las entregas en
+curso se cuentan a partir de los leases vigentes en la tabla `entrega`, por lo
+que el límite es común a todos los procesos, mensajes y campañas.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, case
+
+from app.models import db, Entrega, Settings
+from app import outbox
+
+DEFAULT_MAX_CONCURRENT = 5
+
+
+def limite_concurrencia():
+    """Expresión SQL con el valor vigente de `Settings.max_concurrent`."""
+    return (
+        select(func.coalesce(func.max(Settings.max_concurrent), DEFAULT_MAX_CONCURRENT))
+        .scalar_subquery()
+    )
+
+
+def ejecutar(app, hilos=1, enviar=None, stop_event=None, espera=1.0):
+    """Arranca `hilos` bucles de envío en este proceso respetando el límite global.
+
+    Bloquea hasta que `stop_event` se active.
+    """
+    stop_event = stop_event or threading.Event()
+    base = outbox.worker_id()
+    threads = []
+    for i in range(max(1, hilos)):
+        th = threading.Thread(
+            target=outbox.ejecutar_worker,
+            args=(app,),
+            kwargs=dict(owner='%s#%d' % (base, i), enviar=enviar, stop_event=stop_event,
+                        espera=espera, capacidad=limite_concurrencia()),
+            daemon=True,
+        )
+        th.start()
+        threads.append(th)
+    for th in threads:
+        th.join()
+
+
+def estado():
+    """Métricas del dispatcher para dimensionar `max_concurrent`.
+
+    - `en_cola`: entregas listas para enviarse ya (profundidad de la cola).
+    - `en_espera`: entregas pendientes de reintento (backoff) o programadas.
+    - `en_curso`: entregas reclamadas con lease vigente (concurrencia actual).
+    - `carriles`: cola y latencias por prioridad (ver `latencias`).
+    """
+    now = datetime.utcnow()
+    t = Entrega.__table__
+    row = db.session.execute(
+        select(
+            func.sum(case(((t.c.estado == outbox.PENDIENTE) & (t.c.proximo_intento <= now), 1), else_=0)),
+            func.sum(case(((t.c.estado == outbox.PENDIENTE) & (t.c.proximo_intento > now), 1), else_=0)),
+            func.sum(case(((t.c.estado == outbox.EN_CURSO) & (t.c.lease_hasta >= now), 1), else_=0)),
+            func.sum(case((t.c.estado == outbox.ENTREGADO, 1), else_=0)),
+            func.sum(case((t.c.estado == outbox.FALLIDO, 1), else_=0)),
+            limite_concurrencia(),
+        )
+    ).one()
+    max_concurrent = int(row[5] or 0)
+    en_curso = int(row[2] or 0)
+    return {
+        'max_concurrent': max_concurrent,
+        'en_curso': en_curso,
+        'en_cola': int(row[0] or 0),
+        'en_espera': int(row[1] or 0),
+        'entregados': int(row[3] or 0),
+        'fallidos': int(row[4] or 0),
+        'utilizacion': round(en_curso / float(max_concurrent), 2) if max_concurrent else 0,
+        'carriles': latencias(),
+    }
+
+
+def _segundos(desde, hasta):
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(hasta) - func.julianday(desde)) * 86400.0
+    return func.extract('epoch', hasta - desde)
+
+
+def latencias(ventana_minutos=60):
+    """Por carril: entregas en cola y latencia encolado->entregado (p50/p99, segundos)
+    de las entregas completadas en los últimos `ventana_minutos`.
+    """
+    now = datetime.utcnow()
+    desde = now - timedelta(minutes=ventana_minutos)
+    t = Entrega.__table__
+    latencia = _segundos(t.c.creado, t.c.entregado_en)
+    en_cola = dict(db.session.execute(
+        select(t.c.prioridad, func.count(t.c.id))
+        .where(t.c.estado == outbox.PENDIENTE, t.c.proximo_intento <= now)
+        .group_by(t.c.prioridad)
+    ).all())
+
+    out = {}
+    for nombre, num in sorted(outbox.PRIORIDADES.items(), key=lambda x: x[1]):
+        filtro = (t.c.prioridad == num, t.c.entregado_en >= desde)
+        n = db.session.execute(select(func.count(t.c.id)).where(*filtro)).scalar() or 0
+        carril = {'en_cola': int(en_cola.get(num, 0)), 'entregados': n, 'p50': None, 'p99': None}
+        for clave, p in (('p50', 0.50), ('p99', 0.99)):
+            if n:
+                valor = db.session.execute(
+                    select(latencia).where(*filtro).order_by(latencia).offset(int(p * (n - 1))).limit(1)
+                ).scalar()
+                carril[clave] = round(float(valor), 3) if valor is not None else None
+        out[nombre] = carril
+    return out
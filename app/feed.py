@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Listado de notificaciones (campañas activas + mensajes) resuelto en la BD.
+
+Las dos tablas se combinan con UNION ALL; el filtro de fechas, el orden y el
+LIMIT se aplican dentro de cada rama y sobre la unión, así que sólo viajan a
+Python las filas de la página. "Siguiente" pagina por cursor (`fecha`,
+`tipo`, `id` de la última fila): con índices sobre `mensaje.fecha_envio` y
+`campaña.date` la página N cuesta lo mismo que la 1. El total es un conteo
+acotado a `MAX_CONTEO` y los saltos a una página concreta (OFFSET) sólo se
+permiten dentro de ese tope, así que ninguna petición recorre todo el histórico.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, literal, String, union_all, and_, or_, func
+
+from app.models import db, Campaña, Mensaje, Usuario, Grupo
+
+TIPO_CAMPAÑA = 0
+TIPO_MENSAJE = 1
+
+# Caracteres de `contenido` que se envían a la bandeja de inicio
+LONGITUD_EXTRACTO = 200
+# Tope del conteo de notificaciones (y de las filas a las que se llega con OFFSET)
+MAX_CONTEO = 1000
+
+
+def parse_fecha(valor, fin_de_dia=False):
+    """'YYYY-MM-DD' -> datetime (o None si está vacío o no es válido)."""
+    if not valor:
+        return None
+    try:
+        d = datetime.strptime(valor, '%Y-%m-%d')
+    except ValueError:
+        return None
+    if fin_de_dia:
+        # incluir el día completo
+        d = d + timedelta(days=1)
+    return d
+
+
+def codificar_cursor(fila):
+    raw = '%s|%d|%d' % (fila['sent_at'].isoformat(), fila['tipo'], fila['id'])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, tipo, id) o None si el cursor no es válido."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        fecha, tipo, id_ = raw.split('|')
+        return datetime.fromisoformat(fecha), int(tipo), int(id_)
+    except Exception:
+        return None
+
+
+def _despues_de(col_fecha, col_id, tipo, cursor):
+    # Orden global: fecha DESC, tipo ASC, id DESC. Como `tipo` es constante en
+    # cada rama, la condición de "después del cursor" se simplifica por rama.
+    fecha, tipo_c, id_c = cursor
+    if tipo > tipo_c:
+        return col_fecha <= fecha
+    if tipo < tipo_c:
+        return col_fecha < fecha
+    # el `<=` da el rango sobre el índice de fecha; el OR sólo filtra dentro de él
+    return and_(col_fecha <= fecha, or_(col_fecha < fecha, col_id < id_c))
+
+
+def _ramas(desde, hasta, cursor=None, tope=None):
+    campañas = (
+        select(
+            literal(TIPO_CAMPAÑA).label('tipo'),
+            Campaña.id.label('id'),
+            Campaña.name.label('titulo'),
+            Campaña.message.label('texto'),
+            Campaña.date.label('fecha'),
+            literal(None, String).label('autor'),
+            Campaña.priority.label('prioridad'),
+        )
+        .where(Campaña.active.is_(True), Campaña.date.isnot(None))
+    )
+    mensajes = (
+        select(
+            literal(TIPO_MENSAJE).label('tipo'),
+            Mensaje.id.label('id'),
+            Mensaje.asunto.label('titulo'),
+            Mensaje.contenido.label('texto'),
+            Mensaje.fecha_envio.label('fecha'),
+            Usuario.username.label('autor'),
+            literal('baja', String).label('prioridad'),
+        )
+        .select_from(Mensaje)
+        .outerjoin(Usuario, Usuario.id == Mensaje.usuario_id)
+        .where(Mensaje.fecha_envio.isnot(None))
+    )
+    ramas = []
+    for q, tipo, col_fecha, col_id in ((campañas, TIPO_CAMPAÑA, Campaña.date, Campaña.id),
+                                      (mensajes, TIPO_MENSAJE, Mensaje.fecha_envio, Mensaje.id)):
+        if desde:
+            q = q.where(col_fecha >= desde)
+        if hasta:
+            q = q.where(col_fecha < hasta)
+        if cursor:
+            q = q.where(_despues_de(col_fecha, col_id, tipo, cursor))
+        if tope is not None:
+            # cada rama ya viene limitada y ordenada por índice
+            q = select(*q.order_by(col_fecha.desc(), col_id.desc()).limit(tope).subquery().c)
+        ramas.append(q)
+    return ramas
+
+
+def contar_notificaciones(desde=None, hasta=None, tope=MAX_CONTEO):
+    """Total de notificaciones en el rango, acotado a `tope` (una sola sentencia).
+
+    Devuelve `(total, hay_mas)`; con `hay_mas` el total real supera `tope` y
+    se devuelve `tope`. Cada rama cuenta como mucho `tope + 1` filas de su
+    índice de fecha (sin el LEFT JOIN a `usuario` de la rama de mensajes), así
+    que el coste no depende del tamaño del histórico.
+    """
+    subs = []
+    for modelo, col_fecha, filtros in ((Campaña, Campaña.date, [Campaña.active.is_(True)]),
+                                       (Mensaje, Mensaje.fecha_envio, [])):
+        filtros = filtros + [col_fecha.isnot(None)]
+        if desde:
+            filtros.append(col_fecha >= desde)
+        if hasta:
+            filtros.append(col_fecha < hasta)
+        filas = select(literal(1)).select_from(modelo).where(*filtros).limit(tope + 1).subquery()
+        subs.append(select(func.count()).select_from(filas).scalar_subquery())
+    total = db.session.execute(select(subs[0] + subs[1])).scalar() or 0
+    return min(total, tope), total > tope
+
+
+def notificaciones(desde=None, hasta=None, limite=10, offset=0, cursor=None):
+    """Página de notificaciones ordenada por fecha descendente.
+
+    Con `cursor` (ver `codificar_cursor`) se ignora `offset` y se continúa tras la
+    última fila de la página anterior. Devuelve una lista de dicts listos para la
+    plantilla; cada uno incluye su propio `cursor`.
+    """
+    cursor = decodificar_cursor(cursor) if isinstance(cursor, str) else cursor
+    por_rama = limite + (0 if cursor else offset)
+    u = union_all(*_ramas(desde, hasta, cursor, tope=por_rama)).subquery('u')
+    q = select(u).order_by(u.c.fecha.desc(), u.c.tipo, u.c.id.desc()).limit(limite)
+    if offset and not cursor:
+        q = q.offset(offset)
+
+    out = []
+    for row in db.session.execute(q).mappings():
+        if row['tipo'] == TIPO_CAMPAÑA:
+            titulo = row['titulo'] or ((row['texto'] or '')[:80] + '...')
+            autor = 'Sistema'
+        else:
+            titulo = row['titulo'] or ('Mensaje ' + str(row['id']))
+            autor = row['autor'] or 'Sistema'
+        n = {
+            'type': 'campaign' if row['tipo'] == TIPO_CAMPAÑA else 'message',
+            'tipo': row['tipo'],
+            'id': row['id'],
+            'title': titulo,
+            'text': row['texto'],
+            'sent_at': row['fecha'],
+            'author': autor,
+            'priority': row['prioridad'] or 'baja',
+        }
+        n['cursor'] = codificar_cursor(n)
+        out.append(n)
+    return out
+
+
+def bandeja(limite=20, cursor=None):
+    """Ventana de la bandeja de inicio: mensajes más recientes primero.
+
+    Selecciona sólo las columnas que muestra la página (con un extracto de
+    `contenido`, no el texto completo) y pagina por cursor sobre
+    (`fecha_envio`, `id`). Devuelve `(items, siguiente_cursor)`.
+    """
+    cursor = decodificar_cursor(cursor) if isinstance(cursor, str) else cursor
+    q = (
+        select(
+            Mensaje.id,
+            Mensaje.asunto,
+            func.substr(Mensaje.contenido, 1, LONGITUD_EXTRACTO).label('extracto'),
+            func.length(Mensaje.contenido).label('longitud'),
+            Mensaje.fecha_envio,
+            Grupo.nombre.label('grupo'),
+            Usuario.username.label('autor'),
+        )
+        .select_from(Mensaje)
+        .outerjoin(Grupo, Grupo.id == Mensaje.grupo_id)
+        .outerjoin(Usuario, Usuario.id == Mensaje.usuario_id)
+        .where(Mensaje.fecha_envio.isnot(None))
+    )
+    if cursor:
+        fecha, _, id_ = cursor
+        q = q.where(or_(Mensaje.fecha_envio < fecha, and_(Mensaje.fecha_envio == fecha, Mensaje.id < id_)))
+    # se pide una fila de más para saber si hay otra página
+    q = q.order_by(Mensaje.fecha_envio.desc(), Mensaje.id.desc()).limit(limite + 1)
+
+    items = []
+    for row in db.session.execute(q).mappings():
+        extracto = row['extracto'] or ''
+        if (row['longitud'] or 0) > LONGITUD_EXTRACTO:
+            extracto += '…'
+        items.append({
+            'id': row['id'],
+            'asunto': row['asunto'] or '',
+            'extracto': extracto,
+            'fecha': row['fecha_envio'],
+            'grupo': row['grupo'] or '',
+            'autor': row['autor'] or '',
+            'tipo': TIPO_MENSAJE,
+        })
+    siguiente = None
+    if len(items) > limite:
+        items = items[:limite]
+        ultimo = items[-1]
+        siguiente = codificar_cursor({'sent_at': ultimo['fecha'], 'tipo': TIPO_MENSAJE, 'id': ultimo['id']})
+    return items, siguiente
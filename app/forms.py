@@ -17,7 +17,8 @@ try:
 
 	class GroupForm(FlaskForm):
 		nombre = StringField('Nombre', validators=[DataRequired(), Length(max=100)])
-		usuarios = SelectMultipleField('Usuarios', coerce=int, validators=[Optional()])
+		# los IDs se validan contra la BD en app.membership (no se cargan todos los usuarios como choices)
+		usuarios = SelectMultipleField('Usuarios', coerce=int, choices=[], validate_choice=False, validators=[Optional()])
 
 
 	class AddUserForm(FlaskForm):
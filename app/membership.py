@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Altas y bajas de miembros de grupo con sentencias masivas sobre `user_grupo`.
+
+En lugar de cargar cada `Usuario` por separado y reescribir toda la relación
+`Grupo.usuarios`, los IDs se resuelven con consultas `IN` por lotes y sólo se
+aplica la diferencia: un INSERT (executemany) para las altas y un DELETE por
+lote para las bajas. Cada alta o baja ajusta `Grupo.miembros_count` en la
+misma sentencia de la transacción (ver `app.counters`). Ninguna función hace
+commit.
+
+El selector de miembros de la página de grupos no recibe la lista completa de
+usuarios: busca por prefijo (`buscar_usuarios`) y pide los miembros de cada
+grupo por páginas (`pagina_miembros`), ambos con paginación por clave sobre
+`username`. La búsqueda por prefijo no distingue mayúsculas y se hace como
+rango sobre `lower(col)` (`lower(col) >= q AND lower(col) < siguiente(q)`) para
+aprovechar los índices `ix_usuario_username_lower` / `ix_usuario_email_lower`.
+Como el `lower()` de SQLite, sólo pliega las letras ASCII (A-Z).
+"""
+from sqlalchemy import select, insert, delete, and_, or_, func
+
+from app import counters
+from app.models import db, Usuario, user_grupo
+
+# IDs por sentencia IN (muy por debajo del límite de variables de SQLite)
+LOTE_IN = 5000
+# Tamaño de página del selector de usuarios / miembros
+DEFAULT_LIMITE = 25
+MAX_LIMITE = 100
+
+
+def parse_ids(valores):
+    """Lista de valores de formulario -> conjunto de IDs enteros (ignora los inválidos)."""
+    ids = set()
+    for v in valores or []:
+        try:
+            ids.add(int(v))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def _lotes(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), LOTE_IN):
+        yield ids[i:i + LOTE_IN]
+
+
+def usuarios_existentes(ids):
+    """Subconjunto de `ids` que corresponde a usuarios existentes."""
+    encontrados = set()
+    for lote in _lotes(ids):
+        encontrados.update(db.session.execute(select(Usuario.id).where(Usuario.id.in_(lote))).scalars())
+    return encontrados
+
+
+def miembros(grupo_id):
+    """IDs de los usuarios que pertenecen al grupo."""
+    return set(db.session.execute(
+        select(user_grupo.c.usuario_id).where(user_grupo.c.grupo_id == grupo_id)
+    ).scalars())
+
+
+def añadir(grupo_id, ids):
+    """Da de alta `ids` (ya validados y no miembros) en el grupo."""
+    if ids:
+        db.session.execute(insert(user_grupo), [{'usuario_id': uid, 'grupo_id': grupo_id} for uid in sorted(ids)])
+        counters.ajustar_miembros(grupo_id, len(ids))
+    return len(ids)
+
+
+def quitar(grupo_id, ids):
+    """Da de baja `ids` del grupo. Devuelve cuántos eran miembros."""
+    bajas = 0
+    for lote in _lotes(ids):
+        res = db.session.execute(delete(user_grupo).where(user_grupo.c.grupo_id == grupo_id, user_grupo.c.usuario_id.in_(lote)))
+        bajas += res.rowcount
+    counters.ajustar_miembros(grupo_id, -bajas)
+    return bajas
+
+
+def vaciar(grupo_id):
+    """Quita a todos los miembros del grupo en una sola sentencia."""
+    db.session.execute(delete(user_grupo).where(user_grupo.c.grupo_id == grupo_id))
+    counters.poner_miembros(grupo_id, 0)
+
+
+def quitar_usuario(usuario_id):
+    """Da de baja al usuario de todos sus grupos (p. ej. antes de eliminarlo)."""
+    grupos = db.session.execute(
+        select(user_grupo.c.grupo_id).where(user_grupo.c.usuario_id == usuario_id)
+    ).scalars().all()
+    if grupos:
+        db.session.execute(delete(user_grupo).where(user_grupo.c.usuario_id == usuario_id))
+        for grupo_id in grupos:
+            counters.ajustar_miembros(grupo_id, -1)
+    return len(grupos)
+
+
+def establecer(grupo, valores):
+    """Deja en `grupo` exactamente los usuarios de `valores` (IDs de formulario).
+
+    Sólo escribe la diferencia con los miembros actuales. Devuelve
+    `(altas, bajas)`.
+    """
+    if grupo.id is None:
+        db.session.flush()
+    deseados = usuarios_existentes(parse_ids(valores))
+    actuales = miembros(grupo.id) if grupo.id else set()
+    altas = añadir(grupo.id, deseados - actuales)
+    bajas = quitar(grupo.id, actuales - deseados)
+    # la colección `grupo.usuarios` cargada (si la hay) ya no refleja la tabla
+    db.session.expire(grupo, ['usuarios'])
+    return altas, bajas
+
+
+def aplicar_cambios(grupo, agregar, quitar_ids):
+    """Aplica altas y bajas explícitas (IDs de formulario) sin tocar el resto de miembros.
+
+    Devuelve `(altas, bajas)`.
+    """
+    if grupo.id is None:
+        db.session.flush()
+    agregar = parse_ids(agregar)
+    quitar_ids = parse_ids(quitar_ids) - agregar
+    ya_miembros = set()
+    for lote in _lotes(agregar | quitar_ids):
+        ya_miembros.update(db.session.execute(
+            select(user_grupo.c.usuario_id)
+            .where(user_grupo.c.grupo_id == grupo.id, user_grupo.c.usuario_id.in_(lote))
+        ).scalars())
+    altas = añadir(grupo.id, usuarios_existentes(agregar - ya_miembros))
+    bajas = quitar(grupo.id, quitar_ids & ya_miembros)
+    db.session.expire(grupo, ['usuarios'])
+    return altas, bajas
+
+
+# --- selector paginado ---
+def _minusculas(q):
+    # igual que lower() de SQLite: sólo A-Z, para que el prefijo coincida con el índice
+    return ''.join(chr(ord(c) + 32) if 'A' <= c <= 'Z' else c for c in q)
+
+
+def _siguiente_prefijo(q):
+    """Menor cadena mayor que todas las que empiezan por `q` (None si no hay cota).
+
+    Se incrementa el último carácter (en UTF-8 el orden binario es el de los
+    puntos de código); si ya es el máximo, se quita y se incrementa el anterior.
+    """
+    while q:
+        codigo = ord(q[-1]) + 1
+        if 0xD800 <= codigo <= 0xDFFF:
+            # los sustitutos no existen en UTF-8
+            codigo = 0xE000
+        if codigo <= 0x10FFFF:
+            return q[:-1] + chr(codigo)
+        q = q[:-1]
+    return None
+
+
+def _con_prefijo(col, q):
+    col = func.lower(col)
+    hasta = _siguiente_prefijo(q)
+    return col >= q if hasta is None else and_(col >= q, col < hasta)
+
+
+def _pagina(q_base, q, despues, limite):
+    if q:
+        q = _minusculas(q)
+        q_base = q_base.where(or_(_con_prefijo(Usuario.username, q), _con_prefijo(Usuario.email, q)))
+    if despues:
+        q_base = q_base.where(Usuario.username > despues)
+    # una fila de más para saber si hay otra página
+    rows = db.session.execute(q_base.order_by(Usuario.username).limit(limite + 1)).all()
+    items = [{'id': r.id, 'username': r.username, 'email': r.email or '', 'role': r.role or 'user'} for r in rows[:limite]]
+    siguiente = items[-1]['username'] if len(rows) > limite else None
+    return items, siguiente
+
+
+def buscar_usuarios(q='', limite=DEFAULT_LIMITE, despues=None):
+    """Usuarios cuyo nombre o email empieza por `q` (sin distinguir mayúsculas), por orden de nombre.
+
+    Devuelve `(items, siguiente)`; `siguiente` se pasa como `despues` para la página siguiente.
+    """
+    base = select(Usuario.id, Usuario.username, Usuario.email, Usuario.role)
+    return _pagina(base, (q or '').strip(), despues, limite)
+
+
+def pagina_miembros(grupo_id, q='', limite=DEFAULT_LIMITE, despues=None):
+    """Página de miembros del grupo (mismo formato que `buscar_usuarios`)."""
+    base = (select(Usuario.id, Usuario.username, Usuario.email, Usuario.role)
+            .join(user_grupo, user_grupo.c.usuario_id == Usuario.id)
+            .where(user_grupo.c.grupo_id == grupo_id))
+    return _pagina(base, (q or '').strip(), despues, limite)
+
+
+def limite_pagina(valor):
+    try:
+        return min(MAX_LIMITE, max(1, int(valor)))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMITE
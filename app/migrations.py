@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Migraciones versionadas del esquema SQLite.
+
+`db.create_all()` crea las tablas que faltan, pero no añade columnas ni
+índices a tablas que ya existen. Cada cambio de esquema de una base de datos
+existente es aquí una migración numerada (`@migracion(version, descripcion)`)
+y la tabla `schema_version` guarda las aplicadas; `scripts/migrate.py` aplica
+las pendientes en orden.
+
+Para no bloquear la aplicación en una base de datos de varios GB:
+
+- las columnas se añaden con `ALTER TABLE ... ADD COLUMN`, que sólo cambia el
+  esquema (no reescribe la tabla ni necesita espacio extra);
+- los rellenos (`Migrador.rellenar`) recorren la tabla por tramos de `lote`
+  filas en orden de id, cada tramo en su propia transacción corta, con una
+  pausa entre tramos para que entren las escrituras de la aplicación. El último
+  id hecho se guarda en `schema_migration_progress`: si el proceso se corta,
+  la siguiente ejecución sigue desde ahí;
+- el backup (`backup`) usa la API de backup en línea de SQLite por tramos de
+  páginas sobre una foto de lectura: es una copia consistente aunque la
+  aplicación siga escribiendo, y se comprueba antes que cabe en el disco de
+  destino (`--backup` de `scripts/migrate.py` permite dejarla en otro disco).
+
+Crear un índice sí mantiene el lock de escritura mientras se construye (SQLite
+no tiene `CREATE INDEX` en línea); en WAL las lecturas siguen sin esperar.
+
+Todas las migraciones son idempotentes (comprueban columnas e índices antes de
+crearlos), así que en una base de datos nueva creada por `create_all` sólo
+quedan registradas. Para añadir una: una función nueva con el siguiente número
+de versión al final del fichero; nunca cambiar una ya publicada.
+"""
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+TABLA_VERSIONES = 'schema_version'
+TABLA_PROGRESO = 'schema_migration_progress'
+DEFAULT_LOTE = 1000
+DEFAULT_PAUSA = 0.05
+DEFAULT_PAGINAS_BACKUP = 4096
+
+MIGRACIONES = []
+
+
+def migracion(version, descripcion):
+    """Registra una migración: `f(migrador)` se ejecuta una vez, en orden de `version`."""
+    def registrar(f):
+        if any(v == version for v, _, _ in MIGRACIONES):
+            raise ValueError('versión de migración repetida: %d' % version)
+        MIGRACIONES.append((version, descripcion, f))
+        MIGRACIONES.sort(key=lambda m: m[0])
+        return f
+    return registrar
+
+
+def conectar(ruta, busy_timeout=5000):
+    """Conexión en autocommit (las transacciones las abre cada paso) que espera a los locks de la app."""
+    conn = sqlite3.connect(str(ruta), isolation_level=None)
+    conn.execute('PRAGMA busy_timeout = %d' % busy_timeout)
+    return conn
+
+
+def backup(conn, destino, paginas=DEFAULT_PAGINAS_BACKUP, informar=None):
+    """Copia la base de datos abierta en `conn` a `destino` con la API de backup de SQLite.
+
+    Copia `paginas` páginas por paso. En WAL mantiene una transacción de lectura
+    durante toda la copia: la copia es la foto de ese instante y las escrituras
+    de la aplicación no la hacen volver a empezar (ni esperan por ella). Escribe
+    en `destino.parcial` y lo renombra al terminar. Lanza RuntimeError si
+    `destino` ya existe o si no hay espacio libre para la copia.
+    """
+    destino = os.path.abspath(str(destino))
+    if os.path.exists(destino):
+        raise RuntimeError('el backup %s ya existe' % destino)
+    tamaño = conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+    libre = shutil.disk_usage(os.path.dirname(destino)).free
+    if tamaño > libre:
+        raise RuntimeError('sin espacio para el backup en %s: hacen falta %d MB y hay %d MB libres' % (
+            os.path.dirname(destino), tamaño // 2 ** 20, libre // 2 ** 20))
+
+    def progreso(_estado, quedan, total):
+        if informar and total:
+            informar('backup: %d/%d páginas (%d%%)' % (total - quedan, total, 100 * (total - quedan) // total))
+
+    parcial = destino + '.parcial'
+    for resto in (parcial, parcial + '-journal'):
+        if os.path.exists(resto):
+            os.remove(resto)
+    # sin WAL una lectura abierta bloquearía a los escritores: la copia puede reiniciarse si escriben
+    foto = conn.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+    dest = sqlite3.connect(parcial)
+    try:
+        if foto:
+            conn.execute('BEGIN')
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        try:
+            conn.backup(dest, pages=paginas, progress=progreso)
+        finally:
+            if foto:
+                conn.execute('COMMIT')
+    except BaseException:
+        dest.close()
+        os.remove(parcial)
+        raise
+    dest.close()
+    os.replace(parcial, destino)
+    return destino
+
+
+class Migrador:
+    """Aplica las migraciones pendientes sobre una conexión `sqlite3` (ver `conectar`)."""
+
+    def __init__(self, conn, lote=DEFAULT_LOTE, pausa=DEFAULT_PAUSA, informar=None):
+        self.conn = conn
+        self.lote = lote
+        self.pausa = pausa
+        self.informar = informar or (lambda texto: None)
+        self.version = None
+        self.conn.execute('CREATE TABLE IF NOT EXISTS %s (version INTEGER PRIMARY KEY, descripcion TEXT NOT NULL, '
+                          'aplicada_en TEXT NOT NULL)' % TABLA_VERSIONES)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS %s (version INTEGER NOT NULL, paso TEXT NOT NULL, '
+                          'ultimo_id INTEGER NOT NULL, PRIMARY KEY (version, paso))' % TABLA_PROGRESO)
+
+    # --- estado ---
+    def aplicadas(self):
+        return {v for (v,) in self.conn.execute('SELECT version FROM %s' % TABLA_VERSIONES)}
+
+    def pendientes(self, hasta=None):
+        hechas = self.aplicadas()
+        return [m for m in MIGRACIONES if m[0] not in hechas and (hasta is None or m[0] <= hasta)]
+
+    def aplicar(self, hasta=None):
+        """Aplica en orden las migraciones pendientes (hasta `hasta` incluida). Devuelve sus versiones."""
+        hechas = []
+        for version, descripcion, f in self.pendientes(hasta):
+            self.informar('migración %d: %s' % (version, descripcion))
+            self.version = version
+            t0 = time.monotonic()
+            f(self)
+            with self.transaccion():
+                self.conn.execute('INSERT INTO %s (version, descripcion, aplicada_en) VALUES (?, ?, ?)'
+                                  % TABLA_VERSIONES, (version, descripcion, datetime.utcnow().isoformat()))
+                self.conn.execute('DELETE FROM %s WHERE version = ?' % TABLA_PROGRESO, (version,))
+            self.informar('migración %d aplicada en %.1f s' % (version, time.monotonic() - t0))
+            hechas.append(version)
+        self.version = None
+        return hechas
+
+    # --- utilidades para las migraciones ---
+    def transaccion(self):
+        return _Transaccion(self.conn)
+
+    def existe_tabla(self, tabla):
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                 (tabla,)).fetchone() is not None
+
+    def columnas(self, tabla):
+        return [r[1] for r in self.conn.execute('PRAGMA table_info("%s")' % tabla)]
+
+    def añadir_columna(self, tabla, columna, definicion):
+        """`ALTER TABLE ADD COLUMN` si la tabla existe y no tiene la columna (no reescribe la tabla)."""
+        if not self.existe_tabla(tabla):
+            # create_all la creará completa al arrancar la aplicación
+            self.informar('  tabla %s no existe, nada que hacer' % tabla)
+            return False
+        if columna in self.columnas(tabla):
+            self.informar('  %s.%s ya existe' % (tabla, columna))
+            return False
+        with self.transaccion():
+            self.conn.execute('ALTER TABLE "%s" ADD COLUMN %s %s' % (tabla, columna, definicion))
+        self.informar('  columna %s.%s añadida' % (tabla, columna))
+        return True
+
+    def crear_indice(self, nombre, tabla, columnas):
+        """`CREATE INDEX IF NOT EXISTS` si la tabla existe. Mantiene el lock de escritura mientras se construye.
+
+        Las columnas con paréntesis son expresiones (`lower(username)`) y van tal cual.
+        """
+        if not self.existe_tabla(tabla):
+            return False
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (nombre,)).fetchone():
+            return False
+        t0 = time.monotonic()
+        with self.transaccion():
+            self.conn.execute('CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (
+                nombre, tabla, ', '.join(c if '(' in c else '"%s"' % c for c in columnas)))
+        self.informar('  índice %s creado en %.1f s' % (nombre, time.monotonic() - t0))
+        return True
+
+    def rellenar(self, paso, tabla, sentencia):
+        """Ejecuta `sentencia` (un UPDATE con `:desde` y `:hasta`) por tramos de `lote` ids de `tabla`.
+
+        Cada tramo cubre los ids `desde < id <= hasta` y va en su propia
+        transacción junto con el punto de control, así que una ejecución
+        interrumpida continúa por el primer tramo no terminado.
+        """
+        if not self.existe_tabla(tabla):
+            return 0
+        fila = self.conn.execute('SELECT ultimo_id FROM %s WHERE version = ? AND paso = ?' % TABLA_PROGRESO,
+                                 (self.version, paso)).fetchone()
+        desde = fila[0] if fila else 0
+        maximo = self.conn.execute('SELECT MAX(id) FROM "%s"' % tabla).fetchone()[0] or 0
+        if desde:
+            self.informar('  %s: se continúa tras el id %d' % (paso, desde))
+        filas = 0
+        while desde < maximo:
+            hasta = self.conn.execute('SELECT MAX(id) FROM (SELECT id FROM "%s" WHERE id > ? ORDER BY id LIMIT ?)'
+                                      % tabla, (desde, self.lote)).fetchone()[0]
+            if hasta is None:
+                break
+            with self.transaccion():
+                filas += self.conn.execute(sentencia, {'desde': desde, 'hasta': hasta}).rowcount
+                self.conn.execute('INSERT OR REPLACE INTO %s (version, paso, ultimo_id) VALUES (?, ?, ?)'
+                                  % TABLA_PROGRESO, (self.version, paso, hasta))
+            desde = hasta
+            self.informar('  %s: id %d/%d (%d%%)' % (paso, desde, maximo, 100 * desde // maximo))
+            if self.pausa:
+                time.sleep(self.pausa)
+        return filas
+
+
+class _Transaccion:
+    # BEGIN IMMEDIATE: toma el lock de escritura al empezar (esperando `busy_timeout`)
+    # en lugar de fallar a mitad del paso
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, tipo, _valor, _tb):
+        self.conn.execute('COMMIT' if tipo is None else 'ROLLBACK')
+        return False
+
+
+# --- migraciones ---
+# Las tres primeras sustituyen a los antiguos scripts/add_*_column.py.
+
+@migracion(1, 'campaña.active')
+def _campaña_active(m):
+    # SQLite no tiene tipo booleano nativo: INTEGER 0/1, inactiva por defecto
+    m.añadir_columna('campaña', 'active', 'INTEGER DEFAULT 0')
+
+
+@migracion(2, 'campaña.priority')
+def _campaña_priority(m):
+    m.añadir_columna('campaña', 'priority', 'TEXT')
+
+
+@migracion(3, 'campaña.target_groups')
+def _campaña_target_groups(m):
+    # formato antiguo; la migración 6 lo pasa a campaign_group
+    m.añadir_columna('campaña', 'target_groups', 'TEXT')
+
+
+@migracion(4, 'índices de mensajes, miembros, campañas y resumen diario')
+def _indices(m):
+    # antes de rellenar los contadores: sin ix_user_grupo_grupo ni ix_mensaje_grupo_fecha
+    # cada grupo recorrería las tablas enteras
+    m.crear_indice('ix_user_grupo_grupo', 'user_grupo', ('grupo_id', 'usuario_id'))
+    m.crear_indice('ix_mensaje_fecha_envio', 'mensaje', ('fecha_envio',))
+    m.crear_indice('ix_mensaje_grupo_fecha', 'mensaje', ('grupo_id', 'fecha_envio'))
+    m.crear_indice('ix_mensaje_usuario', 'mensaje', ('usuario_id',))
+    m.crear_indice('ix_campaña_active_date', 'campaña', ('active', 'date'))
+    m.crear_indice('ix_campaña_priority_date', 'campaña', ('priority', 'date'))
+    m.crear_indice('ix_campaña_date', 'campaña', ('date',))
+    m.crear_indice('ix_daily_stats_tipo_dia', 'daily_stats', ('tipo', 'dia'))
+    m.crear_indice('ix_daily_stats_grupo', 'daily_stats', ('grupo_id',))
+    # estadísticas del planificador con muestreo: no recorre las tablas grandes enteras
+    with m.transaccion():
+        m.conn.execute('PRAGMA analysis_limit = 1000')
+        m.conn.execute('ANALYZE')
+
+
+@migracion(5, 'contadores grupo.miembros_count y grupo.mensajes_count')
+def _contadores_grupo(m):
+    for col in ('miembros_count', 'mensajes_count'):
+        m.añadir_columna('grupo', col, 'INTEGER NOT NULL DEFAULT 0')
+    # se recalculan siempre (también si las columnas ya existían): el relleno es
+    # idempotente y así una ejecución cortada entre el ALTER y el primer tramo no
+    # deja los contadores a 0
+    m.rellenar('contadores', 'grupo',
+               'UPDATE grupo SET '
+               'miembros_count = (SELECT COUNT(*) FROM user_grupo WHERE user_grupo.grupo_id = grupo.id), '
+               'mensajes_count = (SELECT COUNT(*) FROM mensaje WHERE mensaje.grupo_id = grupo.id) '
+               'WHERE id > :desde AND id <= :hasta')
+
+
+@migracion(6, 'target_groups en JSON -> campaign_group')
+def _campaign_group(m):
+    if not m.existe_tabla('campaña') or 'target_groups' not in m.columnas('campaña'):
+        return
+    # la tabla nueva puede no existir aún si la aplicación no ha arrancado con esta versión
+    with m.transaccion():
+        m.conn.execute('CREATE TABLE IF NOT EXISTS campaign_group ('
+                       '"campaña_id" INTEGER NOT NULL REFERENCES "campaña" (id), '
+                       'grupo_id INTEGER NOT NULL REFERENCES grupo (id), '
+                       'PRIMARY KEY ("campaña_id", grupo_id))')
+    m.crear_indice('ix_campaign_group_grupo', 'campaign_group', ('grupo_id', 'campaña_id'))
+    # la columna antigua no se toca (es la única copia del JSON original); JSON no
+    # válido o que no sea una lista cuenta como lista vacía y los ids de grupos que
+    # ya no existen se descartan con el JOIN: esas campañas se cuentan al final
+    lista = ("CASE WHEN json_valid(c.target_groups) AND json_type(c.target_groups) = 'array' "
+             "THEN c.target_groups ELSE '[]' END")
+    m.rellenar('target_groups', 'campaña',
+               'INSERT OR IGNORE INTO campaign_group ("campaña_id", grupo_id) '
+               'SELECT c.id, g.id FROM "campaña" c, json_each(%s) j '
+               'JOIN grupo g ON g.id = CAST(j.value AS INTEGER) '
+               'WHERE c.id > :desde AND c.id <= :hasta AND c.target_groups IS NOT NULL' % lista)
+    incompletas = [cid for (cid,) in m.conn.execute(
+        'SELECT c.id FROM "campaña" c WHERE c.target_groups IS NOT NULL AND ('
+        "NOT json_valid(c.target_groups) OR json_type(c.target_groups) != 'array' OR EXISTS ("
+        'SELECT 1 FROM json_each(%s) j WHERE NOT EXISTS ('
+        'SELECT 1 FROM grupo g WHERE g.id = CAST(j.value AS INTEGER)))) ORDER BY c.id' % lista)]
+    if incompletas:
+        m.informar('  AVISO: %d campañas con target_groups no válido o con grupos que ya no existen '
+                   '(se convirtieron sólo los grupos válidos; el JSON sigue en campaña.target_groups): %s%s' % (
+                       len(incompletas), ', '.join(str(c) for c in incompletas[:20]),
+                       ' ...' if len(incompletas) > 20 else ''))
+
+@migracion(7, 'índices lower(username) y lower(email) para la búsqueda de usuarios')
+def _indices_busqueda(m):
+    m.crear_indice('ix_usuario_username_lower', 'usuario', ('lower(username)',))
+    m.crear_indice('ix_usuario_email_lower', 'usuario', ('lower(email)',))
@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
-db = SQLAlchemy()
+from app import passwords
+from app.replica import SesionEnrutada
 
+# la sesión manda las lecturas de las vistas `@solo_lectura` a la réplica (ver app/replica.py)
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 
-# Asociación many-to-many entre usuarios y grupos
+
+# Asociación many-to-many entre usuarios y grupos. La clave primaria
+# (usuario_id, grupo_id) sirve para "grupos de un usuario"; el índice inverso,
+# para "miembros de un grupo" (selector, envíos, vaciar un grupo).
 user_grupo = db.Table(
     'user_grupo',
     db.Column('usuario_id', db.Integer, db.ForeignKey('usuario.id'), primary_key=True),
-    db.Column('grupo_id', db.Integer, db.ForeignKey('grupo.id'), primary_key=True)
+    db.Column('grupo_id', db.Integer, db.ForeignKey('grupo.id'), primary_key=True),
+    db.Index('ix_user_grupo_grupo', 'grupo_id', 'usuario_id'),
+)
+
+# Grupos destinatarios de cada campaña (sustituye al JSON de `Campaña.target_groups`).
+# La clave primaria sirve para "grupos de una campaña"; el índice por grupo, para
+# "campañas que se envían a un grupo".
+campaign_group = db.Table(
+    'campaign_group',
+    db.Column('campaña_id', db.Integer, db.ForeignKey('campaña.id'), primary_key=True),
+    db.Column('grupo_id', db.Integer, db.ForeignKey('grupo.id'), primary_key=True),
+    db.Index('ix_campaign_group_grupo', 'grupo_id', 'campaña_id'),
 )
 
 
@@ -22,12 +38,21 @@ class Usuario(db.Model):  # type: ignore
     role = db.Column(db.String(20), default='user')
 
     def set_password(self, pw):
-        self.password_hash = generate_password_hash(pw)
+        self.password_hash = passwords.generar_hash(pw)
 
-    def check_password(self, pw):
-        if not self.password_hash:
+    def check_password(self, pw, rehash=True):
+        # Si la contraseña es correcta pero el hash usa parámetros antiguos, se
+        # recalcula con PASSWORD_HASH_METHOD (queda pendiente del commit del llamador).
+        if not passwords.verificar(self.password_hash, pw):
             return False
-        return check_password_hash(self.password_hash, pw)
+        if rehash and passwords.necesita_rehash(self.password_hash):
+            self.set_password(pw)
+        return True
+
+
+# búsqueda por prefijo sin distinguir mayúsculas del selector de usuarios (ver app.membership)
+db.Index('ix_usuario_username_lower', db.func.lower(Usuario.username))
+db.Index('ix_usuario_email_lower', db.func.lower(Usuario.email))
 
 
 class Settings(db.Model):  # type: ignore
@@ -41,15 +66,33 @@ class Settings(db.Model):  # type: ignore
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class VersionAjustes(db.Model):  # type: ignore
+    # Contador de cambios de `Settings` (una sola fila). Cada proceso guarda una
+    # copia de los ajustes y sólo la recarga cuando este número cambia (ver
+    # app.settings_cache), en lugar de leer `settings` en cada petición.
+    __tablename__ = 'settings_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Campaña(db.Model):  # type: ignore
+    # índices del listado de administración, el feed y el programador (ver app/campaigns.py);
+    # en BD existentes los crea scripts/migrate.py (ver app/migrations.py)
+    __table_args__ = (
+        db.Index('ix_campaña_active_date', 'active', 'date'),
+        db.Index('ix_campaña_priority_date', 'priority', 'date'),
+        db.Index('ix_campaña_date', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     message = db.Column(db.Text, nullable=False)
-    # grupos destinatarios: almacenados como JSON list of group ids (opcional)
+    # formato antiguo de los grupos destinatarios (JSON list of group ids). Ya no se
+    # escribe: la migración 6 (`scripts/migrate.py`) lo copia a `campaign_group` y lo deja
+    # como estaba, como copia del valor original.
     target_groups = db.Column(db.Text, nullable=True)
     # prioridad: 'alta', 'media', 'baja' (opcional)
     priority = db.Column(db.String(10), nullable=True, default='baja')
-    # bandera para activar/desactivar la campaña (si la BD no tiene esta columna, usar el script en /scripts)
+    # bandera para activar/desactivar la campaña (si la BD no tiene esta columna, ejecutar scripts/migrate.py)
     # Por defecto las campañas nuevas empiezan INACTIVAS; el administrador debe activarlas.
     active = db.Column(db.Boolean, default=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -58,11 +101,21 @@ class Campaña(db.Model):  # type: ignore
 class Grupo(db.Model):  # type: ignore
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), unique=True, nullable=False)
+    # contadores mantenidos en la misma transacción que los cambios (ver app/counters.py)
+    miembros_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    mensajes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # relación con usuarios (muchos a muchos)
     usuarios = db.relationship('Usuario', secondary=user_grupo, backref=db.backref('grupos', lazy=True), lazy=True)
 
 
 class Mensaje(db.Model):  # type: ignore
+    # bandeja y notificaciones ordenan por fecha; informes y borrado de grupos filtran
+    # por grupo; borrar un usuario busca sus mensajes
+    __table_args__ = (
+        db.Index('ix_mensaje_fecha_envio', 'fecha_envio'),
+        db.Index('ix_mensaje_grupo_fecha', 'grupo_id', 'fecha_envio'),
+        db.Index('ix_mensaje_usuario', 'usuario_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     asunto = db.Column(db.String(150))
     contenido = db.Column(db.Text)
@@ -73,3 +126,87 @@ class Mensaje(db.Model):  # type: ignore
 
     grupo = db.relationship('Grupo', backref=db.backref('mensajes', lazy=True))
     usuario = db.relationship('Usuario', backref=db.backref('mensajes', lazy=True))
+
+
+class EjecucionCampaña(db.Model):  # type: ignore
+    # Registro de cada disparo de una campaña para una fecha programada concreta.
+    # La restricción única evita disparar dos veces la misma programación; si la
+    # campaña se reprograma a otra fecha, vuelve a dispararse.
+    __table_args__ = (
+        db.UniqueConstraint('campaña_id', 'fecha_programada', name='uq_ejecucion_campaña_fecha'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaña_id = db.Column(db.Integer, db.ForeignKey('campaña.id'), nullable=False)
+    fecha_programada = db.Column(db.DateTime, nullable=False)
+    disparada_en = db.Column(db.DateTime, default=datetime.utcnow)
+    destinatarios = db.Column(db.Integer, default=0)
+    # 'expandiendo', 'encolada', 'omitida'
+    estado = db.Column(db.String(20), default='expandiendo')
+
+
+class CambioCampaña(db.Model):  # type: ignore
+    # Registro de cambios de campañas (alta, edición, activación, programación,
+    # borrado). El programador lee sólo las filas nuevas para actualizar su heap
+    # en lugar de recorrer toda la tabla `campaña`.
+    id = db.Column(db.Integer, primary_key=True)
+    campaña_id = db.Column(db.Integer, nullable=False)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Entrega(db.Model):  # type: ignore
+    # Outbox de envíos: una fila por (mensaje o ejecución de campaña, destinatario).
+    # Los workers de `app.outbox` reclaman lotes con un lease temporal y registran
+    # el resultado, de modo que un reinicio del proceso no pierde envíos pendientes.
+    __table_args__ = (
+        db.UniqueConstraint('mensaje_id', 'usuario_id', name='uq_entrega_mensaje_usuario'),
+        db.UniqueConstraint('ejecucion_id', 'usuario_id', name='uq_entrega_ejecucion_usuario'),
+        db.Index('ix_entrega_estado_prioridad', 'estado', 'prioridad', 'proximo_intento'),
+        db.Index('ix_entrega_prioridad_entregado', 'prioridad', 'entregado_en'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    mensaje_id = db.Column(db.Integer, db.ForeignKey('mensaje.id'), nullable=True)
+    ejecucion_id = db.Column(db.Integer, db.ForeignKey('ejecucion_campaña.id'), nullable=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    # dirección de destino resuelta al encolar (email, o usuario para SMS)
+    destino = db.Column(db.String(120), nullable=True)
+    # 'pendiente', 'en_curso', 'entregado', 'fallido'
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    # carril de prioridad: 0 = alta, 1 = media, 2 = baja (ver app.outbox.PRIORIDADES)
+    prioridad = db.Column(db.Integer, nullable=False, default=1)
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(64), nullable=True)
+    lease_hasta = db.Column(db.DateTime, nullable=True)
+    ultimo_error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, default=datetime.utcnow)
+    entregado_en = db.Column(db.DateTime, nullable=True)
+
+    mensaje = db.relationship('Mensaje')
+    ejecucion = db.relationship('EjecucionCampaña')
+    usuario = db.relationship('Usuario')
+
+
+class EstadisticaDiaria(db.Model):  # type: ignore
+    # Resumen diario de mensajes y campañas (ver app.stats). Se mantiene de forma
+    # incremental al crear, modificar o borrar filas, así que los informes leen
+    # O(días) filas en lugar de recorrer `mensaje`. Las dimensiones que no aplican
+    # se guardan como 0 / '' (no NULL) para que la restricción única funcione.
+    __tablename__ = 'daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('dia', 'tipo', 'grupo_id', 'modalidad', 'prioridad', name='uq_daily_stats_clave'),
+        # totales por tipo en un rango de días y borrado de las filas de un grupo
+        db.Index('ix_daily_stats_tipo_dia', 'tipo', 'dia'),
+        db.Index('ix_daily_stats_grupo', 'grupo_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False, index=True)
+    # 'mensaje' o 'campaña'
+    tipo = db.Column(db.String(10), nullable=False)
+    # grupo del mensaje; 0 para campañas (pueden apuntar a varios grupos)
+    grupo_id = db.Column(db.Integer, nullable=False, default=0)
+    modalidad = db.Column(db.String(50), nullable=False, default='')
+    prioridad = db.Column(db.String(10), nullable=False, default='')
+    total = db.Column(db.Integer, nullable=False, default=0)
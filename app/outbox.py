@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Cola persistente de envíos (outbox).
+
+Cada `Mensaje` se expande al guardarse en una fila `Entrega` por destinatario,
+dentro de la misma transacción. Los workers (ver `scripts/delivery_worker.py`)
+reclaman lotes marcándolos con un lease temporal; si un worker muere, el lease
+caduca y otro worker vuelve a reclamar las filas. Los errores se reintentan con
+backoff exponencial hasta `OUTBOX_MAX_INTENTOS`.
+
+Cada entrega va en un carril de prioridad (alta / media / baja). Los lotes se
+reparten entre carriles por pesos (`OUTBOX_PESOS`, por defecto 6:3:1) y las
+entregas que llevan esperando más de `OUTBOX_ENVEJECIMIENTO` segundos suben un
+carril (baja pesa como media, media como alta), de modo que la prioridad baja
+nunca se queda sin servicio y la alta conserva siempre su parte del lote.
+"""
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, or_, select, update, insert, literal, func, case, union_all, cast, Float
+
+from app.models import db, Entrega, Usuario, user_grupo
+from app.transports import enviar_entregas, cerrar_transportes, normalizar_modalidad, MODALIDAD_SMS
+
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en_curso'
+ENTREGADO = 'entregado'
+FALLIDO = 'fallido'
+
+# Carriles de prioridad (valor guardado en `Entrega.prioridad`)
+PRIORIDADES = {'alta': 0, 'media': 1, 'baja': 2}
+# Los mensajes redactados a mano no tienen prioridad: van en el carril intermedio
+PRIORIDAD_MENSAJE = 'media'
+
+# Valores por defecto (se pueden sobrescribir desde la configuración de la app)
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_INTENTOS = 5
+DEFAULT_BACKOFF_BASE = 30
+DEFAULT_BACKOFF_MAX = 3600
+DEFAULT_PESOS = {'alta': 6, 'media': 3, 'baja': 1}
+DEFAULT_ENVEJECIMIENTO = 600
+
+
+def _cfg(key, default):
+    try:
+        return current_app.config.get(key, default)
+    except RuntimeError:
+        return default
+
+
+def prioridad_num(prioridad):
+    """Carril numérico de una prioridad textual ('alta', 'media', 'baja')."""
+    return PRIORIDADES.get((prioridad or '').strip().lower(), PRIORIDADES['baja'])
+
+
+def worker_id():
+    """Identificador estable del proceso actual (host:pid)."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def encolar_mensaje(mensaje):
+    """Crea las filas `Entrega` de todos los miembros del grupo del mensaje.
+
+    Usa un único INSERT ... SELECT sobre `user_grupo`, así que el coste para la
+    petición web no depende de cargar los usuarios en Python. No hace commit:
+    debe llamarse en la misma transacción que inserta el `Mensaje`.
+    Devuelve el número de filas encoladas.
+    """
+    if mensaje.id is None:
+        db.session.flush()
+    now = datetime.utcnow()
+    t = Entrega.__table__
+    # Usuario no tiene columna de teléfono: para SMS el destino es el nombre de
+    # usuario (cuenta/número de la línea); para correo, el email.
+    if normalizar_modalidad(mensaje.modalidad) == MODALIDAD_SMS:
+        destino = Usuario.username
+    else:
+        destino = Usuario.email
+    origen = (
+        select(
+            literal(mensaje.id),
+            Usuario.id,
+            destino,
+            literal(PENDIENTE),
+            literal(PRIORIDADES[PRIORIDAD_MENSAJE]),
+            literal(0),
+            literal(now),
+            literal(now),
+        )
+        .select_from(user_grupo.join(Usuario, Usuario.id == user_grupo.c.usuario_id))
+        .where(user_grupo.c.grupo_id == mensaje.grupo_id)
+    )
+    stmt = insert(t).from_select(
+        ['mensaje_id', 'usuario_id', 'destino', 'estado', 'prioridad', 'intentos', 'proximo_intento', 'creado'],
+        origen,
+    ).prefix_with('OR IGNORE', dialect='sqlite')
+    result = db.session.execute(stmt)
+    return result.rowcount or 0
+
+
+def encolar_destinatarios(ejecucion_id, destinatarios, prioridad='baja'):
+    """Crea filas `Entrega` (por correo) de una ejecución de campaña.
+
+    `destinatarios` es un lote acotado de `(usuario_id, email)` como los que genera
+    `app.recipients.expandir`, así que no hace falta volver a leer `usuario`.
+    Duplicados se ignoran por la restricción única (ejecucion_id, usuario_id).
+    No hace commit.
+    """
+    if not destinatarios:
+        return 0
+    now = datetime.utcnow()
+    prio = prioridad_num(prioridad)
+    stmt = insert(Entrega.__table__).prefix_with('OR IGNORE', dialect='sqlite')
+    result = db.session.execute(stmt, [
+        {'ejecucion_id': ejecucion_id, 'usuario_id': uid, 'destino': email, 'estado': PENDIENTE,
+         'prioridad': prio, 'intentos': 0, 'proximo_intento': now, 'creado': now}
+        for uid, email in destinatarios
+    ])
+    return result.rowcount if result.rowcount and result.rowcount > 0 else 0
+
+
+def _reclamables(t, now):
+    # filas pendientes cuyo turno llegó, o en curso con el lease caducado
+    return or_(
+        and_(t.c.estado == PENDIENTE, t.c.proximo_intento <= now),
+        and_(t.c.estado == EN_CURSO, t.c.lease_hasta < now),
+    )
+
+
+def en_curso_expr(now=None):
+    """Subconsulta escalar: entregas en curso con lease vigente (en todos los workers)."""
+    now = now or datetime.utcnow()
+    t = Entrega.__table__
+    return (
+        select(func.count(t.c.id))
+        .where(t.c.estado == EN_CURSO, t.c.lease_hasta >= now)
+        .scalar_subquery()
+    )
+
+
+def _candidatos(t, now, limite, tope):
+    """Subconsulta con los IDs a reclamar, ordenados por cola justa ponderada.
+
+    De cada carril se toman como mucho `limite` filas (por índice), se numeran
+    dentro del carril y se ordenan por `n / peso`: con pesos 6:3:1 un lote lleno
+    lleva ~60% alta, ~30% media y ~10% baja, y si un carril está vacío los demás
+    ocupan su hueco. Las filas creadas antes del corte de envejecimiento usan el
+    peso del carril inmediatamente superior: un atasco de baja envejecida recibe
+    el reparto de media (6:3:3, alta ~50%), nunca el lote entero.
+    """
+    pesos = dict(DEFAULT_PESOS)
+    pesos.update(_cfg('OUTBOX_PESOS', None) or {})
+    corte = now - timedelta(seconds=_cfg('OUTBOX_ENVEJECIMIENTO', DEFAULT_ENVEJECIMIENTO))
+
+    carriles = []
+    for nombre, num in sorted(PRIORIDADES.items(), key=lambda x: x[1]):
+        carril = (
+            select(t.c.id, t.c.prioridad, t.c.creado, t.c.proximo_intento)
+            .where(_reclamables(t, now), t.c.prioridad == num)
+            .order_by(t.c.proximo_intento, t.c.id)
+            .limit(limite)
+            .subquery()
+        )
+        carriles.append(select(carril))
+    c = union_all(*carriles).subquery('c')
+    n = func.row_number().over(partition_by=c.c.prioridad, order_by=(c.c.proximo_intento, c.c.id))
+    r = select(c.c.id, c.c.prioridad, c.c.creado, n.label('n')).subquery('r')
+    por_carril = {num: max(1, int(pesos.get(nombre, 1))) for nombre, num in PRIORIDADES.items()}
+    # envejecida: peso del carril de encima (alta se queda con el suyo)
+    promocion = {num: por_carril.get(num - 1, por_carril[num]) for num in por_carril}
+    peso = case(*[(and_(r.c.prioridad == num, r.c.creado < corte), promocion[num]) for num in por_carril],
+                *[(r.c.prioridad == num, por_carril[num]) for num in por_carril],
+                else_=1)
+    clave = cast(r.c.n, Float) / peso
+    return select(r.c.id).order_by(clave, r.c.prioridad, r.c.id).limit(tope)
+
+
+def reclamar_lote(owner=None, limite=None, lease_segundos=None, capacidad=None):
+    """Reclama hasta `limite` entregas para `owner` y las devuelve.
+
+    El reclamo es un único UPDATE condicionado: si dos workers compiten por las
+    mismas filas, sólo uno de ellos las marca (la condición se vuelve a evaluar
+    sobre cada fila al actualizarla). Hace commit para que el lease sea visible.
+    El reparto entre carriles de prioridad se describe en `_candidatos`.
+
+    `capacidad` (entero o expresión SQL) limita el total de entregas en curso
+    entre todos los workers: el LIMIT se calcula dentro del mismo UPDATE como
+    `capacidad - en_curso`, así que no hay carrera entre el conteo y el reclamo.
+    """
+    owner = owner or worker_id()
+    limite = limite if limite is not None else _cfg('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    lease_segundos = lease_segundos if lease_segundos is not None else _cfg('OUTBOX_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    if limite <= 0:
+        return []
+
+    now = datetime.utcnow()
+    token = '%s/%s' % (owner, uuid.uuid4().hex[:12])
+    t = Entrega.__table__
+    tope = limite
+    if capacidad is not None:
+        libres = capacidad - en_curso_expr(now)
+        tope = case((libres <= 0, 0), (libres < limite, libres), else_=limite)
+    candidatos = _candidatos(t, now, limite, tope)
+    db.session.execute(
+        update(t)
+        .where(t.c.id.in_(candidatos.scalar_subquery()), _reclamables(t, now))
+        .values(
+            estado=EN_CURSO,
+            lease_owner=token[:64],
+            lease_hasta=now + timedelta(seconds=lease_segundos),
+            intentos=t.c.intentos + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return Entrega.query.filter_by(lease_owner=token[:64], estado=EN_CURSO).order_by(Entrega.prioridad, Entrega.id).all()
+
+
+def backoff(intentos):
+    """Segundos de espera antes del siguiente intento (exponencial con jitter)."""
+    base = _cfg('OUTBOX_BACKOFF_BASE', DEFAULT_BACKOFF_BASE)
+    tope = _cfg('OUTBOX_BACKOFF_MAX', DEFAULT_BACKOFF_MAX)
+    espera = min(tope, base * (2 ** max(0, intentos - 1)))
+    return espera * random.uniform(0.8, 1.2)
+
+
+def marcar_entregadas(ids, lease_owner):
+    """Marca como entregadas las filas `ids` (sólo si el lease sigue siendo de `lease_owner`).
+
+    No hace commit.
+    """
+    if not ids:
+        return 0
+    t = Entrega.__table__
+    result = db.session.execute(
+        update(t)
+        .where(t.c.id.in_(ids), t.c.lease_owner == lease_owner, t.c.estado == EN_CURSO)
+        .values(estado=ENTREGADO, entregado_en=datetime.utcnow(), lease_owner=None, lease_hasta=None, ultimo_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+def marcar_error(entrega, error):
+    """Registra un fallo: reprograma con backoff o marca `fallido` si se agotaron los intentos.
+
+    No hace commit.
+    """
+    max_intentos = _cfg('OUTBOX_MAX_INTENTOS', DEFAULT_MAX_INTENTOS)
+    now = datetime.utcnow()
+    t = Entrega.__table__
+    if entrega.intentos >= max_intentos:
+        valores = dict(estado=FALLIDO, lease_owner=None, lease_hasta=None)
+    else:
+        valores = dict(estado=PENDIENTE, lease_owner=None, lease_hasta=None,
+                       proximo_intento=now + timedelta(seconds=backoff(entrega.intentos)))
+    valores['ultimo_error'] = str(error)[:1000]
+    db.session.execute(
+        update(t)
+        .where(t.c.id == entrega.id, t.c.lease_owner == entrega.lease_owner, t.c.estado == EN_CURSO)
+        .values(**valores)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def procesar_lote(owner=None, enviar=None, limite=None, capacidad=None):
+    """Reclama un lote, lo envía y registra el resultado. Devuelve el nº de filas procesadas.
+
+    `enviar(entregas)` debe devolver un dict `{entrega_id: error}` con los fallos;
+    las entregas que no aparecen se consideran entregadas. Por defecto se usan
+    los transportes configurados (`app.transports.enviar_entregas`).
+    """
+    enviar = enviar or enviar_entregas
+    lote = reclamar_lote(owner, limite=limite, capacidad=capacidad)
+    if not lote:
+        return 0
+    try:
+        errores = enviar(lote) or {}
+    except Exception as e:
+        current_app.logger.exception('Error enviando lote de %d entregas: %s', len(lote), e)
+        errores = {x.id: e for x in lote}
+
+    for e in lote:
+        if e.id in errores:
+            marcar_error(e, errores[e.id])
+    marcar_entregadas([e.id for e in lote if e.id not in errores], lote[0].lease_owner)
+    db.session.commit()
+    return len(lote)
+
+
+def ejecutar_worker(app, owner=None, enviar=None, stop_event=None, espera=1.0, capacidad=None):
+    """Bucle principal de un worker: procesa lotes hasta que `stop_event` se active."""
+    owner = owner or worker_id()
+    with app.app_context():
+        app.logger.info('Worker de envíos %s iniciado', owner)
+        while not (stop_event and stop_event.is_set()):
+            try:
+                procesados = procesar_lote(owner, enviar=enviar, capacidad=capacidad)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception('Error en worker de envíos: %s', e)
+                procesados = 0
+            finally:
+                db.session.remove()
+            if not procesados:
+                if stop_event:
+                    stop_event.wait(espera)
+                else:
+                    time.sleep(espera)
+        cerrar_transportes()
+        app.logger.info('Worker de envíos %s detenido', owner)
+
+
+def estadisticas():
+    """Conteo de entregas por estado."""
+    rows = db.session.query(Entrega.estado, db.func.count(Entrega.id)).group_by(Entrega.estado).all()
+    out = {PENDIENTE: 0, EN_CURSO: 0, ENTREGADO: 0, FALLIDO: 0}
+    out.update({estado: n for estado, n in rows})
+    return out
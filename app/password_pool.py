@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Verificación de contraseñas en un pool de procesos acotado.
+
+El hash de una contraseña cuesta decenas o cientos de ms de CPU (ver
+`scripts/bench_password_hash.py`). Para que una avalancha de logins (p. ej. al
+terminar un mantenimiento) no ocupe todos los hilos web, las verificaciones se
+ejecutan en `PASSWORD_POOL_WORKERS` procesos aparte y, como mucho,
+`PASSWORD_POOL_MAX_PENDIENTES` por proceso web pueden estar en cola o en curso.
+Si no hay hueco, `comprobar()` lanza `Sobrecarga` al instante y la vista
+responde "inténtalo de nuevo" (503) sin esperar; las páginas que no verifican
+contraseñas no se ven afectadas.
+
+Con `PASSWORD_POOL_WORKERS = 0` la verificación se hace en el propio hilo,
+con el mismo control de admisión.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+
+from flask import current_app
+
+from app import passwords
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 5.0
+# Segundos sugeridos al cliente en `Retry-After` cuando hay sobrecarga
+RETRY_AFTER = 2
+
+
+class Sobrecarga(Exception):
+    """No hay capacidad para verificar otra contraseña ahora mismo."""
+
+
+def _verificar_en_proceso(password_hash, pw, metodo):
+    # se ejecuta en el proceso del pool: sin contexto de aplicación
+    if not passwords.verificar(password_hash, pw):
+        return False, None
+    if metodo and passwords.necesita_rehash(password_hash, metodo):
+        return True, passwords.generar_hash(pw, metodo)
+    return True, None
+
+
+class PoolContraseñas:
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pendientes=None, timeout=DEFAULT_TIMEOUT):
+        self.workers = max(0, int(workers))
+        self.max_pendientes = max_pendientes or max(1, self.workers) * 4
+        self.timeout = timeout
+        self._admision = threading.BoundedSemaphore(self.max_pendientes)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ejecutor(self):
+        # el pool se crea en el primer uso y de nuevo tras un fork (workers de gunicorn)
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def verificar(self, password_hash, pw, metodo=None):
+        """Devuelve `(ok, nuevo_hash)`; `nuevo_hash` sólo si hay que actualizarlo.
+
+        Lanza `Sobrecarga` si ya hay `max_pendientes` verificaciones en marcha o si
+        la respuesta tarda más de `timeout` segundos.
+        """
+        if not password_hash:
+            return False, None
+        if not self._admision.acquire(blocking=False):
+            raise Sobrecarga()
+        if not self.workers:
+            try:
+                return _verificar_en_proceso(password_hash, pw, metodo)
+            finally:
+                self._admision.release()
+        try:
+            futuro = self._ejecutor().submit(_verificar_en_proceso, password_hash, pw, metodo)
+        except Exception:
+            self._admision.release()
+            raise
+        # el hueco se libera cuando el proceso termina, no cuando se deja de esperar
+        futuro.add_done_callback(lambda _: self._admision.release())
+        try:
+            return futuro.result(timeout=self.timeout)
+        except FuturesTimeout:
+            futuro.cancel()
+            raise Sobrecarga()
+
+    def cerrar(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+
+_lock_pool = threading.Lock()
+
+
+def _pool():
+    pool = current_app.extensions.get('password_pool')
+    if pool is not None:
+        return pool
+    with _lock_pool:
+        pool = current_app.extensions.get('password_pool')
+        if pool is not None:
+            return pool
+        cfg = current_app.config
+        pool = current_app.extensions['password_pool'] = PoolContraseñas(
+            workers=cfg.get('PASSWORD_POOL_WORKERS', DEFAULT_WORKERS),
+            max_pendientes=cfg.get('PASSWORD_POOL_MAX_PENDIENTES'),
+            timeout=cfg.get('PASSWORD_POOL_TIMEOUT', DEFAULT_TIMEOUT),
+        )
+        atexit.register(pool.cerrar)
+        return pool
+
+
+def comprobar(usuario, pw, rehash=True):
+    """Verifica la contraseña de `usuario` en el pool.
+
+    Si es correcta y el hash usa parámetros antiguos, actualiza
+    `usuario.password_hash` (el commit queda a cargo del llamador).
+    Lanza `Sobrecarga` si no hay capacidad.
+    """
+    metodo = passwords.metodo_actual() if rehash else None
+    ok, nuevo_hash = _pool().verificar(usuario.password_hash, pw, metodo)
+    if ok and nuevo_hash:
+        usuario.password_hash = nuevo_hash
+    return ok
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Hash de contraseñas con parámetros configurables.
+
+El método se toma de `PASSWORD_HASH_METHOD` (formato de Werkzeug, p. ej.
+'scrypt:32768:8:1' o 'pbkdf2:sha256:600000'). Los hashes guardados con otro
+método siguen siendo válidos; al iniciar sesión correctamente se vuelven a
+calcular con el método vigente (ver `Usuario.check_password`).
+
+Para elegir parámetros: `python .\\scripts\\bench_password_hash.py` mide
+cuántos logins por segundo y núcleo permite cada método.
+"""
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METODO = 'scrypt:32768:8:1'
+
+
+def metodo_actual():
+    try:
+        return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METODO)
+    except RuntimeError:
+        return DEFAULT_METODO
+
+
+@lru_cache(maxsize=16)
+def _prefijo(metodo):
+    # Werkzeug completa los parámetros omitidos ('scrypt' -> 'scrypt:32768:8:1');
+    # se calcula una vez el prefijo real para poder comparar con los hashes guardados.
+    return generate_password_hash('', method=metodo).split('$', 1)[0]
+
+
+def generar_hash(pw, metodo=None):
+    return generate_password_hash(pw, method=metodo or metodo_actual())
+
+
+def verificar(password_hash, pw):
+    if not password_hash:
+        return False
+    return check_password_hash(password_hash, pw)
+
+
+def necesita_rehash(password_hash, metodo=None):
+    """True si el hash no se generó con el método (y parámetros) vigentes."""
+    if not password_hash:
+        return False
+    return password_hash.split('$', 1)[0] != _prefijo(metodo or metodo_actual())
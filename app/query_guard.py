@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Contador de sentencias SQL para pruebas y diagnóstico.
+
+Uso en un test:
+
+    from app.query_guard import max_consultas
+
+    with max_consultas(4):
+        client.get('/home')
+
+Falla con AssertionError (listando las sentencias) si la petición ejecuta más
+de 4 sentencias. Como el número no debe depender de cuántas filas haya, es la
+forma de detectar consultas N+1 (p. ej. cargas perezosas de `Mensaje.usuario`).
+Sólo se cuentan las sentencias del hilo que abrió el contador.
+
+`sin_escaneos()` comprueba además el plan de cada sentencia: al salir del
+bloque ejecuta `EXPLAIN QUERY PLAN` (SQLite) sobre todas y falla si alguna
+recorre una tabla entera, sin índice (`SCAN <tabla>`) o por un índice
+completo (`SCAN <tabla> USING [COVERING] INDEX`), o busca en un rango abierto
+por un solo lado (`SEARCH ... (fecha>?)`), que crece con la tabla. Las
+sentencias con LIMIT no cuentan: paran tras un número fijo de filas. Ver
+`scripts/check_query_plans.py`, que lo aplica a las consultas más usadas.
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class ContadorConsultas:
+
+    def __init__(self, engine=None):
+        # sin engine explícito se escuchan todos los engines del proceso
+        self.engine = engine or Engine
+        self.sentencias = []
+        self._hilo = None
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._hilo:
+            self.sentencias.append(statement)
+
+    @property
+    def total(self):
+        return len(self.sentencias)
+
+    def __enter__(self):
+        self._hilo = threading.get_ident()
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+def contar_consultas(engine=None):
+    """Context manager que acumula las sentencias ejecutadas en `.sentencias`."""
+    return ContadorConsultas(engine)
+
+
+@contextmanager
+def max_consultas(limite, engine=None):
+    """Falla si dentro del bloque se ejecutan más de `limite` sentencias."""
+    with ContadorConsultas(engine) as contador:
+        yield contador
+    if contador.total > limite:
+        detalle = '\n'.join('  %d. %s' % (i + 1, s.strip().splitlines()[0]) for i, s in enumerate(contador.sentencias))
+        raise AssertionError('Se esperaban como mucho %d consultas y se ejecutaron %d:\n%s' % (limite, contador.total, detalle))
+
+
+# "SCAN tabla", con o sin índice (un índice completo también crece con la tabla);
+# "SCAN CONSTANT ROW", las tablas virtuales y las subconsultas materializadas no cuentan
+_RE_SCAN = re.compile(r'^SCAN (\S+)(?: AS \S+)?(?: USING (?:COVERING )?INDEX \S+)?$')
+# búsqueda por índice: las restricciones entre paréntesis
+_RE_SEARCH = re.compile(r'^SEARCH (\S+)(?: AS \S+)? USING (?:(?:COVERING )?INDEX \S+|INTEGER PRIMARY KEY) \((.*)\)')
+_RE_SUBCONSULTA = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\S+)')
+_RE_LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+def _rango_abierto(restricciones):
+    # sin igualdad y con un solo extremo (`fecha>?`): recorre todo lo que hay a un lado
+    return '=' not in restricciones and not ('>' in restricciones and '<' in restricciones)
+
+
+def _recorrido(detalle):
+    """Tabla que recorre la línea de plan `detalle` sin acotar, o None."""
+    m = _RE_SCAN.match(detalle)
+    if m:
+        return m.group(1)
+    m = _RE_SEARCH.match(detalle)
+    if m and _rango_abierto(m.group(2)):
+        return m.group(1)
+    return None
+
+
+class GuardiaPlanes:
+
+    def __init__(self, permitir=(), engine=None):
+        self.permitir = set(permitir)
+        self.engine = engine or Engine
+        self.sentencias = []
+        self.escaneos = []
+        self._hilo = None
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() != self._hilo or executemany:
+            return
+        if statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+            self.sentencias.append((conn.engine, statement, parameters))
+
+    def __enter__(self):
+        self._hilo = threading.get_ident()
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        if exc[0] is None:
+            self.comprobar()
+        return False
+
+    def plan(self, engine, statement, parameters):
+        with engine.connect() as conn:
+            return [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters or ())]
+
+    def comprobar(self):
+        for engine, statement, parameters in self.sentencias:
+            if engine.dialect.name != 'sqlite' or _RE_LIMIT.search(statement):
+                continue
+            detalles = [d.strip() for d in self.plan(engine, statement, parameters)]
+            derivadas = {m.group(1) for m in map(_RE_SUBCONSULTA.match, detalles) if m}
+            for d in detalles:
+                tabla = _recorrido(d)
+                if tabla and tabla not in derivadas and tabla not in self.permitir:
+                    self.escaneos.append((d, statement))
+        if self.escaneos:
+            detalle = '\n'.join('  %s: %s' % (d, ' '.join(s.split())[:200]) for d, s in self.escaneos)
+            raise AssertionError('Recorridos completos de tabla o de rango abierto:\n%s' % detalle)
+
+
+def sin_escaneos(permitir=(), engine=None):
+    """Falla si alguna sentencia sin LIMIT del bloque recorre una tabla o un rango abierto.
+
+    `permitir` lista tablas (o alias) que se pueden recorrer, p. ej. tablas de
+    configuración de una fila.
+    """
+    return GuardiaPlanes(permitir, engine)
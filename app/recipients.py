@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Expansión de grupos a destinatarios únicos, en streaming.
+
+`expandir(grupo_ids)` recorre `user_grupo` (unido a `usuario` para traer el
+email) ordenado por `usuario_id`, en tramos de `tamaño` filas con paginación por
+clave, y genera lotes de `(usuario_id, email)`. Cada tramo se lee con un cursor
+en streaming (`yield_per`; en PostgreSQL es un cursor del servidor) y se
+consume entero antes de entregar el lote, así el llamador puede hacer commit
+entre lotes sin dejar una lectura abierta.
+
+Como las filas llegan ordenadas por usuario, las repeticiones de un usuario que
+está en varios grupos son consecutivas: basta con recordar el último ID emitido
+para descartarlas. La memoria usada es la de un lote, sea cual sea el tamaño de
+los grupos; nunca se materializa la lista completa.
+"""
+from sqlalchemy import select
+
+from app.models import db, Usuario, user_grupo
+
+DEFAULT_TAMAÑO = 1000
+
+
+def expandir(grupo_ids, tamaño=DEFAULT_TAMAÑO, desde=0):
+    """Genera lotes de `(usuario_id, email)` únicos de los miembros de `grupo_ids`.
+
+    `desde` permite reanudar una expansión: sólo se devuelven usuarios con ID
+    mayor. Los lotes pueden traer menos de `tamaño` filas si había repetidos.
+    """
+    grupo_ids = sorted(set(grupo_ids or []))
+    if not grupo_ids:
+        return
+    consulta = (
+        select(user_grupo.c.usuario_id, Usuario.email)
+        .join(Usuario, Usuario.id == user_grupo.c.usuario_id)
+        .where(user_grupo.c.grupo_id.in_(grupo_ids))
+        .order_by(user_grupo.c.usuario_id)
+        .limit(tamaño)
+    )
+    ultimo = desde or 0
+    while True:
+        lote = []
+        leidas = 0
+        resultado = db.session.execute(
+            consulta.where(user_grupo.c.usuario_id > ultimo),
+            execution_options={'yield_per': tamaño},
+        )
+        for usuario_id, email in resultado:
+            leidas += 1
+            if usuario_id != ultimo:
+                lote.append((usuario_id, email))
+                ultimo = usuario_id
+        if lote:
+            yield lote
+        if leidas < tamaño:
+            return
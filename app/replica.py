@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Separación de lecturas y escrituras: las vistas de sólo lectura usan una réplica.
+
+Las vistas pesadas de consulta (informes, dashboard, notificaciones, listado de
+grupos) se marcan con `@solo_lectura`. Durante esas peticiones GET, la sesión
+(`SesionEnrutada`) manda las SELECT al engine de lectura; los flush y las
+sentencias INSERT/UPDATE/DELETE siguen yendo al engine principal.
+
+El engine de lectura se configura con `READ_REPLICA_URI`:
+
+- `None` (por defecto): si la base de datos principal es un fichero SQLite, se
+  abre el mismo fichero en modo sólo lectura (`mode=ro`). En WAL (ver
+  `app.sqlite_profile`) esas lecturas no bloquean ni esperan a los envíos y
+  logins que escriben. Con otros motores no hay réplica.
+- una URI: la réplica de lectura (p. ej. un PostgreSQL en streaming replication).
+- `False`: sin réplica.
+
+Sin réplica, o fuera de una vista marcada, todo va al engine principal. Al
+arrancar se prueba una conexión a la réplica; si falla, se registra un aviso y
+se trabaja sin réplica.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import URL
+from sqlalchemy.sql.dml import UpdateBase
+
+from app import sqlite_profile
+
+EXTENSION = 'read_replica'
+METODOS_LECTURA = ('GET', 'HEAD')
+
+
+def _lectura_activa():
+    return has_app_context() and g.get('solo_lectura', False)
+
+
+def motor_lectura():
+    """Engine de la réplica de la app actual, o None si no hay."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION)
+
+
+class SesionEnrutada(Session):
+    """Sesión de Flask-SQLAlchemy que envía las lecturas de vistas `@solo_lectura` a la réplica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and _lectura_activa():
+            engine = motor_lectura()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def solo_lectura(f):
+    """Marca una vista: sus peticiones GET/HEAD leen de la réplica (si la hay)."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if request.method in METODOS_LECTURA:
+            g.solo_lectura = True
+        return f(*args, **kwargs)
+    return decorated
+
+
+@contextmanager
+def lecturas():
+    """Igual que `@solo_lectura` para un bloque de código (necesita contexto de aplicación)."""
+    anterior = g.get('solo_lectura', False)
+    g.solo_lectura = True
+    try:
+        yield
+    finally:
+        g.solo_lectura = anterior
+
+
+def _uri_solo_lectura(url):
+    # mismo fichero SQLite abierto como URI con mode=ro; `as_uri` codifica la
+    # ruta (`#`, `?`, `%`, espacios...) y URL.create la pasa tal cual a sqlite3
+    return URL.create('sqlite', database=Path(url.database).resolve().as_uri(),
+                      query={'mode': 'ro', 'uri': 'true'})
+
+
+def _probar(engine):
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+
+def init_app(app, db):
+    """Crea el engine de lectura según `READ_REPLICA_URI` (llamar tras `db.init_app`)."""
+    uri = app.config.get('READ_REPLICA_URI')
+    if uri is False:
+        return
+    with app.app_context():
+        principal = db.engines[None]
+    if not uri:
+        if principal.dialect.name != 'sqlite' or not sqlite_profile.es_fichero_sqlite(principal.url):
+            return
+        # mode=ro no crea el fichero: en una instalación nueva lo crea antes la conexión principal
+        with principal.connect():
+            pass
+        uri = _uri_solo_lectura(principal.url)
+        opciones = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    else:
+        opciones = dict(app.config.get('READ_REPLICA_ENGINE_OPTIONS') or {})
+    engine = create_engine(uri, **opciones)
+    if engine.dialect.name == 'sqlite':
+        pragmas = app.config.get('SQLITE_PRAGMAS', sqlite_profile.DEFAULT_PRAGMAS)
+        if pragmas:
+            # el modo de journal lo fija la conexión principal; la réplica no escribe nunca
+            pragmas = {k: v for k, v in pragmas.items() if k != 'journal_mode'}
+            pragmas['query_only'] = 1
+            sqlite_profile.aplicar_pragmas(engine, pragmas)
+    try:
+        _probar(engine)
+    except Exception:
+        # una réplica que no abre no debe tumbar las vistas de lectura: van a la principal
+        app.logger.warning('Réplica de lectura no disponible, se usa la base de datos principal', exc_info=True)
+        engine.dispose()
+        return
+    app.extensions[EXTENSION] = engine
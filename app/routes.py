@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
 from app.models import Usuario, Grupo, db, Mensaje
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.exc import IntegrityError
-from threading import Thread
 from app.forms import LoginForm, ChangePasswordForm, GroupForm
+from app.outbox import encolar_mensaje
+from app import feed, stats
+from app.settings_cache import ajustes
+from app import password_pool
+from app import membership, campaign_groups
+from app.replica import solo_lectura
 
 main_bp = Blueprint('main', __name__)
 
 
+def _sobrecarga(plantilla, **contexto):
+    # respuesta inmediata cuando el pool de contraseñas está lleno
+    flash('Hay muchas solicitudes en este momento. Inténtalo de nuevo en unos segundos.', 'error')
+    return render_template(plantilla, **contexto), 503, {'Retry-After': str(password_pool.RETRY_AFTER)}
+
+
 @main_bp.route('/', methods=['GET', 'POST'])
 def index():
     form = LoginForm()
@@ -44,10 +54,18 @@ def index():
 
         usuario = Usuario.query.filter_by(username=username).first()
 
-        if usuario and usuario.check_password(password):
+        # la verificación del hash se hace en el pool de procesos (app/password_pool.py)
+        try:
+            password_ok = bool(usuario) and password_pool.comprobar(usuario, password)
+        except password_pool.Sobrecarga:
+            return _sobrecarga('portal.html', form=form)
+
+        if password_ok:
+            if usuario in db.session.dirty:
+                # hash recalculado con los parámetros vigentes
+                db.session.commit()
             # Si el modo mantenimiento está activo, solo permitir login a administradores.
-            from app.models import Settings
-            settings = Settings.query.first()
+            settings = ajustes()
             maintenance_active = False
             maintenance_message = None
             try:
@@ -91,11 +109,26 @@ def logout():
 def home():
     if not session.get('logged_in'):
         return redirect(url_for('main.login'))
-    messages = Mensaje.query.all()
+    # sólo la ventana más reciente; el resto se pide con "Cargar más" (main.home_mensajes)
+    messages, next_cursor = feed.bandeja(limite=current_app.config.get('HOME_PAGE_SIZE', 20))
     # pasar settings para que la UI de usuarios refleje configuraciones
-    from app.models import Settings
-    settings = Settings.query.first()
-    return render_template('home.html', usuario=session.get('username'), messages=messages, settings=settings)
+    settings = ajustes()
+    return render_template('home.html', usuario=session.get('username'), messages=messages, next_cursor=next_cursor, settings=settings)
+
+
+@main_bp.route('/home/mensajes', methods=['GET'])
+def home_mensajes():
+    # JSON para "Cargar más" en la bandeja de inicio (paginación por cursor)
+    if not session.get('logged_in'):
+        return jsonify({'error': 'no autenticado'}), 401
+    try:
+        limite = min(100, max(1, int(request.args.get('limit', current_app.config.get('HOME_PAGE_SIZE', 20)))))
+    except ValueError:
+        limite = 20
+    items, next_cursor = feed.bandeja(limite=limite, cursor=request.args.get('cursor'))
+    for item in items:
+        item['fecha'] = item['fecha'].strftime('%d/%m/%Y %H:%M') if item['fecha'] else ''
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 
 @main_bp.route('/redactar', methods=['GET', 'POST'])
@@ -132,7 +165,9 @@ def redactar():
             flash("Usuario no encontrado", "error")
             return redirect(url_for('main.redactar'))
 
-        # Guardar un registro del mensaje "enviado"
+        # Guardar el mensaje y encolar una entrega por destinatario en la misma
+        # transacción: los workers de `scripts/delivery_worker.py` hacen el envío real,
+        # así un reinicio del proceso no pierde el mensaje.
         nuevo_mensaje = Mensaje(
             asunto=asunto,
             contenido=contenido,
@@ -141,22 +176,15 @@ def redactar():
             usuario_id=usuario_actual.id
         )
         db.session.add(nuevo_mensaje)
-        db.session.commit()
-
-        # Envío en background para no bloquear la petición
-        def send_background(mensaje_id, grupo_id):
-            try:
-                mensaje = Mensaje.query.get(mensaje_id)
-                grupo_local = Grupo.query.get(grupo_id)
-                if not mensaje or not grupo_local:
-                    return
-                for u in grupo_local.usuarios:
-                    # Integración real con SMS/Email aquí
-                    current_app.logger.info(f"📨 (bg) Enviando a {u.username} -> {u.email}")
-            except Exception as e:
-                current_app.logger.exception('Error en envío background: %s', e)
-
-        Thread(target=send_background, args=(nuevo_mensaje.id, grupo.id), daemon=True).start()
+        try:
+            db.session.flush()
+            encolar_mensaje(nuevo_mensaje)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Error al encolar mensaje: %s', e)
+            flash('Error al enviar el mensaje', 'error')
+            return redirect(url_for('main.redactar'))
 
         # Mantener al usuario en la pestaña de redactar y mostrar confirmación
         flash('Mensaje enviado correctamente', 'success')
@@ -169,6 +197,7 @@ def redactar():
 
 
 @main_bp.route('/notificaciones')
+@solo_lectura
 def notificaciones():
     # Mostrar tanto Mensaje (envíos) como Campaña en el listado de notificaciones
     if not session.get('logged_in'):
@@ -184,76 +213,26 @@ def notificaciones():
     except ValueError:
         page = 1
     limit = 10
+    cursor = request.args.get('cursor')
 
-    # Obtener mensajes y campañas
-    mensajes = Mensaje.query.order_by(Mensaje.fecha_envio.desc()).all()
-    from app.models import Campaña
-    campañas = Campaña.query.order_by(Campaña.date.desc()).all()
+    # Filtro de fechas, orden y paginación se resuelven en la BD (ver app/feed.py)
+    desde = feed.parse_fecha(from_date)
+    hasta = feed.parse_fecha(to_date, fin_de_dia=True)
+    # conteo acotado: con más de feed.MAX_CONTEO sólo se salta por número dentro del tope
+    total, total_mas = feed.contar_notificaciones(desde, hasta)
 
-    notifications = []
-    # Añadir solo campañas activas (evitar mostrar campañas inactivas en notificaciones)
-    for c in campañas:
-        try:
-            is_active = getattr(c, 'active', True)
-        except Exception:
-            is_active = True
-        if not is_active:
-            continue
-        notifications.append({
-            'type': 'campaign',
-            'title': c.name or (c.message[:80] + '...'),
-            'text': c.message,
-            'sent_at': c.date,
-            'author': 'Sistema',
-            'priority': (getattr(c, 'priority', None) or 'baja')
-        })
-    for m in mensajes:
-        notifications.append({
-            'type': 'message',
-            'title': m.asunto or ('Mensaje ' + str(m.id)),
-            'text': m.contenido,
-            'sent_at': m.fecha_envio,
-            'author': (m.usuario.username if getattr(m, 'usuario', None) and m.usuario else 'Sistema'),
-            'priority': 'baja'
-        })
-
-    # ordenar por fecha descendente
-    notifications = sorted([n for n in notifications if n.get('sent_at')], key=lambda x: x['sent_at'], reverse=True)
-
-    # Filtrar por rango de fechas si se proporcionan
-    def in_date_range(n):
-        if not from_date and not to_date:
-            return True
-        try:
-            sent = n.get('sent_at')
-            if not sent:
-                return False
-            if from_date:
-                fd = datetime.strptime(from_date, '%Y-%m-%d')
-                if sent < fd:
-                    return False
-            if to_date:
-                td = datetime.strptime(to_date, '%Y-%m-%d')
-                # include the whole day
-                td_end = td.replace(hour=23, minute=59, second=59)
-                if sent > td_end:
-                    return False
-            return True
-        except Exception:
-            return True
-
-    filtered = [n for n in notifications if in_date_range(n)]
-    total = len(filtered)
-
-    # paginar por página
     total_pages = (total + limit - 1) // limit if total > 0 else 1
-    if page > total_pages:
-        page = total_pages
-    start = (page - 1) * limit
-    end = start + limit
-    page_slice = filtered[start:end]
+    if feed.decodificar_cursor(cursor) is None:
+        cursor = None
+        if page > total_pages:
+            page = total_pages
+    # "Siguiente" usa el cursor de la última fila; los saltos de página, OFFSET (acotado por el tope).
+    # Se pide una fila de más para saber si hay otra página.
+    filas = feed.notificaciones(desde, hasta, limite=limit + 1, offset=(page - 1) * limit, cursor=cursor)
+    page_slice = filas[:limit]
+    next_cursor = page_slice[-1]['cursor'] if len(filas) > limit else None
 
-    return render_template('notificaciones.html', usuario=session.get('username'), notifications=page_slice, total_notifications=total, page=page, total_pages=total_pages, limit=limit, from_date=from_date, to_date=to_date)
+    return render_template('notificaciones.html', usuario=session.get('username'), notifications=page_slice, total_notifications=total, total_mas=total_mas, page=page, total_pages=total_pages, limit=limit, from_date=from_date, to_date=to_date, next_cursor=next_cursor)
 
 
 @main_bp.route('/extras/ayuda')
@@ -261,8 +240,7 @@ def ayuda():
     if not session.get('logged_in'):
         return redirect(url_for('main.index'))
     # Obtener soporte desde Settings si está disponible
-    from app.models import Settings
-    settings = Settings.query.first()
+    settings = ajustes()
     support = settings.support_email if settings and settings.support_email else 'etecsa.ayuda@nauta.com.cu'
     return render_template('extras/ayuda.html', usuario=session.get('username') or session.get('usuario') or 'Usuario', year=2025, support_email=support, settings=settings)
 
@@ -277,13 +255,17 @@ def change_password():
         confirmar = request.form['confirmar']
         usuario_actual = session['username']
         user = Usuario.query.filter_by(username=usuario_actual).first()
-        if not user or not check_password_hash(user.password_hash, actual):
+        try:
+            actual_ok = bool(user) and password_pool.comprobar(user, actual, rehash=False)
+        except password_pool.Sobrecarga:
+            return _sobrecarga('change_password.html')
+        if not actual_ok:
             flash('Contraseña actual incorrecta', 'error')
             return redirect(url_for('main.change_password'))
         if nueva != confirmar:
             flash('La nueva contraseña no coincide con la confirmación', 'error')
             return redirect(url_for('main.change_password'))
-        user.password_hash = generate_password_hash(nueva)
+        user.set_password(nueva)
         db.session.commit()
         flash('Contraseña actualizada correctamente', 'success')
         return redirect(url_for('main.home'))
@@ -291,21 +273,15 @@ def change_password():
 
 
 @main_bp.route('/grupos',  methods=['GET', 'POST'])
+@solo_lectura
 def grupos():
     if not session.get('logged_in'):
         return redirect(url_for('main.login'))
 
-    usuarios = Usuario.query.all()
     grupos = Grupo.query.all()
 
-    # Instanciar el formulario y asegurar que los choices estén definidos
+    # Los usuarios no se cargan aquí: el selector los pide por páginas (main.buscar_usuarios)
     form = GroupForm()
-    try:
-        # si WTForms está disponible, asignar choices para el SelectMultipleField
-        if hasattr(form, 'usuarios'):
-            form.usuarios.choices = [(u.id, u.username or ("ID %d" % u.id)) for u in usuarios]
-    except Exception:
-        pass
 
     if request.method == 'POST':
         if not form.validate_on_submit():
@@ -321,19 +297,11 @@ def grupos():
             nombre = (request.form.get('nombre') or '').strip()
         user_ids = request.form.getlist('usuarios')  # lista de IDs seleccionados
 
-        # Crear grupo
+        # Crear grupo; los miembros se validan con consultas IN y se insertan en bloque
         nuevo_grupo = Grupo(nombre=nombre)
-        for uid in user_ids:
-            try:
-                uid_i = int(uid)
-            except ValueError:
-                continue
-            usuario = Usuario.query.get(uid_i)
-            if usuario:
-                nuevo_grupo.usuarios.append(usuario)
-
         db.session.add(nuevo_grupo)
         try:
+            membership.establecer(nuevo_grupo, user_ids)
             db.session.commit()
             flash("Grupo creado correctamente", "success")
         except IntegrityError:
@@ -344,7 +312,6 @@ def grupos():
 
     return render_template('grupos.html', 
                            usuario=session.get('username'), 
-                           usuarios=usuarios, 
                            grupos=grupos,
                            form=form)
 
@@ -355,7 +322,6 @@ def editar_grupo(id):
         return redirect(url_for('main.login'))
 
     grupo = Grupo.query.get_or_404(id)
-    usuarios = Usuario.query.order_by(Usuario.username).all()
 
     if request.method == 'POST':
         nombre = (request.form.get('nombre') or '').strip()
@@ -366,18 +332,13 @@ def editar_grupo(id):
         # actualizar nombre
         grupo.nombre = nombre
 
-        # actualizar usuarios asociados
-        selected = request.form.getlist('usuarios') or []
-        grupo.usuarios = []
-        for uid in selected:
-            try:
-                u = Usuario.query.get(int(uid))
-                if u:
-                    grupo.usuarios.append(u)
-            except Exception:
-                continue
-
+        # actualizar usuarios asociados: el selector paginado envía sólo altas y bajas
+        # (`agregar` / `quitar`); una lista completa en `usuarios` se aplica como diferencia
         try:
+            if 'usuarios' in request.form:
+                membership.establecer(grupo, request.form.getlist('usuarios'))
+            else:
+                membership.aplicar_cambios(grupo, request.form.getlist('agregar'), request.form.getlist('quitar'))
             db.session.commit()
             flash('Grupo actualizado correctamente', 'success')
         except IntegrityError:
@@ -386,7 +347,27 @@ def editar_grupo(id):
 
         return redirect(url_for('main.grupos'))
 
-    return render_template('editar_grupo.html', grupo=grupo, usuarios=usuarios)
+    return render_template('editar_grupo.html', grupo=grupo)
+
+
+@main_bp.route('/usuarios/buscar', methods=['GET'], endpoint='buscar_usuarios')
+def buscar_usuarios():
+    # JSON para el selector de usuarios: búsqueda por prefijo paginada por nombre
+    if not session.get('logged_in'):
+        return jsonify({'error': 'no autenticado'}), 401
+    items, siguiente = membership.buscar_usuarios(
+        request.args.get('q', ''), membership.limite_pagina(request.args.get('limit')), request.args.get('after'))
+    return jsonify({'items': items, 'next': siguiente})
+
+
+@main_bp.route('/grupos/<int:id>/miembros', methods=['GET'], endpoint='miembros_grupo')
+def miembros_grupo(id):
+    # JSON con una página de miembros del grupo (filtrable por prefijo)
+    if not session.get('logged_in'):
+        return jsonify({'error': 'no autenticado'}), 401
+    items, siguiente = membership.pagina_miembros(
+        id, request.args.get('q', ''), membership.limite_pagina(request.args.get('limit')), request.args.get('after'))
+    return jsonify({'items': items, 'next': siguiente})
 
 
 @main_bp.route('/grupos/<int:id>/eliminar', methods=['POST'], endpoint='eliminar_grupo')
@@ -398,10 +379,17 @@ def eliminar_grupo(id):
 
     try:
         # Eliminar mensajes asociados primero para evitar errores de FK
-        from app.models import Mensaje
+        from app.models import Mensaje, Entrega
+        mensajes_ids = db.session.query(Mensaje.id).filter(Mensaje.grupo_id == id)
+        db.session.query(Entrega).filter(Entrega.mensaje_id.in_(mensajes_ids.scalar_subquery())).delete(synchronize_session=False)
         db.session.query(Mensaje).filter(Mensaje.grupo_id == id).delete()
+        # el borrado masivo no pasa por el ORM: quitar también sus filas del resumen diario
+        stats.olvidar_grupo(id)
         # detach relations user<->group
-        grupo.usuarios = []
+        membership.vaciar(id)
+        db.session.expire(grupo, ['usuarios'])
+        # deja de ser destinatario de las campañas que lo incluían
+        campaign_groups.quitar_grupo(id)
         db.session.delete(grupo)
         db.session.commit()
         flash('Grupo eliminado correctamente', 'success')
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Programador de campañas: dispara cada `Campaña` activa en su `date`.
+
+Mantiene en memoria un min-heap `(date, campaña_id)` con las campañas activas
+pendientes. El heap se carga una vez al arrancar y después sólo se actualiza a
+partir de la tabla `cambio_campaña` (las rutas de administración registran ahí
+cada alta, edición, activación, programación o borrado), así que cada tick lee
+únicamente los cambios nuevos y nunca recorre toda la tabla `campaña`.
+
+Al disparar, los grupos destinatarios se expanden a destinatarios únicos en
+streaming (ver `app.recipients`) y cada lote se encola en `entrega` (ver
+`app.outbox`).
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Campaña, CambioCampaña, EjecucionCampaña, Entrega
+from app import outbox, recipients, campaign_groups
+
+DEFAULT_CHUNK = 1000
+# Campañas cuya fecha quedó más atrás que esto al arrancar no se disparan
+DEFAULT_MAX_RETRASO_HORAS = 24
+
+
+def registrar_cambio(campaña_id):
+    """Anota un cambio de campaña para el programador. Llamar antes del commit."""
+    if campaña_id is not None:
+        db.session.add(CambioCampaña(campaña_id=campaña_id))
+
+
+def cancelar_campaña(campaña_id):
+    """Elimina ejecuciones y entregas de una campaña que se va a borrar. No hace commit."""
+    ejecuciones = select(EjecucionCampaña.id).where(EjecucionCampaña.campaña_id == campaña_id).scalar_subquery()
+    db.session.query(Entrega).filter(Entrega.ejecucion_id.in_(ejecuciones)).delete(synchronize_session=False)
+    db.session.query(EjecucionCampaña).filter(EjecucionCampaña.campaña_id == campaña_id).delete(synchronize_session=False)
+
+
+def grupos_objetivo(campaña):
+    """IDs de los grupos destinatarios de la campaña (tabla `campaign_group`)."""
+    return campaign_groups.grupos_de(campaña.id)
+
+
+class ProgramadorCampañas:
+
+    def __init__(self, app, chunk=None, max_retraso=None):
+        self.app = app
+        self.chunk = chunk or app.config.get('CAMPAIGN_CHUNK', DEFAULT_CHUNK)
+        horas = max_retraso if max_retraso is not None else app.config.get('CAMPAIGN_MAX_RETRASO_HORAS', DEFAULT_MAX_RETRASO_HORAS)
+        self.max_retraso = timedelta(hours=horas)
+        self._heap = []
+        # campaña_id -> fecha vigente; las entradas del heap que no coinciden se descartan al salir
+        self._vigentes = {}
+        self._ultimo_cambio = 0
+        # ejecuciones de este proceso cuya expansión falló a mitad: se reintentan en cada tick
+        self._a_medias = set()
+
+    # --- estado del heap ---
+    def _programar(self, campaña_id, fecha):
+        self._vigentes[campaña_id] = fecha
+        heapq.heappush(self._heap, (fecha, campaña_id))
+
+    def _descartar(self, campaña_id):
+        self._vigentes.pop(campaña_id, None)
+
+    def proxima(self):
+        """Fecha del próximo disparo (o None)."""
+        while self._heap and self._vigentes.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _ya_ejecutada(self, campaña_ids):
+        if not campaña_ids:
+            return set()
+        rows = db.session.execute(
+            select(EjecucionCampaña.campaña_id, EjecucionCampaña.fecha_programada)
+            .where(EjecucionCampaña.campaña_id.in_(campaña_ids))
+        ).all()
+        return set(rows)
+
+    def _actualizar(self, campañas):
+        hechas = self._ya_ejecutada([c.id for c in campañas])
+        for c in campañas:
+            if c.active and c.date and (c.id, c.date) not in hechas:
+                self._programar(c.id, c.date)
+            else:
+                self._descartar(c.id)
+
+    def cargar(self):
+        """Carga inicial: campañas activas no ejecutadas con fecha reciente o futura."""
+        self._heap = []
+        self._vigentes = {}
+        self._ultimo_cambio = db.session.execute(select(db.func.max(CambioCampaña.id))).scalar() or 0
+        # los cambios anteriores al arranque ya están reflejados en la carga completa
+        db.session.query(CambioCampaña).filter(
+            CambioCampaña.id <= self._ultimo_cambio,
+            CambioCampaña.creado < datetime.utcnow() - timedelta(days=1),
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        desde = datetime.utcnow() - self.max_retraso
+        campañas = Campaña.query.filter(Campaña.active.is_(True), Campaña.date >= desde).all()
+        self._actualizar(campañas)
+
+    def aplicar_cambios(self):
+        """Lee los cambios nuevos de `cambio_campaña` y actualiza sólo esas campañas."""
+        cambios = db.session.execute(
+            select(CambioCampaña.id, CambioCampaña.campaña_id)
+            .where(CambioCampaña.id > self._ultimo_cambio)
+            .order_by(CambioCampaña.id)
+        ).all()
+        if not cambios:
+            return 0
+        self._ultimo_cambio = cambios[-1][0]
+        ids = {cid for _, cid in cambios}
+        existentes = Campaña.query.filter(Campaña.id.in_(ids)).all()
+        for cid in ids - {c.id for c in existentes}:
+            self._descartar(cid)
+        self._actualizar(existentes)
+        return len(ids)
+
+    # --- disparo ---
+    def disparar(self, campaña_id, fecha):
+        """Registra la ejecución y encola los destinatarios por lotes. Devuelve el total encolado."""
+        campaña = db.session.get(Campaña, campaña_id)
+        if campaña is None or not campaña.active or campaña.date != fecha:
+            return 0
+        ejecucion = EjecucionCampaña(campaña_id=campaña_id, fecha_programada=fecha, estado='expandiendo')
+        db.session.add(ejecucion)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # otro programador ya la disparó
+            db.session.rollback()
+            return 0
+
+        return self._expandir(ejecucion.id, campaña_id, grupos_objetivo(campaña), campaña.priority)
+
+    def _expandir(self, ejecucion_id, campaña_id, grupo_ids, prioridad, desde=0, previos=0):
+        # cada lote se confirma por separado y en orden de usuario_id; si el
+        # proceso muere a mitad, `reanudar()` continúa tras el último encolado
+        # (al arrancar o, si sólo falló la expansión, en el siguiente tick)
+        total = 0
+        self._a_medias.add(ejecucion_id)
+        for lote in recipients.expandir(grupo_ids, self.chunk, desde):
+            total += outbox.encolar_destinatarios(ejecucion_id, lote, prioridad)
+            db.session.commit()
+        ejecucion = db.session.get(EjecucionCampaña, ejecucion_id)
+        ejecucion.destinatarios = previos + total
+        ejecucion.estado = 'encolada'
+        db.session.commit()
+        self._a_medias.discard(ejecucion_id)
+        self.app.logger.info('Campaña %s disparada: %d destinatarios encolados', campaña_id, total)
+        return total
+
+    def reanudar(self, ejecucion_ids=None):
+        """Completa las expansiones que quedaron a medias (todas o sólo `ejecucion_ids`)."""
+        q = (db.session.query(EjecucionCampaña.id, Campaña)
+             .join(Campaña, Campaña.id == EjecucionCampaña.campaña_id)
+             .filter(EjecucionCampaña.estado == 'expandiendo'))
+        if ejecucion_ids is not None:
+            q = q.filter(EjecucionCampaña.id.in_(ejecucion_ids))
+        pendientes = q.all()
+        if ejecucion_ids is not None:
+            # borradas o completadas por otro programador
+            self._a_medias.difference_update(set(ejecucion_ids) - {e for e, _ in pendientes})
+        for ejecucion_id, campaña in pendientes:
+            desde, previos = db.session.execute(
+                select(func.max(Entrega.usuario_id), func.count())
+                .where(Entrega.ejecucion_id == ejecucion_id)
+            ).one()
+            self._expandir(ejecucion_id, campaña.id, grupos_objetivo(campaña), campaña.priority,
+                           desde or 0, previos)
+        return len(pendientes)
+
+    def tick(self, now=None):
+        """Aplica cambios, reintenta expansiones fallidas y dispara las vencidas. Devuelve cuántas se dispararon."""
+        self.aplicar_cambios()
+        if self._a_medias:
+            try:
+                self.reanudar(sorted(self._a_medias))
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception('Error al reanudar expansiones %s: %s', sorted(self._a_medias), e)
+        now = now or datetime.utcnow()
+        disparadas = 0
+        while True:
+            fecha = self.proxima()
+            if fecha is None or fecha > now:
+                break
+            _, campaña_id = heapq.heappop(self._heap)
+            self._descartar(campaña_id)
+            try:
+                self.disparar(campaña_id, fecha)
+                disparadas += 1
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception('Error al disparar campaña %s: %s', campaña_id, e)
+        return disparadas
+
+    def ejecutar(self, stop_event=None, intervalo=5.0):
+        """Bucle del programador; espera hasta el próximo disparo o `intervalo` segundos."""
+        stop_event = stop_event or threading.Event()
+        with self.app.app_context():
+            self.cargar()
+            self.reanudar()
+            self.app.logger.info('Programador de campañas iniciado (%d pendientes)', len(self._vigentes))
+            while not stop_event.is_set():
+                try:
+                    self.tick()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.exception('Error en programador de campañas: %s', e)
+                finally:
+                    db.session.remove()
+                espera = intervalo
+                proxima = self.proxima()
+                if proxima is not None:
+                    espera = max(0.1, min(intervalo, (proxima - datetime.utcnow()).total_seconds()))
+                stop_event.wait(espera)
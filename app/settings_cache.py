@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Caché por proceso de la fila única de `Settings`.
+
+Cada proceso guarda una instantánea inmutable (`Ajustes`) y sólo comprueba si
+sigue vigente cada `SETTINGS_CACHE_SEGUNDOS` segundos, leyendo el contador de
+`settings_version` (una fila, un entero). Las rutas que modifican los ajustes
+llaman a `marcar_cambio()` antes del commit; el resto de workers ven el cambio
+en como mucho `SETTINGS_CACHE_SEGUNDOS`, y mientras tanto el camino caliente
+(`before_request`, context processor, vistas) no hace ninguna consulta.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import select, update, insert, event
+from sqlalchemy.orm import Session
+
+from app.models import db, Settings, VersionAjustes
+
+DEFAULT_SEGUNDOS = 2.0
+
+Ajustes = namedtuple('Ajustes', [
+    'system_name', 'support_email', 'default_page', 'max_concurrent',
+    'maintenance', 'maintenance_message', 'updated_at', 'version',
+])
+
+
+def _instantanea(settings, version):
+    if settings is None:
+        return Ajustes(None, None, None, None, False, None, None, version)
+    return Ajustes(settings.system_name, settings.support_email, settings.default_page,
+                   settings.max_concurrent, bool(settings.maintenance), settings.maintenance_message,
+                   settings.updated_at, version)
+
+
+def _leer_version():
+    return db.session.execute(select(VersionAjustes.version).where(VersionAjustes.id == 1)).scalar() or 0
+
+
+class CacheAjustes:
+
+    def __init__(self, segundos=DEFAULT_SEGUNDOS):
+        self.segundos = segundos
+        self._ajustes = None
+        self._comprobado = 0.0
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        """Instantánea vigente; como mucho una consulta cada `segundos`."""
+        ajustes = self._ajustes
+        if ajustes is not None and time.monotonic() - self._comprobado < self.segundos:
+            return ajustes
+        with self._lock:
+            # otro hilo puede haberla refrescado mientras esperábamos
+            if self._ajustes is not None and time.monotonic() - self._comprobado < self.segundos:
+                return self._ajustes
+            version = _leer_version()
+            if self._ajustes is None or self._ajustes.version != version:
+                self._ajustes = _instantanea(Settings.query.first(), version)
+            self._comprobado = time.monotonic()
+            return self._ajustes
+
+    def invalidar(self):
+        """Fuerza la comprobación del contador en la próxima lectura."""
+        self._comprobado = 0.0
+
+
+def _cache():
+    cache = current_app.extensions.get('settings_cache')
+    if cache is None:
+        cache = current_app.extensions['settings_cache'] = CacheAjustes(
+            current_app.config.get('SETTINGS_CACHE_SEGUNDOS', DEFAULT_SEGUNDOS))
+    return cache
+
+
+def ajustes():
+    """Ajustes del sitio (instantánea inmutable, atributos como `Settings`)."""
+    return _cache().obtener()
+
+
+def marcar_cambio():
+    """Incrementa el contador de versión. Llamar antes del commit que modifica `Settings`."""
+    t = VersionAjustes.__table__
+    if not db.session.execute(update(t).where(t.c.id == 1).values(version=t.c.version + 1)).rowcount:
+        db.session.execute(insert(t).values(id=1, version=1))
+    # este proceso recarga en cuanto se confirme la transacción, sin esperar al plazo
+    db.session.info['settings_cache'] = _cache()
+
+
+@event.listens_for(Session, 'after_commit')
+def _tras_commit(session):
+    cache = session.info.pop('settings_cache', None)
+    if cache is not None:
+        cache.invalidar()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _tras_rollback(session):
+    session.info.pop('settings_cache', None)
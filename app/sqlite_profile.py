@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Perfil de producción para SQLite: pragmas por conexión y pool de conexiones.
+
+Con el journal por defecto (DELETE) un escritor bloquea a todos los lectores y
+los hilos de envío y los workers web acaban en "database is locked". Con WAL
+los lectores no esperan a los escritores y sólo los escritores se turnan; el
+resto de pragmas reduce el coste de cada commit y de cada lectura:
+
+- `journal_mode=WAL`: lectores y un escritor a la vez (persiste en el fichero).
+- `synchronous=NORMAL`: en WAL sólo se sincroniza en los checkpoints; un corte
+  de luz puede perder los últimos commits, nunca corromper la base de datos.
+- `busy_timeout`: ms que un escritor espera al lock en lugar de fallar al momento.
+- `cache_size` (negativo = KiB por conexión) y `mmap_size` (bytes): páginas
+  calientes en memoria y lecturas sin copia.
+- `temp_store=MEMORY`: ordenaciones y tablas temporales en memoria.
+
+Los pragmas se configuran con `SQLITE_PRAGMAS` (dict; `None` desactiva el
+perfil) y se aplican en el evento `connect` de cada engine SQLite de la app.
+El tamaño del pool (`SQLITE_POOL_SIZE`, `SQLITE_POOL_OVERFLOW`) debe cubrir
+los hilos que usan la base de datos en cada proceso: hilos del servidor web o
+`--threads` de `scripts/delivery_worker.py`. Ver
+`scripts/bench_sqlite_concurrency.py` para medirlo.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 10
+
+
+def es_fichero_sqlite(uri):
+    """True si `uri` es una base de datos SQLite en fichero (no `:memory:`)."""
+    try:
+        url = make_url(uri)
+    except Exception:
+        return False
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def opciones_engine(config):
+    """`SQLALCHEMY_ENGINE_OPTIONS` por defecto para una base de datos SQLite en fichero."""
+    return {
+        'pool_size': config.get('SQLITE_POOL_SIZE', DEFAULT_POOL_SIZE),
+        'max_overflow': config.get('SQLITE_POOL_OVERFLOW', DEFAULT_POOL_OVERFLOW),
+        'pool_timeout': config.get('SQLITE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+        # las conexiones del pool se pueden usar desde cualquier hilo del proceso
+        'connect_args': {'check_same_thread': False},
+    }
+
+
+def aplicar_pragmas(engine, pragmas=None):
+    """Registra los pragmas en el evento `connect` de `engine` (sólo engines SQLite)."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for nombre, valor in pragmas.items():
+                cur.execute('PRAGMA %s = %s' % (nombre, valor))
+        finally:
+            cur.close()
+
+
+def init_app(app, db):
+    """Aplica los pragmas a todos los engines SQLite de `db` (llamar tras `db.init_app`)."""
+    pragmas = app.config.get('SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            aplicar_pragmas(engine, pragmas)
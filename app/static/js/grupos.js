@@ -3,24 +3,74 @@
   // Funciones para los modales
   function openModal() { document.getElementById('modal')?.style.setProperty('display','block'); }
   function closeModal() { document.getElementById('modal')?.style.setProperty('display','none'); }
-  function openServicesModal() { document.getElementById('servicesModal')?.style.setProperty('display','block'); }
+  // Usuarios elegidos para el grupo nuevo (id -> usuario); se mantienen entre búsquedas
+  const seleccion = new Map();
+  let serviciosLista = null;
+
+  function filaUsuario(item) {
+    const tr = document.createElement('tr');
+    if (item.role === 'admin') tr.className = 'admin-user';
+    const td = document.createElement('td');
+    const cb = document.createElement('input');
+    cb.type = 'checkbox';
+    cb.className = 'service-checkbox';
+    cb.value = item.id;
+    cb.checked = seleccion.has(String(item.id));
+    cb.addEventListener('change', function() {
+      if (cb.checked) seleccion.set(String(item.id), item); else seleccion.delete(String(item.id));
+    });
+    td.appendChild(cb);
+    tr.appendChild(td);
+    [item.username, item.email || '—', '—'].forEach(function(texto, i) {
+      const celda = document.createElement('td');
+      if (i === 0) celda.className = 'user-name-cell';
+      celda.textContent = texto;
+      tr.appendChild(celda);
+    });
+    return tr;
+  }
+
+  function openServicesModal() {
+    const modal = document.getElementById('servicesModal');
+    if (!modal) return;
+    if (!serviciosLista && window.MemberPicker) {
+      // búsqueda por prefijo paginada en el servidor (main.buscar_usuarios)
+      serviciosLista = new window.MemberPicker.PagedList({
+        url: modal.dataset.searchUrl,
+        search: document.getElementById('serviceSearch'),
+        list: document.getElementById('servicesTableBody'),
+        more: document.getElementById('servicesMore'),
+        renderItem: filaUsuario
+      });
+      serviciosLista.load(true);
+    }
+    modal.style.display = 'block';
+  }
   function closeServicesModal() { document.getElementById('servicesModal')?.style.setProperty('display','none'); }
 
   function acceptServicesModal() {
-    const selected = document.querySelectorAll(".service-checkbox:checked");
     const box = document.getElementById("servicesBox");
     if(!box) return;
     box.innerHTML = "";
-    selected.forEach(chk => {
+    seleccion.forEach((item, id) => {
       const input = document.createElement("input");
       input.type = "hidden";
       input.name = "usuarios";
-      input.value = chk.value;
+      input.value = id;
       box.appendChild(input);
       const label = document.createElement("div");
       label.classList.add("selected-user");
-      const uname = chk.dataset && chk.dataset.username ? chk.dataset.username : ('Usuario ' + chk.value);
-      label.innerHTML = '<span class="su-name">' + uname + '</span>' + (chk.dataset.role === 'admin' ? ' <span class="badge bg-secondary su-admin">admin</span>' : '');
+      const name = document.createElement('span');
+      name.className = 'su-name';
+      name.textContent = item.username || ('Usuario ' + id);
+      label.appendChild(name);
+      if (item.role === 'admin') {
+        const badge = document.createElement('span');
+        badge.className = 'badge bg-secondary su-admin';
+        badge.textContent = 'admin';
+        label.appendChild(document.createTextNode(' '));
+        label.appendChild(badge);
+      }
       box.appendChild(label);
     });
     closeServicesModal();
@@ -95,17 +145,20 @@
   function closeEditModal() { const modal = document.getElementById('editGroupModal'); if (modal) modal.style.display = 'none'; }
   function openEditModal() { const modal = document.getElementById('editGroupModal'); if (modal) modal.style.display = 'block'; }
 
+  let editor = null;
+
   function initEditAndDeleteButtons(){
     document.querySelectorAll('.edit-button').forEach(btn => {
       btn.addEventListener('click', function () {
         const id = this.dataset.id;
         const name = this.dataset.name || '';
-        const users = (this.dataset.users || '').split(',').filter(Boolean).map(s => s.trim());
         const form = document.getElementById('editGroupForm'); if (!form) return;
         const tpl = form.dataset.actionTemplate || form.action || '';
         form.action = tpl.replace('/0', '/' + id);
         const nombreInput = document.getElementById('edit_nombre'); if(nombreInput) nombreInput.value = name;
-        document.querySelectorAll('.edit-user-checkbox').forEach(cb => { cb.checked = users.includes(cb.value); });
+        // miembros y candidatos se piden por páginas al abrir el modal
+        if (!editor && window.MemberPicker) editor = new window.MemberPicker.GroupEditor(form);
+        if (editor) editor.open((form.dataset.membersTemplate || '').replace('/0/', '/' + id + '/'));
         openEditModal();
       });
     });
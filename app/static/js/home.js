@@ -28,4 +28,33 @@
 
   window.toggleUserDropdown = toggleUserDropdown;
 
+  // "Cargar más": pide la siguiente ventana de mensajes por cursor y la añade a la lista
+  const cargarMas = document.getElementById('cargarMas');
+  if (cargarMas) {
+    cargarMas.addEventListener('click', function() {
+      const list = document.getElementById('enviosList');
+      const url = cargarMas.dataset.url + '?cursor=' + encodeURIComponent(cargarMas.dataset.cursor || '');
+      cargarMas.disabled = true;
+      fetch(url, { credentials: 'same-origin' })
+        .then(function(r) { return r.json(); })
+        .then(function(data) {
+          (data.items || []).forEach(function(msg) {
+            const strong = document.createElement('strong');
+            strong.textContent = msg.asunto;
+            list.appendChild(strong);
+            list.appendChild(document.createElement('br'));
+            list.appendChild(document.createTextNode(msg.extracto));
+            list.appendChild(document.createElement('br'));
+          });
+          if (data.next_cursor) {
+            cargarMas.dataset.cursor = data.next_cursor;
+            cargarMas.disabled = false;
+          } else {
+            cargarMas.remove();
+          }
+        })
+        .catch(function() { cargarMas.disabled = false; });
+    });
+  }
+
 })();
@@ -0,0 +1,175 @@
+// Selector de usuarios y miembros de grupo paginado en el servidor.
+// Los usuarios se piden por prefijo a /usuarios/buscar y los miembros de cada
+// grupo a /grupos/<id>/miembros, siempre por páginas ("Cargar más"), así que
+// la página de grupos no incluye la lista completa de usuarios.
+(function(){
+  function debounce(fn, ms) {
+    let t = null;
+    return function() {
+      const args = arguments, self = this;
+      clearTimeout(t);
+      t = setTimeout(function() { fn.apply(self, args); }, ms);
+    };
+  }
+
+  // Lista paginada: `url` devuelve {items: [...], next: cursor|null}
+  function PagedList(opts) {
+    this.url = opts.url;
+    this.search = opts.search || null;
+    this.list = opts.list;
+    this.more = opts.more || null;
+    this.renderItem = opts.renderItem;
+    this.emptyText = opts.emptyText || 'Sin resultados';
+    this.next = null;
+    this._req = 0;
+    const self = this;
+    if (this.search) {
+      this.search.addEventListener('input', debounce(function() { self.load(true); }, 250));
+    }
+    if (this.more) {
+      this.more.addEventListener('click', function() { self.load(false); });
+    }
+  }
+
+  PagedList.prototype.load = function(reset) {
+    if (!this.url) return;
+    const self = this;
+    const req = ++this._req;
+    const params = new URLSearchParams();
+    const q = this.search ? this.search.value.trim() : '';
+    if (q) params.set('q', q);
+    if (!reset && this.next) params.set('after', this.next);
+    if (this.more) this.more.disabled = true;
+    fetch(this.url + '?' + params.toString(), { credentials: 'same-origin' })
+      .then(function(r) { return r.json(); })
+      .then(function(data) {
+        if (req !== self._req) return;  // respuesta de una búsqueda anterior
+        if (reset) self.list.innerHTML = '';
+        (data.items || []).forEach(function(item) { self.list.appendChild(self.renderItem(item)); });
+        if (reset && !(data.items || []).length) {
+          let empty;
+          if (self.list.tagName === 'TBODY') {
+            empty = document.createElement('tr');
+            const td = document.createElement('td');
+            td.colSpan = 4;
+            td.textContent = self.emptyText;
+            empty.appendChild(td);
+          } else {
+            empty = document.createElement('div');
+            empty.textContent = self.emptyText;
+          }
+          empty.className = 'text-muted small mp-empty';
+          self.list.appendChild(empty);
+        }
+        self.next = data.next || null;
+        if (self.more) {
+          self.more.disabled = false;
+          self.more.style.display = self.next ? '' : 'none';
+        }
+      })
+      .catch(function() { if (self.more) self.more.disabled = false; });
+  };
+
+  function userLabel(item) {
+    return item.username + (item.email ? ' (' + item.email + ')' : '');
+  }
+
+  function checkRow(item, checked, onChange) {
+    const row = document.createElement('div');
+    row.className = 'form-check';
+    const cb = document.createElement('input');
+    cb.type = 'checkbox';
+    cb.className = 'form-check-input';
+    cb.value = item.id;
+    cb.id = 'mp_' + Math.random().toString(36).slice(2);
+    cb.checked = checked;
+    cb.addEventListener('change', function() { onChange(item, cb.checked); });
+    const label = document.createElement('label');
+    label.className = 'form-check-label';
+    label.htmlFor = cb.id;
+    label.textContent = userLabel(item);
+    if (item.role === 'admin') {
+      const badge = document.createElement('span');
+      badge.className = 'badge bg-secondary ms-1';
+      badge.textContent = 'admin';
+      label.appendChild(badge);
+    }
+    row.appendChild(cb);
+    row.appendChild(label);
+    return row;
+  }
+
+  // Editor de miembros de un grupo dentro de `form`: la página de miembros
+  // actuales permite dar de baja y la búsqueda de usuarios permite dar de alta.
+  // Al enviar se añaden campos ocultos `agregar` / `quitar` sólo con los cambios.
+  function GroupEditor(form) {
+    this.form = form;
+    this.agregar = new Map();
+    this.quitar = new Map();
+    const self = this;
+    const q = function(sel) { return form.querySelector(sel); };
+    this.members = new PagedList({
+      url: null,
+      search: q('.mp-members-search'),
+      list: q('.mp-members-list'),
+      more: q('.mp-members-more'),
+      emptyText: 'El grupo no tiene miembros',
+      renderItem: function(item) {
+        return checkRow(item, !self.quitar.has(String(item.id)), function(it, checked) {
+          if (checked) self.quitar.delete(String(it.id)); else self.quitar.set(String(it.id), it);
+          self.updateSummary();
+        });
+      }
+    });
+    this.candidates = new PagedList({
+      url: form.dataset.searchUrl,
+      search: q('.mp-add-search'),
+      list: q('.mp-add-list'),
+      more: q('.mp-add-more'),
+      renderItem: function(item) {
+        return checkRow(item, self.agregar.has(String(item.id)), function(it, checked) {
+          if (checked) self.agregar.set(String(it.id), it); else self.agregar.delete(String(it.id));
+          self.updateSummary();
+        });
+      }
+    });
+    form.addEventListener('submit', function() { self.writeChanges(); });
+  }
+
+  GroupEditor.prototype.open = function(membersUrl) {
+    this.agregar.clear();
+    this.quitar.clear();
+    this.members.url = membersUrl;
+    if (this.members.search) this.members.search.value = '';
+    if (this.candidates.search) this.candidates.search.value = '';
+    this.members.load(true);
+    this.candidates.load(true);
+    this.updateSummary();
+  };
+
+  GroupEditor.prototype.updateSummary = function() {
+    const el = this.form.querySelector('.mp-summary');
+    if (!el) return;
+    const parts = [];
+    if (this.agregar.size) parts.push(this.agregar.size + ' por añadir');
+    if (this.quitar.size) parts.push(this.quitar.size + ' por quitar');
+    el.textContent = parts.join(' · ');
+  };
+
+  GroupEditor.prototype.writeChanges = function() {
+    const box = this.form.querySelector('.mp-changes');
+    if (!box) return;
+    box.innerHTML = '';
+    const add = function(name, id) {
+      const input = document.createElement('input');
+      input.type = 'hidden';
+      input.name = name;
+      input.value = id;
+      box.appendChild(input);
+    };
+    this.agregar.forEach(function(_, id) { add('agregar', id); });
+    this.quitar.forEach(function(_, id) { add('quitar', id); });
+  };
+
+  window.MemberPicker = { PagedList: PagedList, GroupEditor: GroupEditor, checkRow: checkRow };
+})();
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Camino rápido para estáticos, favicon y comprobación de salud.
+
+- `/healthz` y `/favicon.ico` se responden en el primer `before_request`, antes
+  de cualquier otro hook: no abren sesión de SQLAlchemy ni leen `Settings`.
+- Las URLs de `static/css/` y `static/js/` llevan la huella del contenido
+  (`?v=<sha1 corto>`); esas respuestas se sirven con caché de un año
+  (`immutable`), y al cambiar el fichero cambia la URL. El resto de estáticos
+  se revalida con peticiones condicionales (ETag / Last-Modified).
+"""
+import hashlib
+import os
+import threading
+
+from flask import request, send_from_directory
+
+# Carpetas bajo `static/` cuyas URLs llevan huella
+CARPETAS_CON_HUELLA = ('css/', 'js/')
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+FAVICON = 'icono_logo.png'
+
+# Endpoints que nunca necesitan base de datos
+ENDPOINTS_LIGEROS = frozenset(['static', 'healthz', 'favicon'])
+
+_huellas = {}
+_lock = threading.Lock()
+
+
+def huella(static_folder, filename):
+    """Hash corto del contenido del fichero (se recalcula si cambia su mtime)."""
+    ruta = os.path.join(static_folder, filename)
+    try:
+        mtime = os.stat(ruta).st_mtime_ns
+    except OSError:
+        return None
+    clave = (ruta, mtime)
+    h = _huellas.get(clave)
+    if h is None:
+        sha = hashlib.sha1()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(65536), b''):
+                sha.update(bloque)
+        h = sha.hexdigest()[:12]
+        with _lock:
+            _huellas[clave] = h
+    return h
+
+
+def es_ligera():
+    """True si la petición actual se sirve sin tocar la base de datos."""
+    return request.endpoint in ENDPOINTS_LIGEROS
+
+
+def init_app(app):
+
+    @app.url_defaults
+    def _añadir_huella(endpoint, values):
+        if endpoint != 'static' or 'v' in values:
+            return
+        filename = values.get('filename') or ''
+        if filename.startswith(CARPETAS_CON_HUELLA):
+            h = huella(app.static_folder, filename)
+            if h:
+                values['v'] = h
+
+    def healthz():
+        return 'ok', 200, {'Content-Type': 'text/plain; charset=utf-8', 'Cache-Control': 'no-store'}
+
+    def favicon():
+        resp = send_from_directory(app.static_folder, FAVICON, mimetype='image/png')
+        resp.headers['Cache-Control'] = 'public, max-age=86400'
+        return resp
+
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/favicon.ico', 'favicon', favicon)
+
+    # primero de la lista: corta antes que el resto de hooks (mantenimiento, etc.)
+    def _camino_rapido():
+        if request.endpoint == 'healthz':
+            return healthz()
+        if request.endpoint == 'favicon':
+            return favicon()
+        return None
+
+    app.before_request_funcs.setdefault(None, []).insert(0, _camino_rapido)
+
+    @app.after_request
+    def _cabeceras_cache(response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        filename = (request.view_args or {}).get('filename') or ''
+        v = request.args.get('v')
+        if v and filename.startswith(CARPETAS_CON_HUELLA) and v == huella(app.static_folder, filename):
+            response.headers['Cache-Control'] = CACHE_INMUTABLE
+        return response
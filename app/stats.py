@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Series diarias de actividad para el dashboard y los informes de administración.
+
+Los conteos se leen del resumen `daily_stats` (`EstadisticaDiaria`): una fila
+por día, tipo ('mensaje' / 'campaña'), grupo, modalidad y prioridad. El resumen
+se mantiene de forma incremental en cada flush del ORM (alta, cambio de fecha /
+grupo / prioridad y borrado de `Mensaje` y `Campaña`), así que un informe de 7,
+30 o 90 días lee O(días) filas y nunca recorre `mensaje`.
+
+Los borrados masivos (`Query.delete`) no pasan por el ORM: quien los haga debe
+ajustar el resumen (ver `olvidar_grupo`) o reconstruirlo con
+`scripts/rebuild_daily_stats.py`.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, insert, update, delete, literal, and_, event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import db, Campaña, Mensaje, EstadisticaDiaria
+
+RANGOS_DIAS = (7, 30, 90)
+DEFAULT_DIAS = 7
+
+TIPO_MENSAJE = 'mensaje'
+TIPO_CAMPAÑA = 'campaña'
+
+# Atributos que determinan la fila del resumen a la que cuenta cada objeto
+_CAMPOS = {
+    Mensaje: ('fecha_envio', 'grupo_id', 'modalidad'),
+    Campaña: ('date', 'priority'),
+}
+
+
+def rango_dias(valor, default=DEFAULT_DIAS):
+    """Normaliza el parámetro `?dias=` a uno de los rangos admitidos."""
+    try:
+        dias = int(valor)
+    except (TypeError, ValueError):
+        return default
+    return dias if dias in RANGOS_DIAS else default
+
+
+def dias_del_rango(dias, hoy=None):
+    """Lista de fechas (inicio de día, UTC) de los últimos `dias` días, hoy incluido."""
+    hoy = hoy or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [hoy - timedelta(days=i) for i in range(dias - 1, -1, -1)]
+
+
+# --- mantenimiento incremental ---
+def _clave(modelo, valores):
+    """Clave (dia, tipo, grupo_id, modalidad, prioridad) o None si no tiene fecha."""
+    if modelo is Mensaje:
+        fecha, grupo_id, modalidad = valores
+        if fecha is None:
+            return None
+        return (fecha.date(), TIPO_MENSAJE, grupo_id or 0, modalidad or '', '')
+    fecha, prioridad = valores
+    if fecha is None:
+        return None
+    return (fecha.date(), TIPO_CAMPAÑA, 0, '', prioridad or 'baja')
+
+
+def _valores(obj, anteriores=False):
+    campos = _CAMPOS[type(obj)]
+    if not anteriores:
+        return tuple(getattr(obj, c) for c in campos)
+    estado = inspect(obj)
+    out = []
+    for c in campos:
+        h = estado.attrs[c].history
+        out.append(h.deleted[0] if h.deleted else (h.unchanged[0] if h.unchanged else getattr(obj, c)))
+    return tuple(out)
+
+
+def aplicar_deltas(conn, deltas):
+    """Suma cada delta `{clave: n}` a su fila de `daily_stats` (upsert)."""
+    t = EstadisticaDiaria.__table__
+    for (dia, tipo, grupo_id, modalidad, prioridad), n in deltas.items():
+        if not n:
+            continue
+        filtro = and_(t.c.dia == dia, t.c.tipo == tipo, t.c.grupo_id == grupo_id,
+                      t.c.modalidad == modalidad, t.c.prioridad == prioridad)
+        # UPDATE primero (caso habitual: la fila del día ya existe) e INSERT si no
+        if conn.execute(update(t).where(filtro).values(total=t.c.total + n)).rowcount:
+            continue
+        conn.execute(insert(t).values(dia=dia, tipo=tipo, grupo_id=grupo_id,
+                                      modalidad=modalidad, prioridad=prioridad, total=n))
+
+
+@event.listens_for(Session, 'before_flush')
+def _antes_de_flush(session, flush_context, instances):
+    # Borrados y cambios se calculan antes del flush: las filas aún existen y
+    # cualquier atributo caducado se puede cargar sin problema.
+    deltas = session.info.setdefault('daily_stats_deltas', defaultdict(int))
+    for obj in session.deleted:
+        if type(obj) in _CAMPOS:
+            clave = _clave(type(obj), _valores(obj, anteriores=True))
+            if clave:
+                deltas[clave] -= 1
+    for obj in session.dirty:
+        if type(obj) in _CAMPOS and obj not in session.deleted:
+            antes = _clave(type(obj), _valores(obj, anteriores=True))
+            despues = _clave(type(obj), _valores(obj))
+            if antes != despues:
+                if antes:
+                    deltas[antes] -= 1
+                if despues:
+                    deltas[despues] += 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _despues_de_flush(session, flush_context):
+    # Las altas se cuentan después del INSERT, cuando los defaults (fecha_envio,
+    # date) ya están en el objeto; en after_flush `session.new` aún las incluye.
+    deltas = session.info.pop('daily_stats_deltas', None) or defaultdict(int)
+    for obj in session.new:
+        if type(obj) in _CAMPOS:
+            clave = _clave(type(obj), _valores(obj))
+            if clave:
+                deltas[clave] += 1
+    if any(deltas.values()):
+        aplicar_deltas(session.connection(), deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _tras_rollback(session):
+    # un flush fallido no debe arrastrar sus deltas al siguiente
+    session.info.pop('daily_stats_deltas', None)
+
+
+def olvidar_grupo(grupo_id):
+    """Quita del resumen los mensajes de un grupo (para borrados masivos). No hace commit."""
+    db.session.execute(delete(EstadisticaDiaria).where(
+        EstadisticaDiaria.tipo == TIPO_MENSAJE, EstadisticaDiaria.grupo_id == grupo_id))
+
+
+# --- reconstrucción ---
+def reconstruir(desde=None):
+    """Recalcula `daily_stats` desde `mensaje` y `campaña` (todo, o a partir del día `desde`).
+
+    Dos INSERT ... SELECT con GROUP BY; no carga filas en Python. Hace commit.
+    Devuelve el número de filas del resumen escritas.
+    """
+    t = EstadisticaDiaria.__table__
+    borrar = delete(t)
+    if desde is not None:
+        borrar = borrar.where(t.c.dia >= desde)
+    db.session.execute(borrar)
+
+    total = 0
+    for col_fecha, tipo, grupo, modalidad, prioridad in (
+        (Mensaje.fecha_envio, TIPO_MENSAJE, func.coalesce(Mensaje.grupo_id, 0),
+         func.coalesce(Mensaje.modalidad, ''), literal('')),
+        (Campaña.date, TIPO_CAMPAÑA, literal(0), literal(''),
+         func.coalesce(Campaña.priority, 'baja')),
+    ):
+        dia = func.date(col_fecha)
+        q = select(dia, literal(tipo), grupo, modalidad, prioridad, func.count()).where(col_fecha.isnot(None))
+        if desde is not None:
+            q = q.where(col_fecha >= datetime.combine(desde, datetime.min.time()))
+        q = q.group_by(dia, grupo, modalidad, prioridad)
+        res = db.session.execute(insert(t).from_select(
+            ['dia', 'tipo', 'grupo_id', 'modalidad', 'prioridad', 'total'], q))
+        total += res.rowcount or 0
+    db.session.commit()
+    return total
+
+
+def asegurar_resumen():
+    """Reconstruye el resumen si está vacío pero ya hay mensajes o campañas (primer arranque)."""
+    if db.session.execute(select(EstadisticaDiaria.id).limit(1)).first() is not None:
+        return False
+    hay_datos = db.session.execute(select(
+        select(Mensaje.id).exists() | select(Campaña.id).exists()
+    )).scalar()
+    if not hay_datos:
+        return False
+    try:
+        reconstruir()
+    except Exception:
+        # otro proceso lo está reconstruyendo a la vez
+        db.session.rollback()
+        return False
+    return True
+
+
+# --- lectura ---
+def _dia(d):
+    return d.date() if isinstance(d, datetime) else d
+
+
+def conteo_diario(tipo, desde, hasta):
+    """{'YYYY-MM-DD': n} de `tipo` para `desde <= dia < hasta`."""
+    rows = db.session.execute(
+        select(EstadisticaDiaria.dia, func.sum(EstadisticaDiaria.total))
+        .where(EstadisticaDiaria.tipo == tipo,
+               EstadisticaDiaria.dia >= _dia(desde), EstadisticaDiaria.dia < _dia(hasta))
+        .group_by(EstadisticaDiaria.dia)
+    ).all()
+    return {str(d): int(n or 0) for d, n in rows}
+
+
+def total(tipo, desde=None, hasta=None):
+    """Total de `tipo` en `desde <= dia < hasta` (sin límites: histórico completo)."""
+    q = select(func.coalesce(func.sum(EstadisticaDiaria.total), 0)).where(EstadisticaDiaria.tipo == tipo)
+    if desde is not None:
+        q = q.where(EstadisticaDiaria.dia >= _dia(desde))
+    if hasta is not None:
+        q = q.where(EstadisticaDiaria.dia < _dia(hasta))
+    return int(db.session.execute(q).scalar() or 0)
+
+
+def serie_actividad(dias=DEFAULT_DIAS):
+    """Etiquetas y conteos diarios de mensajes y campañas de los últimos `dias` días.
+
+    Devuelve `(labels, mensajes, campañas)` alineados por día, con una sola
+    consulta sobre `daily_stats`.
+    """
+    fechas = dias_del_rango(dias)
+    labels = [d.strftime('%Y-%m-%d') for d in fechas]
+    rows = db.session.execute(
+        select(EstadisticaDiaria.dia, EstadisticaDiaria.tipo, func.sum(EstadisticaDiaria.total))
+        .where(EstadisticaDiaria.dia >= fechas[0].date(), EstadisticaDiaria.dia <= fechas[-1].date())
+        .group_by(EstadisticaDiaria.dia, EstadisticaDiaria.tipo)
+    ).all()
+    conteos = {(str(d), tipo): int(n or 0) for d, tipo, n in rows}
+    return (labels,
+            [conteos.get((l, TIPO_MENSAJE), 0) for l in labels],
+            [conteos.get((l, TIPO_CAMPAÑA), 0) for l in labels])
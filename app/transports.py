@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+"""
+Transportes de envío (correo / SMS) con APIs por lotes.
+
+Cada transporte recibe una lista de `Envio` y devuelve `{envio.id: error}` con
+los fallos; los envíos que no aparecen se consideran entregados. Los
+transportes mantienen su conexión abierta entre lotes (una por hilo de worker),
+así que el coste de conexión/autenticación se paga una vez y no por destinatario.
+
+El transporte de cada modalidad se elige con `DELIVERY_TRANSPORTS`, p. ej.:
+
+    DELIVERY_TRANSPORTS = {'correo': 'smtp', 'sms': 'smpp'}
+
+Sin configuración se usa `log` (sólo registra, como hasta ahora).
+"""
+import smtplib
+import socket
+import struct
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict, namedtuple
+from email.message import EmailMessage
+
+from flask import current_app
+
+from app.models import db, Mensaje, Campaña, EjecucionCampaña
+
+Envio = namedtuple('Envio', 'id destino asunto contenido')
+
+MODALIDAD_CORREO = 'correo'
+MODALIDAD_SMS = 'sms'
+
+
+def normalizar_modalidad(modalidad):
+    return MODALIDAD_SMS if (modalidad or '').strip().lower() == MODALIDAD_SMS else MODALIDAD_CORREO
+
+
+class Transporte(ABC):
+    # un transporte sin `enviar_lote` falla al crearlo, no en la primera entrega
+    nombre = None
+
+    @classmethod
+    def desde_config(cls, config):
+        return cls()
+
+    @abstractmethod
+    def enviar_lote(self, envios):
+        """Envía `envios` y devuelve `{envio.id: error}` con los que fallaron."""
+
+    def cerrar(self):
+        pass
+
+
+class TransporteLog(Transporte):
+    """Sin integración real: registra cada envío en el log."""
+    nombre = 'log'
+
+    def enviar_lote(self, envios):
+        for e in envios:
+            current_app.logger.info(f"📨 Enviando '{e.asunto}' a {e.destino}")
+        return {}
+
+
+class TransporteMemoria(Transporte):
+    """Transporte falso para pruebas: guarda los envíos en `TransporteMemoria.enviados`.
+
+    Los destinos incluidos en `TransporteMemoria.fallar` devuelven error.
+    """
+    nombre = 'memoria'
+    enviados = []
+    fallar = set()
+    _lock = threading.Lock()
+
+    def enviar_lote(self, envios):
+        errores = {}
+        with self._lock:
+            for e in envios:
+                if e.destino in self.fallar:
+                    errores[e.id] = 'destino rechazado (memoria)'
+                else:
+                    self.enviados.append(e)
+        return errores
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.enviados.clear()
+            cls.fallar.clear()
+
+
+class SMTPTransporte(Transporte):
+    """SMTP con conexión persistente.
+
+    Los envíos de un lote con el mismo asunto/contenido se agrupan en un solo
+    MAIL FROM / DATA con hasta `rcpt_por_mensaje` RCPT TO, y la conexión se
+    reutiliza entre lotes (se reconecta si el servidor la cierra).
+    """
+    nombre = 'smtp'
+
+    def __init__(self, host='localhost', port=25, usuario=None, password=None, starttls=False,
+                 remitente='no-reply@localhost', timeout=30, rcpt_por_mensaje=50):
+        self.host = host
+        self.port = port
+        self.usuario = usuario
+        self.password = password
+        self.starttls = starttls
+        self.remitente = remitente
+        self.timeout = timeout
+        self.rcpt_por_mensaje = max(1, rcpt_por_mensaje)
+        self._smtp = None
+
+    @classmethod
+    def desde_config(cls, config):
+        return cls(host=config.get('SMTP_HOST', 'localhost'), port=config.get('SMTP_PORT', 25),
+                   usuario=config.get('SMTP_USER'), password=config.get('SMTP_PASSWORD'),
+                   starttls=config.get('SMTP_STARTTLS', False),
+                   remitente=config.get('SMTP_FROM', 'no-reply@localhost'),
+                   timeout=config.get('SMTP_TIMEOUT', 30),
+                   rcpt_por_mensaje=config.get('SMTP_RCPT_POR_MENSAJE', 50))
+
+    def _conexion(self):
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.usuario:
+                smtp.login(self.usuario, self.password or '')
+            self._smtp = smtp
+        return self._smtp
+
+    def _enviar(self, asunto, contenido, destinos):
+        msg = EmailMessage()
+        msg['From'] = self.remitente
+        msg['To'] = 'undisclosed-recipients:;'
+        msg['Subject'] = asunto or ''
+        msg.set_content(contenido or '')
+        return self._conexion().send_message(msg, from_addr=self.remitente, to_addrs=destinos)
+
+    def enviar_lote(self, envios):
+        errores = {}
+        grupos = defaultdict(list)
+        for e in envios:
+            grupos[(e.asunto, e.contenido)].append(e)
+
+        for (asunto, contenido), items in grupos.items():
+            for i in range(0, len(items), self.rcpt_por_mensaje):
+                chunk = items[i:i + self.rcpt_por_mensaje]
+                destinos = [e.destino for e in chunk]
+                for intento in range(2):
+                    try:
+                        rechazados = self._enviar(asunto, contenido, destinos)
+                        for e in chunk:
+                            if e.destino in rechazados:
+                                code, resp = rechazados[e.destino]
+                                errores[e.id] = 'SMTP %s %s' % (code, _texto(resp))
+                        break
+                    except smtplib.SMTPRecipientsRefused as ex:
+                        for e in chunk:
+                            code, resp = ex.recipients.get(e.destino, ('', b'rechazado'))
+                            errores[e.id] = 'SMTP %s %s' % (code, _texto(resp))
+                        break
+                    except smtplib.SMTPServerDisconnected as ex:
+                        # conexión caída: reconectar una vez y reintentar el chunk
+                        self.cerrar()
+                        if intento:
+                            for e in chunk:
+                                errores[e.id] = 'SMTP desconectado: %s' % ex
+                    except smtplib.SMTPResponseException as ex:
+                        # respuesta de error del servidor (p. ej. 554 al DATA): la conexión
+                        # sigue viva; RSET y sin reintento
+                        self._reset()
+                        for e in chunk:
+                            errores[e.id] = 'SMTP %s %s' % (ex.smtp_code, _texto(ex.smtp_error))
+                        break
+                    except smtplib.SMTPException as ex:
+                        self._reset()
+                        for e in chunk:
+                            errores[e.id] = 'SMTP %s' % ex
+                        break
+                    except OSError as ex:
+                        # fallo del socket (SMTPException también es OSError: va antes)
+                        self.cerrar()
+                        if intento:
+                            for e in chunk:
+                                errores[e.id] = 'SMTP desconectado: %s' % ex
+        return errores
+
+    def _reset(self):
+        try:
+            if self._smtp is not None:
+                self._smtp.rset()
+        except Exception:
+            self.cerrar()
+
+    def cerrar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                try:
+                    self._smtp.close()
+                except Exception:
+                    pass
+            self._smtp = None
+
+
+def _texto(valor):
+    return valor.decode('utf-8', 'replace') if isinstance(valor, bytes) else str(valor)
+
+
+# --- SMPP 3.4 (subconjunto mínimo para submit) ---
+SMPP_GENERIC_NACK = 0x80000000
+SMPP_BIND_TRANSMITTER = 0x00000002
+SMPP_BIND_TRANSMITTER_RESP = 0x80000002
+SMPP_SUBMIT_SM = 0x00000004
+SMPP_SUBMIT_SM_RESP = 0x80000004
+SMPP_UNBIND = 0x00000006
+SMPP_UNBIND_RESP = 0x80000006
+SMPP_ENQUIRE_LINK = 0x00000015
+SMPP_ENQUIRE_LINK_RESP = 0x80000015
+SMPP_TLV_MESSAGE_PAYLOAD = 0x0424
+
+
+def smpp_pdu(command_id, seq, body=b'', status=0):
+    return struct.pack('>IIII', 16 + len(body), command_id, status, seq) + body
+
+
+def smpp_cstr(value):
+    return (value or '').encode('ascii', 'ignore') + b'\x00'
+
+
+def smpp_leer_pdu(sock):
+    """Lee una PDU completa del socket: devuelve (command_id, status, seq, body)."""
+    cabecera = _leer_exacto(sock, 16)
+    length, command_id, status, seq = struct.unpack('>IIII', cabecera)
+    body = _leer_exacto(sock, length - 16) if length > 16 else b''
+    return command_id, status, seq, body
+
+
+def _leer_exacto(sock, n):
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError('conexión SMPP cerrada')
+        buf += chunk
+    return buf
+
+
+class SMPPTransporte(Transporte):
+    """SMPP (bind_transmitter + submit_sm) con ventana deslizante.
+
+    Se envían hasta `ventana` submit_sm sin esperar respuesta; cada submit_sm_resp
+    libera un hueco y se empareja con su envío por número de secuencia.
+    """
+    nombre = 'smpp'
+
+    def __init__(self, host='localhost', port=2775, system_id='', password='', system_type='',
+                 source_addr='', ventana=10, timeout=30):
+        self.host = host
+        self.port = port
+        self.system_id = system_id
+        self.password = password
+        self.system_type = system_type
+        self.source_addr = source_addr
+        self.ventana = max(1, ventana)
+        self.timeout = timeout
+        self._sock = None
+        self._seq = 0
+
+    @classmethod
+    def desde_config(cls, config):
+        return cls(host=config.get('SMPP_HOST', 'localhost'), port=config.get('SMPP_PORT', 2775),
+                   system_id=config.get('SMPP_SYSTEM_ID', ''), password=config.get('SMPP_PASSWORD', ''),
+                   system_type=config.get('SMPP_SYSTEM_TYPE', ''),
+                   source_addr=config.get('SMPP_SOURCE_ADDR', ''),
+                   ventana=config.get('SMPP_VENTANA', 10), timeout=config.get('SMPP_TIMEOUT', 30))
+
+    def _siguiente_seq(self):
+        self._seq = self._seq % 0x7FFFFFFF + 1
+        return self._seq
+
+    def _conexion(self):
+        if self._sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            body = (smpp_cstr(self.system_id) + smpp_cstr(self.password) + smpp_cstr(self.system_type)
+                    + bytes([0x34, 0, 0]) + smpp_cstr(''))
+            seq = self._siguiente_seq()
+            sock.sendall(smpp_pdu(SMPP_BIND_TRANSMITTER, seq, body))
+            command_id, status, _, _ = smpp_leer_pdu(sock)
+            if command_id != SMPP_BIND_TRANSMITTER_RESP or status != 0:
+                sock.close()
+                raise ConnectionError('bind SMPP rechazado (status %d)' % status)
+            self._sock = sock
+        return self._sock
+
+    def _submit_sm(self, envio):
+        texto = envio.contenido or ''
+        try:
+            datos, coding = texto.encode('latin-1'), 0x03
+        except UnicodeEncodeError:
+            datos, coding = texto.encode('utf-16-be'), 0x08
+        body = (smpp_cstr('') + bytes([0, 0]) + smpp_cstr(self.source_addr)
+                + bytes([1, 1]) + smpp_cstr(envio.destino)
+                + bytes([0, 0, 0]) + smpp_cstr('') + smpp_cstr('')
+                + bytes([0, 0, coding, 0]))
+        if len(datos) <= 254:
+            body += bytes([len(datos)]) + datos
+        else:
+            # textos largos: sm_length=0 y el contenido en el TLV message_payload
+            body += bytes([0]) + struct.pack('>HH', SMPP_TLV_MESSAGE_PAYLOAD, len(datos)) + datos
+        return body
+
+    def enviar_lote(self, envios):
+        errores = {}
+        pendientes = list(envios)
+        en_vuelo = {}
+        try:
+            sock = self._conexion()
+            while pendientes or en_vuelo:
+                while pendientes and len(en_vuelo) < self.ventana:
+                    envio = pendientes.pop(0)
+                    seq = self._siguiente_seq()
+                    sock.sendall(smpp_pdu(SMPP_SUBMIT_SM, seq, self._submit_sm(envio)))
+                    en_vuelo[seq] = envio
+                command_id, status, seq, _ = smpp_leer_pdu(sock)
+                if command_id == SMPP_ENQUIRE_LINK:
+                    sock.sendall(smpp_pdu(SMPP_ENQUIRE_LINK_RESP, seq))
+                    continue
+                envio = en_vuelo.pop(seq, None)
+                if envio is None:
+                    continue
+                if command_id == SMPP_GENERIC_NACK or status != 0:
+                    errores[envio.id] = 'SMPP status 0x%08X' % status
+        except (OSError, ConnectionError) as ex:
+            # conexión perdida: lo no confirmado vuelve a la cola con el error
+            for envio in list(en_vuelo.values()) + pendientes:
+                errores[envio.id] = 'SMPP desconectado: %s' % ex
+            self.cerrar()
+        return errores
+
+    def cerrar(self):
+        if self._sock is not None:
+            try:
+                self._sock.sendall(smpp_pdu(SMPP_UNBIND, self._siguiente_seq()))
+                smpp_leer_pdu(self._sock)
+            except Exception:
+                pass
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+
+TRANSPORTES = {cls.nombre: cls for cls in (TransporteLog, TransporteMemoria, SMTPTransporte, SMPPTransporte)}
+
+# Un juego de transportes (y por tanto de conexiones) por hilo de worker
+_local = threading.local()
+
+
+def obtener_transporte(modalidad):
+    """Transporte configurado para `modalidad`, reutilizado dentro del hilo actual."""
+    modalidad = normalizar_modalidad(modalidad)
+    nombre = (current_app.config.get('DELIVERY_TRANSPORTS') or {}).get(modalidad, 'log')
+    cache = getattr(_local, 'transportes', None)
+    if cache is None:
+        cache = _local.transportes = {}
+    transporte = cache.get(nombre)
+    if transporte is None:
+        cls = TRANSPORTES.get(nombre)
+        if cls is None:
+            raise ValueError('Transporte desconocido: %s' % nombre)
+        transporte = cache[nombre] = cls.desde_config(current_app.config)
+    return transporte
+
+
+def cerrar_transportes():
+    """Cierra las conexiones abiertas por el hilo actual."""
+    for transporte in (getattr(_local, 'transportes', None) or {}).values():
+        transporte.cerrar()
+    _local.transportes = {}
+
+
+def enviar_entregas(entregas):
+    """Función de envío de `app.outbox`: agrupa las entregas por modalidad y las
+    pasa al transporte correspondiente. Carga cada mensaje/campaña del lote una sola vez.
+    """
+    errores = {}
+    # (modalidad, asunto, contenido) por mensaje y por ejecución de campaña
+    ids = {e.mensaje_id for e in entregas if e.mensaje_id}
+    mensajes = {}
+    if ids:
+        for m in Mensaje.query.filter(Mensaje.id.in_(ids)).all():
+            mensajes[m.id] = (normalizar_modalidad(m.modalidad), m.asunto, m.contenido)
+    ids = {e.ejecucion_id for e in entregas if e.ejecucion_id}
+    ejecuciones = {}
+    if ids:
+        rows = (db.session.query(EjecucionCampaña.id, Campaña.name, Campaña.message)
+                .join(Campaña, Campaña.id == EjecucionCampaña.campaña_id)
+                .filter(EjecucionCampaña.id.in_(ids)).all())
+        # las campañas no tienen modalidad: se envían por correo
+        ejecuciones = {eid: (MODALIDAD_CORREO, nombre, texto) for eid, nombre, texto in rows}
+
+    por_modalidad = defaultdict(list)
+    for e in entregas:
+        datos = mensajes.get(e.mensaje_id) if e.mensaje_id else ejecuciones.get(e.ejecucion_id)
+        if datos is None:
+            errores[e.id] = 'mensaje o campaña eliminados'
+            continue
+        if not e.destino:
+            errores[e.id] = 'destinatario sin dirección'
+            continue
+        modalidad, asunto, contenido = datos
+        por_modalidad[modalidad].append(Envio(e.id, e.destino, asunto, contenido))
+
+    for modalidad, envios in por_modalidad.items():
+        try:
+            errores.update(obtener_transporte(modalidad).enviar_lote(envios))
+        except Exception as ex:
+            current_app.logger.exception('Error en transporte %s: %s', modalidad, ex)
+            for envio in envios:
+                errores[envio.id] = str(ex)
+    return errores
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Alta masiva de usuarios desde un fichero CSV o JSONL.
+
+El fichero se lee en streaming y se procesa por lotes de `lote` filas, cada
+lote en su propia transacción:
+
+1. se valida cada fila (`username`, `email`, `password` opcional, `role`);
+2. los `username` / `email` repetidos dentro del lote y los que ya existen en
+   la base de datos se descartan con una sola consulta `IN` por lote (sobre
+   los índices únicos); los repetidos entre lotes los detecta la consulta del
+   lote siguiente, porque el anterior ya está guardado;
+3. las contraseñas de las filas válidas se calculan en un pool de procesos;
+4. las filas se insertan con un INSERT (executemany) y se hace commit.
+
+Cada fila descartada queda en el informe con su número de línea y el motivo.
+Si el fichero no está en UTF-8 (p. ej. un CSV de Excel en cp1252), la
+importación se detiene en la primera línea que no se puede decodificar: lo
+anterior queda guardado y `Informe.detenido` explica dónde y por qué.
+Las filas sin contraseña crean cuentas sin acceso (el hash queda vacío) hasta
+que un administrador les asigne una.
+
+Lo usan `POST /admin/users/import` y `scripts/import_users.py`.
+"""
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select, insert, or_
+from sqlalchemy.exc import IntegrityError
+
+from app import passwords
+from app.models import db, Usuario
+
+FORMATOS = ('csv', 'jsonl')
+DEFAULT_LOTE = 1000
+# tope por lote: dos listas IN de `lote` valores, por debajo del límite de variables de SQLite
+MAX_LOTE = 5000
+# errores guardados en el informe (el recuento sigue aunque se llegue al tope)
+MAX_ERRORES = 1000
+ROLES = ('user', 'admin')
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class Informe:
+    """Resultado de una importación: contadores, errores por línea y ritmo."""
+
+    def __init__(self, max_errores=MAX_ERRORES):
+        self.filas = 0
+        self.creados = 0
+        self.duplicados = 0
+        self.invalidas = 0
+        self.errores = []
+        self.max_errores = max_errores
+        self.segundos = 0.0
+        # motivo si la importación se cortó antes del final del fichero
+        self.detenido = None
+
+    def error(self, linea, motivo, duplicado=False):
+        if duplicado:
+            self.duplicados += 1
+        else:
+            self.invalidas += 1
+        if self.max_errores is None or len(self.errores) < self.max_errores:
+            self.errores.append((linea, motivo))
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos else 0.0
+
+    def a_dict(self):
+        return {
+            'filas': self.filas,
+            'creados': self.creados,
+            'duplicados': self.duplicados,
+            'invalidas': self.invalidas,
+            'segundos': round(self.segundos, 2),
+            'detenido': self.detenido,
+            'filas_por_segundo': round(self.filas_por_segundo, 1),
+            'errores': [{'linea': linea, 'error': motivo} for linea, motivo in self.errores],
+        }
+
+
+def formato_de(nombre, por_defecto='csv'):
+    """'csv' o 'jsonl' según la extensión del fichero."""
+    ext = os.path.splitext(nombre or '')[1].lower().lstrip('.')
+    if ext in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if ext == 'csv':
+        return 'csv'
+    return por_defecto
+
+
+class NoEsUTF8(ValueError):
+    """El fichero tiene una línea que no es UTF-8 válido."""
+
+    def __init__(self, linea):
+        super().__init__('el fichero no está en UTF-8 (línea %d); guárdalo como CSV UTF-8' % linea)
+        self.linea = linea
+
+
+def _lineas(stream):
+    # se decodifica línea a línea para saber en cuál está el primer byte no válido
+    for n, crudo in enumerate(stream, 1):
+        try:
+            yield crudo.decode('utf-8-sig' if n == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise NoEsUTF8(n) from None
+
+
+def leer(stream, formato):
+    """Recorre un fichero binario y devuelve `(linea, fila)`; `fila` es un dict o el texto del error.
+
+    Lanza `NoEsUTF8` al llegar a una línea que no es UTF-8.
+    """
+    texto = _lineas(stream)
+    if formato == 'csv':
+        lector = csv.DictReader(texto)
+        for fila in lector:
+            yield lector.line_num, fila
+        return
+    for linea, contenido in enumerate(texto, 1):
+        if not contenido.strip():
+            continue
+        try:
+            fila = json.loads(contenido)
+        except ValueError:
+            yield linea, 'JSON no válido'
+            continue
+        yield linea, fila if isinstance(fila, dict) else 'se esperaba un objeto JSON'
+
+
+def validar(fila):
+    """Devuelve `(datos, None)` con los campos normalizados o `(None, motivo)`."""
+    f = {str(k).strip().lower(): v for k, v in fila.items() if k is not None}
+    username = str(f.get('username') or '').strip()
+    email = str(f.get('email') or '').strip()
+    password = f.get('password') or None
+    role = str(f.get('role') or 'user').strip().lower()
+    if not username:
+        return None, 'falta username'
+    if len(username) > 80:
+        return None, 'username de más de 80 caracteres'
+    if not email:
+        return None, 'falta email'
+    if len(email) > 120 or not _EMAIL.match(email):
+        return None, 'email no válido'
+    if password is not None:
+        password = str(password)
+        if not 8 <= len(password) <= 128:
+            return None, 'la contraseña debe tener entre 8 y 128 caracteres'
+    if role not in ROLES:
+        return None, 'rol no válido (user o admin)'
+    return {'username': username, 'email': email, 'password': password, 'role': role}, None
+
+
+def _existentes(filas):
+    # una consulta por lote sobre los índices únicos de username y email
+    nombres = [d['username'] for _, d in filas]
+    emails = [d['email'] for _, d in filas]
+    usados_n, usados_e = set(), set()
+    for username, email in db.session.execute(
+            select(Usuario.username, Usuario.email).where(or_(Usuario.username.in_(nombres), Usuario.email.in_(emails)))):
+        usados_n.add(username)
+        usados_e.add(email)
+    return usados_n, usados_e
+
+
+def _sin_duplicados(filas, informe):
+    # repetidos dentro del lote: se queda la primera aparición
+    vistos_n, vistos_e, unicas = set(), set(), []
+    for linea, d in filas:
+        if d['username'] in vistos_n or d['email'] in vistos_e:
+            informe.error(linea, 'username o email repetido en el fichero', duplicado=True)
+            continue
+        vistos_n.add(d['username'])
+        vistos_e.add(d['email'])
+        unicas.append((linea, d))
+    usados_n, usados_e = _existentes(unicas)
+    nuevas = []
+    for linea, d in unicas:
+        if d['username'] in usados_n or d['email'] in usados_e:
+            informe.error(linea, 'username o email ya existe', duplicado=True)
+        else:
+            nuevas.append((linea, d))
+    return nuevas
+
+
+def _hashes(ejecutor, claves, metodo):
+    if ejecutor is None:
+        return [passwords.generar_hash(pw, metodo) for pw in claves]
+    return list(ejecutor.map(passwords.generar_hash, claves, [metodo] * len(claves),
+                             chunksize=max(1, len(claves) // 32)))
+
+
+def _guardar(filas, ejecutor, metodo, informe):
+    nuevas = _sin_duplicados(filas, informe)
+    if not nuevas:
+        db.session.commit()
+        return
+    con_clave = [d['password'] for _, d in nuevas if d['password']]
+    hashes = iter(_hashes(ejecutor, con_clave, metodo))
+    valores = [{'username': d['username'], 'email': d['email'], 'role': d['role'],
+                'password_hash': next(hashes) if d['password'] else None} for _, d in nuevas]
+    try:
+        db.session.execute(insert(Usuario.__table__), valores)
+        db.session.commit()
+    except IntegrityError:
+        # otra petición dio de alta alguno de estos usuarios entre la comprobación y el INSERT:
+        # se repite la comprobación y se insertan los que siguen libres
+        db.session.rollback()
+        hashes = {v['username']: v['password_hash'] for v in valores}
+        nuevas = _sin_duplicados(nuevas, informe)
+        if nuevas:
+            db.session.execute(insert(Usuario.__table__), [
+                {'username': d['username'], 'email': d['email'], 'role': d['role'],
+                 'password_hash': hashes[d['username']]} for _, d in nuevas])
+        db.session.commit()
+    informe.creados += len(nuevas)
+
+
+def importar(stream, formato='csv', lote=DEFAULT_LOTE, workers=0, metodo=None,
+             max_errores=MAX_ERRORES, progreso=None):
+    """Importa los usuarios del fichero binario `stream` (necesita contexto de aplicación).
+
+    `workers` procesos calculan las contraseñas (0 = en el propio hilo) con
+    `metodo` (por defecto `PASSWORD_HASH_METHOD`). `progreso(informe)` se llama
+    tras el commit de cada lote. Devuelve un `Informe` (con `detenido` si el
+    fichero no es UTF-8).
+    """
+    if formato not in FORMATOS:
+        raise ValueError('formato no soportado: %s' % formato)
+    lote = max(1, min(int(lote), MAX_LOTE))
+    metodo = metodo or passwords.metodo_actual()
+    informe = Informe(max_errores)
+    t0 = time.monotonic()
+    ejecutor = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        pendientes = []
+        for linea, fila in leer(stream, formato):
+            informe.filas += 1
+            datos, motivo = validar(fila) if isinstance(fila, dict) else (None, fila)
+            if motivo:
+                informe.error(linea, motivo)
+                continue
+            pendientes.append((linea, datos))
+            if len(pendientes) >= lote:
+                _guardar(pendientes, ejecutor, metodo, informe)
+                pendientes = []
+                informe.segundos = time.monotonic() - t0
+                if progreso:
+                    progreso(informe)
+        if pendientes:
+            _guardar(pendientes, ejecutor, metodo, informe)
+    except NoEsUTF8 as e:
+        # se guarda lo leído hasta la línea anterior y se para: el resto no se puede interpretar
+        if pendientes:
+            _guardar(pendientes, ejecutor, metodo, informe)
+        informe.detenido = str(e)
+        informe.error(e.linea, str(e))
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if ejecutor is not None:
+            ejecutor.shutdown(cancel_futures=True)
+        informe.segundos = time.monotonic() - t0
+    # los duplicados se detectan al cerrar cada lote: errores en orden de línea
+    informe.errores.sort()
+    if progreso:
+        progreso(informe)
+    return informe
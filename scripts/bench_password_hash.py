@@ -0,0 +1,84 @@
+"""
+Microbenchmark de hash de contraseñas: logins por segundo y núcleo por método.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\bench_password_hash.py
+  python .\\scripts\\bench_password_hash.py --metodos scrypt:16384:8:1 pbkdf2:sha256:600000 --iteraciones 50
+  python .\\scripts\\bench_password_hash.py --objetivo 200   # núcleos necesarios para 200 logins/s
+
+Cada login verifica un hash (check_password_hash), así que logins/s por núcleo
+es 1 / tiempo de verificación. Con --procesos N se mide además el rendimiento
+real con N procesos en paralelo. El método elegido se configura en
+`PASSWORD_HASH_METHOD` (instance/config.py).
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from werkzeug.security import generate_password_hash, check_password_hash  # noqa: E402
+
+from app.passwords import DEFAULT_METODO  # noqa: E402
+
+METODOS = [DEFAULT_METODO, 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000']
+PASSWORD = 'contraseña-de-prueba'
+
+
+def _verificar(args):
+    password_hash, n = args
+    for _ in range(n):
+        check_password_hash(password_hash, PASSWORD)
+    return n
+
+
+def medir(metodo, iteraciones):
+    """Segundos por verificación en un solo núcleo (mediana de 3 rondas)."""
+    h = generate_password_hash(PASSWORD, method=metodo)
+    check_password_hash(h, PASSWORD)  # calentamiento
+    rondas = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        _verificar((h, iteraciones))
+        rondas.append((time.perf_counter() - t0) / iteraciones)
+    return sorted(rondas)[1], h
+
+
+def medir_paralelo(password_hash, procesos, iteraciones):
+    """Verificaciones por segundo con `procesos` procesos en paralelo."""
+    with multiprocessing.Pool(procesos) as pool:
+        pool.map(_verificar, [(password_hash, 1)] * procesos)  # arrancar los procesos
+        t0 = time.perf_counter()
+        total = sum(pool.map(_verificar, [(password_hash, iteraciones)] * procesos))
+        return total / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de hash de contraseñas')
+    parser.add_argument('--metodos', nargs='+', default=METODOS, help='métodos en formato Werkzeug')
+    parser.add_argument('--iteraciones', type=int, default=20, help='verificaciones por ronda')
+    parser.add_argument('--procesos', type=int, default=0, help='medir también con N procesos en paralelo')
+    parser.add_argument('--objetivo', type=float, default=0, help='logins/s a soportar: calcula núcleos necesarios')
+    args = parser.parse_args()
+
+    cabecera = '%-26s %10s %16s' % ('método', 'ms/login', 'logins/s/núcleo')
+    if args.procesos:
+        cabecera += ' %20s' % ('logins/s (%d proc)' % args.procesos)
+    if args.objetivo:
+        cabecera += ' %10s' % 'núcleos'
+    print(cabecera)
+    for metodo in args.metodos:
+        segundos, h = medir(metodo, args.iteraciones)
+        linea = '%-26s %10.2f %16.1f' % (metodo, segundos * 1000, 1 / segundos)
+        if args.procesos:
+            linea += ' %20.1f' % medir_paralelo(h, args.procesos, args.iteraciones)
+        if args.objetivo:
+            linea += ' %10d' % math.ceil(args.objetivo * segundos)
+        print(linea)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark de concurrencia en SQLite: lecturas por segundo mientras hay escrituras.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\bench_sqlite_concurrency.py
+  python .\\scripts\\bench_sqlite_concurrency.py --lectores 8 --escritores 2 --segundos 10
+  python .\\scripts\\bench_sqlite_concurrency.py --procesos 4       # como varios workers web y de envío
+  python .\\scripts\\bench_sqlite_concurrency.py --sin-perfil      # journal por defecto, para comparar
+
+Crea una base de datos temporal con el esquema de la aplicación y `--filas`
+mensajes, y durante `--segundos` lanza en cada uno de `--procesos` procesos
+hilos lectores (consultas indexadas como las de la bandeja: últimos mensajes y
+un mensaje por id) e hilos escritores (altas de mensajes con commit, como los
+envíos). Informa de lecturas/s, escrituras/s, latencia p50/p99 de lectura y
+errores "database is locked".
+
+Por defecto usa el perfil de `app/sqlite_profile.py` (WAL, busy_timeout...) y
+el pool de `SQLITE_POOL_SIZE`; con --sin-perfil usa los valores de SQLite.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, select, insert  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import sqlite_profile  # noqa: E402
+from app.models import db, Mensaje  # noqa: E402
+
+GRUPOS = 50
+
+
+def preparar(engine, filas):
+    db.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for i in range(0, filas, 10000):
+            conn.execute(insert(Mensaje.__table__), [
+                {'asunto': 'a%d' % j, 'contenido': 'x' * 200, 'modalidad': 'correo',
+                 'grupo_id': j % GRUPOS + 1, 'usuario_id': 1, 'fecha_envio': now}
+                for j in range(i, min(filas, i + 10000))
+            ])
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def ejecutar(engine, lectores, escritores, segundos, filas):
+    t = Mensaje.__table__
+    stop = threading.Event()
+    res = {'lecturas': 0, 'escrituras': 0, 'bloqueos': 0}
+    latencias = []
+    lock = threading.Lock()
+
+    def lector():
+        n, lat = 0, []
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(t.c.id, t.c.asunto, t.c.fecha_envio).order_by(t.c.id.desc()).limit(20)).all()
+                    conn.execute(select(t.c.contenido).where(t.c.id == random.randint(1, filas))).scalar()
+            except OperationalError:
+                with lock:
+                    res['bloqueos'] += 1
+                continue
+            lat.append(time.perf_counter() - t0)
+            n += 1
+        with lock:
+            res['lecturas'] += n
+            latencias.extend(lat)
+
+    def escritor():
+        n = 0
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(t), [{'asunto': 'nuevo', 'contenido': 'y' * 200, 'modalidad': 'correo',
+                                              'grupo_id': random.randint(1, GRUPOS), 'usuario_id': 1,
+                                              'fecha_envio': datetime.utcnow()}])
+                n += 1
+            except OperationalError:
+                with lock:
+                    res['bloqueos'] += 1
+        with lock:
+            res['escrituras'] += n
+
+    hilos = [threading.Thread(target=lector) for _ in range(lectores)]
+    hilos += [threading.Thread(target=escritor) for _ in range(escritores)]
+    for h in hilos:
+        h.start()
+    time.sleep(segundos)
+    stop.set()
+    for h in hilos:
+        h.join()
+    res['latencias'] = latencias
+    return res
+
+
+def crear_engine(uri, perfil, hilos):
+    if not perfil:
+        return create_engine(uri)
+    engine = create_engine(uri, **sqlite_profile.opciones_engine({'SQLITE_POOL_SIZE': hilos}))
+    sqlite_profile.aplicar_pragmas(engine)
+    return engine
+
+
+def _proceso(args):
+    uri, perfil, lectores, escritores, segundos, filas = args
+    engine = crear_engine(uri, perfil, lectores + escritores)
+    try:
+        return ejecutar(engine, lectores, escritores, segundos, filas)
+    finally:
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lecturas/s de SQLite con escrituras concurrentes')
+    parser.add_argument('--lectores', type=int, default=8)
+    parser.add_argument('--escritores', type=int, default=2)
+    parser.add_argument('--segundos', type=float, default=5.0)
+    parser.add_argument('--procesos', type=int, default=1, help='procesos, cada uno con sus lectores y escritores')
+    parser.add_argument('--filas', type=int, default=100000, help='mensajes iniciales')
+    parser.add_argument('--sin-perfil', action='store_true', help='sin pragmas ni pool del perfil de producción')
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix='bench_sqlite_')
+    uri = 'sqlite:///' + os.path.join(carpeta, 'bench.db')
+    try:
+        engine = crear_engine(uri, not args.sin_perfil, 1)
+        preparar(engine, args.filas)
+        with engine.connect() as conn:
+            modo = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+        engine.dispose()
+        print('journal_mode=%s, %d proceso(s) x (%d lectores, %d escritores), %.0f s' % (
+            modo, args.procesos, args.lectores, args.escritores, args.segundos))
+        tarea = (uri, not args.sin_perfil, args.lectores, args.escritores, args.segundos, args.filas)
+        if args.procesos > 1:
+            with multiprocessing.Pool(args.procesos) as pool:
+                resultados = pool.map(_proceso, [tarea] * args.procesos)
+        else:
+            resultados = [_proceso(tarea)]
+        latencias = [x for r in resultados for x in r['latencias']]
+        lecturas = sum(r['lecturas'] for r in resultados)
+        escrituras = sum(r['escrituras'] for r in resultados)
+        bloqueos = sum(r['bloqueos'] for r in resultados)
+        print('  lecturas/s:   %8.0f  (p50 %.2f ms, p99 %.2f ms)' % (
+            lecturas / args.segundos, percentil(latencias, 0.50) * 1000, percentil(latencias, 0.99) * 1000))
+        print('  escrituras/s: %8.0f' % (escrituras / args.segundos))
+        print('  "database is locked": %d' % bloqueos)
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
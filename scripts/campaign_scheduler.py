@@ -0,0 +1,42 @@
+"""
+Programador de campañas: dispara las campañas activas en su fecha programada.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\campaign_scheduler.py
+
+Las campañas disparadas se encolan en la tabla `entrega`; el envío real lo hacen
+los workers de `scripts/delivery_worker.py`. Se pueden ejecutar varias
+instancias: cada programación se dispara una sola vez.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from app.scheduler import ProgramadorCampañas  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Programador de campañas')
+    parser.add_argument('--intervalo', type=float, default=5.0, help='segundos máximos entre comprobaciones de cambios')
+    args = parser.parse_args()
+
+    app = create_app()
+    stop_event = threading.Event()
+
+    def _stop(*_):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    print('Programador de campañas iniciado. Ctrl+C para detener.')
+    ProgramadorCampañas(app).ejecutar(stop_event=stop_event, intervalo=args.intervalo)
+    print('Programador detenido.')
+
+
+if __name__ == '__main__':
+    main()
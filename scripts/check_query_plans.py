@@ -0,0 +1,193 @@
+"""
+Comprobación de planes de consulta: ninguna consulta de las rutas y tareas más
+usadas debe recorrer una tabla entera sin índice.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\check_query_plans.py
+  python .\\scripts\\check_query_plans.py -v     # muestra también el plan de cada sentencia
+
+Crea una base de datos temporal con el esquema de `app/models.py` y algunos
+datos, ejecuta cada caso dentro de `app.query_guard.sin_escaneos()` (que pasa
+cada sentencia por `EXPLAIN QUERY PLAN`) y termina con código 1 si algún caso
+recorre una tabla o un índice enteros, o un rango de índice abierto por un
+lado, en una sentencia sin LIMIT. Al añadir una ruta o consulta frecuente,
+añadir aquí su caso; `permitir` es sólo para recorridos completos deliberados
+(tablas de una fila, totales o listados completos por diseño).
+
+Después repite `/home` y `/notificaciones` con dos volúmenes de datos y
+comprueba que ejecutan exactamente las sentencias de `CONSULTAS` en ambos
+(si el número crece con las filas hay una consulta N+1).
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+CARPETA = tempfile.mkdtemp(prefix='check_plans_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(CARPETA, 'plans.db')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from app.models import db, Usuario, Grupo, Mensaje, Campaña  # noqa: E402
+from app import membership, campaign_groups, recipients, campaigns, outbox, feed, user_import  # noqa: E402
+from app.query_guard import sin_escaneos, contar_consultas  # noqa: E402
+
+# tablas de configuración de una sola fila
+CONFIG = ('settings', 'settings_version')
+# sentencias por petición: no deben cambiar con el número de filas (consultas N+1)
+CONSULTAS = {
+    '/home': 1,
+    '/notificaciones': 2,
+}
+
+
+def sembrar():
+    now = datetime.utcnow()
+    db.session.execute(db.insert(Usuario), [
+        {'username': 'user%03d' % i, 'email': 'user%03d@example.com' % i, 'role': 'user'} for i in range(200)])
+    grupos = [Grupo(nombre='grupo%d' % i) for i in range(5)]
+    db.session.add_all(grupos)
+    db.session.flush()
+    ids = list(db.session.execute(db.select(Usuario.id).where(Usuario.username.like('user%'))).scalars())
+    for i, g in enumerate(grupos):
+        membership.añadir(g.id, ids[i * 30:i * 30 + 80])
+    autor = ids[0]
+    for i in range(300):
+        db.session.add(Mensaje(asunto='m%d' % i, contenido='x', modalidad='correo', grupo_id=grupos[i % 5].id,
+                               usuario_id=autor, fecha_envio=now - timedelta(hours=i)))
+    for i in range(300):
+        c = Campaña(name='c%d' % i, message='x', priority=('alta', 'media', 'baja')[i % 3],
+                    active=bool(i % 2), date=now + timedelta(hours=i - 150))
+        db.session.add(c)
+        db.session.flush()
+        campaign_groups.establecer(c.id, [grupos[i % 5].id])
+    db.session.commit()
+    return grupos, ids
+
+
+def ampliar(grupos, ids, n=1000):
+    # más mensajes y campañas para repetir el recuento de sentencias con otro volumen
+    now = datetime.utcnow()
+    db.session.execute(db.insert(Mensaje.__table__), [
+        {'asunto': 'n%d' % i, 'contenido': 'x', 'modalidad': 'correo', 'grupo_id': grupos[i % 4].id,
+         'usuario_id': ids[i % len(ids)], 'fecha_envio': now - timedelta(minutes=i)} for i in range(n)])
+    db.session.execute(db.insert(Campaña.__table__), [
+        {'name': 'n%d' % i, 'message': 'x', 'priority': 'media', 'active': True,
+         'date': now - timedelta(minutes=i)} for i in range(n)])
+    db.session.commit()
+
+
+def comprobar_consultas(client, etiqueta):
+    fallos = 0
+    for url, esperadas in CONSULTAS.items():
+        try:
+            with contar_consultas() as contador:
+                resultado = client.get(url)
+            if resultado.status_code >= 400:
+                raise AssertionError('respuesta %d' % resultado.status_code)
+            if contador.total != esperadas:
+                detalle = '\n'.join('  %d. %s' % (i + 1, s.strip().splitlines()[0])
+                                     for i, s in enumerate(contador.sentencias))
+                raise AssertionError('Se esperaban %d sentencias y se ejecutaron %d:\n%s' % (
+                    esperadas, contador.total, detalle))
+            print('OK    GET %s con %s: %d sentencias' % (url, etiqueta, contador.total))
+        except AssertionError as e:
+            fallos += 1
+            print('FALLO GET %s con %s\n%s' % (url, etiqueta, e))
+        finally:
+            db.session.rollback()
+    return fallos
+
+
+def casos(client, grupos, ids):
+    g = grupos[0].id
+    mensaje = Mensaje.query.filter_by(grupo_id=g).order_by(Mensaje.id.desc()).first()
+    cursor_feed = feed.notificaciones(limite=10)[-1]['cursor']
+    _, cursor_campañas = campaigns.pagina({}, limite=10)
+    get = [
+        ('/home', ()),
+        ('/home/mensajes', ()),
+        ('/notificaciones', ()),
+        ('/notificaciones?cursor=%s' % cursor_feed, ()),
+        ('/notificaciones?from=2020-01-01&to=2030-01-01', ()),
+        # listado completo de grupos por diseño (pocos cientos de filas)
+        ('/grupos', ('grupo',)),
+        ('/redactar', ('grupo',)),
+        ('/usuarios/buscar?q=user01', ()),
+        ('/grupos/%d/miembros' % g, ()),
+        ('/grupos/%d/miembros?q=user0&after=user005' % g, ()),
+        # totales de usuarios, mensajes y grupos del panel por diseño
+        ('/admin/dashboard', ('usuario', 'mensaje', 'grupo')),
+        ('/admin/reports', ('usuario', 'grupo')),
+        # contadores de la cabecera (toda la tabla por diseño) y grupos del formulario
+        ('/admin/campaigns', ('campaña', 'grupo')),
+        ('/admin/campaigns?cursor=%s' % cursor_campañas, ('campaña', 'grupo')),
+        ('/admin/campaigns?estado=activas&prioridad=alta', ('campaña', 'grupo')),
+        ('/admin/campaigns?ventana=programadas', ('campaña', 'grupo')),
+    ]
+    for url, permitir in get:
+        yield 'GET ' + url, permitir, (lambda url=url: client.get(url))
+    yield 'POST /redactar', (), lambda: client.post(
+        '/redactar', data={'grupo': str(g), 'asunto': 'a', 'mensaje': 'b', 'modalidad': 'correo'})
+    yield 'POST /grupos/<id>/editar', (), lambda: client.post(
+        '/grupos/%d/editar' % g, data={'nombre': 'grupo0', 'agregar': [str(ids[150])], 'quitar': [str(ids[1])]})
+    yield 'POST /grupos/<id>/eliminar', (), lambda: client.post('/grupos/%d/eliminar' % grupos[4].id)
+    yield 'recipients.expandir', (), lambda: [lote for lote in recipients.expandir([g, grupos[1].id], 50)]
+    yield 'outbox.encolar_mensaje', (), lambda: outbox.encolar_mensaje(mensaje)
+    yield 'outbox.reclamar_lote', (), lambda: outbox.reclamar_lote('check', 10)
+    yield 'campaign_groups.campañas_de_grupo', (), lambda: campaign_groups.campañas_de_grupo(g)
+    csv_usuarios = 'username,email\n' + ''.join('imp%d,imp%d@example.com\n' % (i, i) for i in range(50)) + 'user001,x@example.com\n'
+    yield 'user_import.importar', (), lambda: user_import.importar(io.BytesIO(csv_usuarios.encode()), 'csv', lote=20)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EXPLAIN QUERY PLAN de las consultas frecuentes')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    fallos = 0
+    try:
+        with app.app_context():
+            grupos, ids = sembrar()
+            client = app.test_client()
+            with client.session_transaction() as s:
+                s['logged_in'] = True
+                s['username'] = 'admin'
+                s['role'] = 'admin'
+            for nombre, permitir, accion in casos(client, grupos, ids):
+                guardia = sin_escaneos(permitir=CONFIG + tuple(permitir))
+                try:
+                    with guardia:
+                        resultado = accion()
+                    status = getattr(resultado, 'status_code', None)
+                    if status is not None and status >= 400:
+                        raise AssertionError('respuesta %d' % status)
+                    print('OK    %s (%d sentencias)' % (nombre, len(guardia.sentencias)))
+                except AssertionError as e:
+                    fallos += 1
+                    print('FALLO %s\n%s' % (nombre, e))
+                finally:
+                    db.session.rollback()
+                if args.verbose:
+                    for engine, sentencia, parametros in guardia.sentencias:
+                        print('      %s' % ' '.join(sentencia.split())[:160])
+                        for linea in guardia.plan(engine, sentencia, parametros):
+                            print('        -> %s' % linea)
+            for ampliado in (False, True):
+                if ampliado:
+                    ampliar(grupos, ids)
+                filas = db.session.scalar(db.select(db.func.count()).select_from(Mensaje))
+                fallos += comprobar_consultas(client, '%d mensajes' % filas)
+    finally:
+        shutil.rmtree(CARPETA, ignore_errors=True)
+    print('%d caso(s) con fallos' % fallos if fallos else 'Sin recorridos completos ni consultas N+1.')
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Pool de workers de envío: procesa la cola persistente de entregas (`app.outbox`).
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\delivery_worker.py --workers 4
+
+Cada worker es un proceso independiente que reclama lotes con lease; se puede
+escalar arrancando más procesos (en la misma máquina o en otras que compartan
+la base de datos). El total de entregas en curso entre todos los workers nunca
+supera `Settings.max_concurrent` (ver `app.dispatcher`).
+Ctrl+C / SIGTERM detiene los workers al terminar el lote actual.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_worker(stop_event, batch_size, lease_seconds, threads):
+    # Cada proceso crea su propia app (y su propio engine/pool de conexiones)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app import create_app
+    from app import dispatcher
+
+    app = create_app()
+    if batch_size:
+        app.config['OUTBOX_BATCH_SIZE'] = batch_size
+    if lease_seconds:
+        app.config['OUTBOX_LEASE_SECONDS'] = lease_seconds
+    dispatcher.ejecutar(app, hilos=threads, stop_event=stop_event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Workers de la cola de envíos')
+    parser.add_argument('--workers', type=int, default=max(1, multiprocessing.cpu_count()))
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--lease-seconds', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=1, help='bucles de envío por proceso')
+    args = parser.parse_args()
+
+    stop_event = multiprocessing.Event()
+    procs = []
+    for _ in range(max(1, args.workers)):
+        p = multiprocessing.Process(target=run_worker, args=(stop_event, args.batch_size, args.lease_seconds, args.threads))
+        p.start()
+        procs.append(p)
+    print(f'{len(procs)} workers de envío iniciados. Ctrl+C para detener.')
+
+    def _stop(*_):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    for p in procs:
+        p.join()
+    print('Workers detenidos.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Servidores SMTP y SMPP falsos para desarrollo y pruebas locales.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\fake_transport_server.py --smtp-port 2525 --smpp-port 2775
+
+Aceptan todo lo que reciben y muestran un resumen por consola. Para usarlos,
+en `instance/config.py`:
+
+  DELIVERY_TRANSPORTS = {'correo': 'smtp', 'sms': 'smpp'}
+  SMTP_HOST, SMTP_PORT = 'localhost', 2525
+  SMPP_HOST, SMPP_PORT = 'localhost', 2775
+
+Los destinos que empiecen por `fail` se rechazan, para probar reintentos.
+"""
+import argparse
+import os
+import socketserver
+import struct
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.transports import (  # noqa: E402
+    smpp_pdu, smpp_leer_pdu, SMPP_BIND_TRANSMITTER, SMPP_BIND_TRANSMITTER_RESP, SMPP_SUBMIT_SM,
+    SMPP_SUBMIT_SM_RESP, SMPP_UNBIND, SMPP_UNBIND_RESP, SMPP_ENQUIRE_LINK, SMPP_ENQUIRE_LINK_RESP,
+    SMPP_GENERIC_NACK,
+)
+
+ESTADISTICAS = {'smtp_conexiones': 0, 'smtp_mensajes': 0, 'smtp_rcpt': 0,
+                'smpp_conexiones': 0, 'smpp_submit': 0}
+_lock = threading.Lock()
+
+
+def _contar(clave, n=1):
+    with _lock:
+        ESTADISTICAS[clave] += n
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def _resp(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        _contar('smtp_conexiones')
+        self._resp('220 fake-smtp ESMTP')
+        rcpts = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode('utf-8', 'replace').strip()
+            verbo = cmd[:4].upper()
+            if verbo in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-fake-smtp\r\n250 PIPELINING\r\n')
+            elif verbo == 'MAIL':
+                rcpts = []
+                self._resp('250 OK')
+            elif verbo == 'RCPT':
+                addr = cmd.split(':', 1)[1].strip().strip('<>')
+                if addr.lower().startswith('fail'):
+                    self._resp('550 rechazado')
+                else:
+                    rcpts.append(addr)
+                    self._resp('250 OK')
+            elif verbo == 'DATA':
+                self._resp('354 fin con <CRLF>.<CRLF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                _contar('smtp_mensajes')
+                _contar('smtp_rcpt', len(rcpts))
+                print(f'[smtp] mensaje para {len(rcpts)} destinatarios')
+                self._resp('250 OK')
+            elif verbo in ('RSET', 'NOOP'):
+                self._resp('250 OK')
+            elif verbo == 'QUIT':
+                self._resp('221 Bye')
+                return
+            else:
+                self._resp('502 no implementado')
+
+
+def _destino_submit_sm(body):
+    # service_type (C-string), ton, npi, source_addr (C-string), ton, npi, destination_addr
+    pos = body.index(b'\x00') + 1 + 2
+    pos = body.index(b'\x00', pos) + 1 + 2
+    return body[pos:body.index(b'\x00', pos)].decode('ascii', 'replace')
+
+
+class FakeSMPPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        _contar('smpp_conexiones')
+        sock = self.request
+        while True:
+            try:
+                command_id, _, seq, body = smpp_leer_pdu(sock)
+            except (ConnectionError, OSError, struct.error):
+                return
+            if command_id == SMPP_BIND_TRANSMITTER:
+                sock.sendall(smpp_pdu(SMPP_BIND_TRANSMITTER_RESP, seq, b'fake-smsc\x00'))
+            elif command_id == SMPP_SUBMIT_SM:
+                destino = _destino_submit_sm(body)
+                _contar('smpp_submit')
+                status = 0x0000000B if destino.lower().startswith('fail') else 0
+                sock.sendall(smpp_pdu(SMPP_SUBMIT_SM_RESP, seq, b'%d\x00' % seq, status=status))
+            elif command_id == SMPP_ENQUIRE_LINK:
+                sock.sendall(smpp_pdu(SMPP_ENQUIRE_LINK_RESP, seq))
+            elif command_id == SMPP_UNBIND:
+                sock.sendall(smpp_pdu(SMPP_UNBIND_RESP, seq))
+                return
+            else:
+                sock.sendall(smpp_pdu(SMPP_GENERIC_NACK, seq, status=0x00000003))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def iniciar(host='127.0.0.1', smtp_port=2525, smpp_port=2775):
+    """Arranca ambos servidores en hilos; devuelve la lista de servidores."""
+    servidores = [_Server((host, smtp_port), FakeSMTPHandler), _Server((host, smpp_port), FakeSMPPHandler)]
+    for srv in servidores:
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return servidores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidores SMTP/SMPP falsos')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--smtp-port', type=int, default=2525)
+    parser.add_argument('--smpp-port', type=int, default=2775)
+    args = parser.parse_args()
+    servidores = iniciar(args.host, args.smtp_port, args.smpp_port)
+    print(f'SMTP falso en {args.host}:{args.smtp_port}, SMPP falso en {args.host}:{args.smpp_port}. Ctrl+C para salir.')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for srv in servidores:
+            srv.shutdown()
+        print('Resumen:', ESTADISTICAS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Alta masiva de usuarios desde un fichero CSV o JSONL (ver `app/user_import.py`).
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\import_users.py abonados.csv
+  python .\\scripts\\import_users.py abonados.jsonl --lote 2000 --workers 8
+  python .\\scripts\\import_users.py abonados.csv --errores errores.csv
+
+El CSV lleva cabecera con las columnas `username`, `email` y, opcionales,
+`password` y `role` (user / admin); en JSONL, un objeto por línea con las
+mismas claves. Cada `--lote` filas se guardan en una transacción y se informa
+del ritmo; las contraseñas se calculan en `--workers` procesos (por defecto,
+uno por núcleo). Al terminar lista las filas descartadas con su línea y motivo
+(`--errores` las guarda todas en un CSV).
+"""
+import argparse
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from app import user_import  # noqa: E402
+
+# errores mostrados por pantalla (todos van a --errores)
+MOSTRAR_ERRORES = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alta masiva de usuarios desde CSV o JSONL')
+    parser.add_argument('fichero')
+    parser.add_argument('--formato', choices=user_import.FORMATOS, help='por defecto según la extensión')
+    parser.add_argument('--lote', type=int, default=user_import.DEFAULT_LOTE, help='filas por transacción')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='procesos para las contraseñas (0 = en este proceso)')
+    parser.add_argument('--errores', help='CSV donde guardar todas las filas descartadas')
+    args = parser.parse_args()
+
+    formato = args.formato or user_import.formato_de(args.fichero)
+
+    def progreso(informe):
+        print('  %d filas, %d creados, %d duplicados, %d no válidas (%.0f filas/s)' % (
+            informe.filas, informe.creados, informe.duplicados, informe.invalidas, informe.filas_por_segundo),
+            flush=True)
+
+    app = create_app()
+    with app.app_context(), open(args.fichero, 'rb') as f:
+        informe = user_import.importar(f, formato, lote=args.lote, workers=args.workers,
+                                       max_errores=None if args.errores else user_import.MAX_ERRORES,
+                                       progreso=progreso)
+    for linea, motivo in informe.errores[:MOSTRAR_ERRORES]:
+        print('línea %d: %s' % (linea, motivo))
+    descartadas = informe.duplicados + informe.invalidas
+    if descartadas > MOSTRAR_ERRORES:
+        print('... y %d filas descartadas más' % (descartadas - MOSTRAR_ERRORES))
+    if args.errores:
+        with open(args.errores, 'w', newline='', encoding='utf-8') as salida:
+            w = csv.writer(salida)
+            w.writerow(['linea', 'error'])
+            w.writerows(informe.errores)
+        print('Errores guardados en %s' % args.errores)
+    print('Usuarios creados: %d de %d filas en %.1f s (%.0f filas/s)' % (
+        informe.creados, informe.filas, informe.segundos, informe.filas_por_segundo))
+    if informe.detenido:
+        print('Importación detenida: %s' % informe.detenido)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Aplica a una base de datos SQLite existente las migraciones de esquema pendientes
+(ver `app/migrations.py`): columnas nuevas, índices y rellenos por tramos.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\migrate.py .\\instance\\app.db
+  python .\\scripts\\migrate.py .\\instance\\app.db --estado          # sólo lista aplicadas y pendientes
+  python .\\scripts\\migrate.py .\\instance\\app.db --backup D:\\backups\\app.db
+  python .\\scripts\\migrate.py .\\instance\\app.db --lote 5000 --pausa 0.1
+
+Antes de migrar hace un backup con la API de backup en línea de SQLite (por
+defecto `app.db.bak-<fecha>` junto a la base de datos; `--backup RUTA` para
+dejarlo en otro disco, `--sin-backup` para omitirlo). La aplicación puede
+seguir en marcha: los rellenos van por tramos de `--lote` filas con `--pausa`
+segundos entre tramos, y si el proceso se corta basta con volver a lanzarlo.
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from app import migrations  # noqa: E402
+
+DB_PATHS = [ROOT / 'app.db', ROOT / 'instance' / 'app.db', ROOT / 'database.db']
+
+
+def informar(texto):
+    # sin búfer: el progreso se ve aunque la salida vaya a un fichero o a un pipe
+    print(texto, flush=True)
+
+
+def find_db(arg=None):
+    if arg:
+        p = Path(arg)
+        return p if p.is_absolute() else Path.cwd() / p
+    for p in DB_PATHS:
+        if p.exists():
+            return p
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migraciones de esquema de SQLite')
+    parser.add_argument('db', nargs='?', help='fichero de la base de datos (por defecto app.db o instance/app.db)')
+    parser.add_argument('--estado', action='store_true', help='lista las migraciones sin aplicar nada')
+    parser.add_argument('--hasta', type=int, help='aplica sólo hasta esta versión (incluida)')
+    parser.add_argument('--lote', type=int, default=migrations.DEFAULT_LOTE, help='filas por tramo de relleno')
+    parser.add_argument('--pausa', type=float, default=migrations.DEFAULT_PAUSA, help='segundos entre tramos')
+    parser.add_argument('--backup', help='ruta del backup (por defecto junto a la base de datos)')
+    parser.add_argument('--sin-backup', action='store_true')
+    args = parser.parse_args()
+
+    dbfile = find_db(args.db)
+    if not dbfile or not dbfile.exists():
+        print('No se encontró la base de datos. Indica la ruta o colócala en la raíz o en instance/.')
+        sys.exit(1)
+    print(f'Usando archivo de BD: {dbfile}')
+
+    conn = migrations.conectar(dbfile)
+    try:
+        migrador = migrations.Migrador(conn, lote=args.lote, pausa=args.pausa, informar=informar)
+        pendientes = migrador.pendientes(args.hasta)
+        if args.estado:
+            aplicadas = migrador.aplicadas()
+            for version, descripcion, _ in migrations.MIGRACIONES:
+                print('%4d %-10s %s' % (version, 'aplicada' if version in aplicadas else 'pendiente', descripcion))
+            return
+        if not pendientes:
+            print('No hay migraciones pendientes.')
+            return
+        if not args.sin_backup:
+            destino = args.backup or '%s.bak-%s' % (dbfile, datetime.now().strftime('%Y%m%d%H%M%S'))
+            try:
+                print(f'Backup creado: {migrations.backup(conn, destino, informar=informar)}')
+            except Exception as e:
+                print(f'No se pudo crear el backup: {e}. Usa --backup RUTA o --sin-backup.')
+                sys.exit(1)
+        try:
+            hechas = migrador.aplicar(args.hasta)
+        except Exception as e:
+            print(f'Error en la migración {migrador.version}: {e}. Al relanzar el script continúa desde ahí.')
+            sys.exit(1)
+        print('Migraciones aplicadas: %s.' % ', '.join(str(v) for v in hechas))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
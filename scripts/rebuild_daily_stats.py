@@ -0,0 +1,38 @@
+"""
+Reconstruye el resumen diario `daily_stats` a partir de `mensaje` y `campaña`.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\rebuild_daily_stats.py              # todo el histórico
+  python .\\scripts\\rebuild_daily_stats.py --dias 90    # sólo los últimos 90 días
+
+El resumen se mantiene solo en cada alta, cambio o borrado hecho con el ORM;
+este script sirve para el relleno inicial o para corregirlo tras cambios hechos
+directamente en la base de datos.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from app import stats  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstruir daily_stats')
+    parser.add_argument('--dias', type=int, default=None, help='reconstruir sólo los últimos N días (por defecto, todo)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        desde = None
+        if args.dias:
+            desde = (datetime.utcnow() - timedelta(days=args.dias - 1)).date()
+        filas = stats.reconstruir(desde)
+    print('daily_stats reconstruido: %d filas%s' % (filas, (' desde %s' % desde) if desde else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Recalcula `Grupo.miembros_count` y `Grupo.mensajes_count` desde `user_grupo` y `mensaje`.
+
+Uso (desde la raíz del proyecto):
+  python .\\scripts\\reconcile_group_counters.py
+
+Los contadores se mantienen solos con cada alta, baja o mensaje hecho desde la
+aplicación; este script corrige la deriva tras cambios hechos directamente en
+la base de datos e informa de los grupos que estaban desajustados.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app  # noqa: E402
+from app import counters  # noqa: E402
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        desajustados = counters.reconciliar()
+    for grupo_id, m_antes, m, e_antes, e in desajustados:
+        print('grupo %d: miembros %d -> %d, mensajes %d -> %d' % (grupo_id, m_antes, m, e_antes, e))
+    print('Contadores reconciliados: %d grupos corregidos' % len(desajustados))
+
+
+if __name__ == '__main__':
+    main()